@@ -25,13 +25,12 @@ setup(
     packages=find_packages(where="src"),
     include_package_data=True,
     install_requires=[
-        "cartopy==0.19.0.post1",
+        "cartopy>=0.21.1",
         "Click",
         "gdal==3.0.4",
         "fiona",
         "geopandas",
         "geopy",
-        "joblib",
         "matplotlib",
         "netCDF4",
         "numpy",
@@ -43,7 +42,7 @@ setup(
         "rasterio",
         "scipy",
         "setuptools",
-        "shapely",
+        "shapely>=2",
         "tqdm",
         "xlrd",
     ],
@@ -4,6 +4,7 @@ import click
 import math
 import numpy as np
 import rasterio
+from rasterio.windows import Window
 
 R_MAJOR = 6378137.0000
 R_MINOR = 6356752.3142
@@ -31,14 +32,27 @@ def cell_area(lats, lons):
     return (np.diff(lons, 1) / 360.0).reshape(1, width) * slices
 
 
-def raster_cell_area(src, full=False):
-    left, bottom, right, top = src.bounds
-    lats = np.linspace(top, bottom, src.height + 1)
+def grid_cell_area(transform, shape, full=False):
+    """Returns the area (in m^2) of the cells of a regular lat/lon grid.
+
+    Every column of such a grid is identical so by default the result is
+    a (height, 1) array that broadcasts against (height, width) data.
+    With `full' the result is a read-only (height, width) view of the
+    same column (no memory is allocated); copy it to modify it.
+
+    """
+    height, width = shape[-2:]
+    lats = transform[5] + np.arange(height + 1) * transform[4]
+    column = cell_area(lats, np.array([0.0, abs(transform[0])]))
     if full:
-        lons = np.linspace(left, right, src.width + 1)
-    else:
-        lons = np.linspace(left, left + src.transform[0], 2)
-    return cell_area(lats, lons)
+        return np.broadcast_to(column, (height, width))
+    return column
+
+
+def raster_cell_area(src, full=False):
+    """Returns the area (in m^2) of the cells of a raster (see
+    grid_cell_area(); with `full' the result is read-only)."""
+    return grid_cell_area(src.transform, src.shape, full)
 
 
 # An easy way to generate the latitude/longitude indexes
@@ -56,14 +70,20 @@ def generate(source, output):
         meta.update(
             {
                 "driver": "GTiff",
+                "count": 1,
                 "dtype": "float32",
                 "nodata": -9999.0,
                 "compress": "lzw",
-                "predictpr": 3,
+                "predictor": 3,
             }
         )
+        area = raster_cell_area(src, full=True)
         with rasterio.open(output, "w", **meta) as dst:
-            dst.write(raster_cell_area(src).astype("float32"), indexes=1)
+            rows = dst.block_shapes[0][0]
+            for row in range(0, dst.height, rows):
+                window = Window(0, row, dst.width, min(rows, dst.height - row))
+                block = area[row:row + window.height].astype("float32")
+                dst.write(block, indexes=1, window=window)
 
 
 if __name__ == "__main__":
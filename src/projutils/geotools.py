@@ -1,4 +1,5 @@
 import math
+import numpy as np
 import osgeo.osr
 import types
 
@@ -124,6 +125,213 @@ class GeoLocation:
         ]
 
 
+def haversine(rad_lat1, rad_lon1, rad_lat2, rad_lon2, radius=GeoLocation.EARTH_RADIUS):
+    """
+    Great circle distance between points (in radians) using the haversine
+    formula.  Unlike the spherical law of cosines (used by
+    GeoLocation.distance_to) it does not lose precision for very small
+    distances.  Arguments are broadcast against each other.
+    """
+    a = (
+        np.sin((rad_lat2 - rad_lat1) / 2) ** 2
+        + np.cos(rad_lat1) * np.cos(rad_lat2) * np.sin((rad_lon2 - rad_lon1) / 2) ** 2
+    )
+    return 2 * radius * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def vincenty(rad_lat1, rad_lon1, rad_lat2, rad_lon2, radius=GeoLocation.EARTH_RADIUS):
+    """
+    Great circle distance between points (in radians) using the special
+    case of the Vincenty formula for a sphere.  It is accurate both for
+    very small distances and for (nearly) antipodal points where the
+    haversine formula degrades.  Arguments are broadcast against each
+    other.
+    """
+    dlon = rad_lon2 - rad_lon1
+    sin1, cos1 = np.sin(rad_lat1), np.cos(rad_lat1)
+    sin2, cos2 = np.sin(rad_lat2), np.cos(rad_lat2)
+    num = np.hypot(cos2 * np.sin(dlon), cos1 * sin2 - sin1 * cos2 * np.cos(dlon))
+    den = sin1 * sin2 + cos1 * cos2 * np.cos(dlon)
+    return radius * np.arctan2(num, den)
+
+
+def layer_coordinates(layer, x_field=None, y_field=None):
+    """
+    Read the FID and coordinates of every feature in a layer in one pass.
+
+    Coordinates come from the (point) geometry of each feature unless
+    the names of the fields that hold them are given.  Returns three
+    arrays (fids, xs, ys) sorted by FID.
+    """
+    fids = []
+    xs = []
+    ys = []
+    layer.ResetReading()
+    for feature in layer:
+        fids.append(feature.GetFID())
+        if x_field is None:
+            geom = feature.GetGeometryRef()
+            xs.append(geom.GetX())
+            ys.append(geom.GetY())
+        else:
+            xs.append(feature.GetFieldAsDouble(x_field))
+            ys.append(feature.GetFieldAsDouble(y_field))
+    layer.ResetReading()
+    fids = np.array(fids, dtype=np.int64)
+    order = np.argsort(fids, kind="stable")
+    return (
+        fids[order],
+        np.array(xs, dtype=float)[order],
+        np.array(ys, dtype=float)[order],
+    )
+
+
+class GeoLocations:
+    """
+    Array of coordinates on a sphere.
+
+    Vectorized companion of GeoLocation: latitudes and longitudes (in
+    radians) are stored in NumPy arrays so large sets of points can be
+    handled without creating a Python object per point.  Indexing (with
+    an integer array, mask or slice) returns a new GeoLocations.
+    """
+
+    EARTH_RADIUS = GeoLocation.EARTH_RADIUS
+
+    @classmethod
+    def from_degrees(cls, deg_lat, deg_lon):
+        return GeoLocations(np.radians(deg_lat), np.radians(deg_lon))
+
+    @classmethod
+    def from_radians(cls, rad_lat, rad_lon):
+        return GeoLocations(rad_lat, rad_lon)
+
+    @classmethod
+    def from_layer(cls, layer, lat_field=None, lon_field=None):
+        """
+        Read every location of a layer in bulk.  Coordinates come from the
+        (point) geometry of each feature unless the names of the latitude
+        and longitude fields are given.  Locations are sorted by FID and
+        the FIDs are stored in the fids attribute.
+        """
+        fids, lons, lats = layer_coordinates(layer, lon_field, lat_field)
+        locs = cls.from_degrees(lats, lons)
+        locs.fids = fids
+        return locs
+
+    def __init__(self, rad_lat, rad_lon, fids=None):
+        self.rad_lat, self.rad_lon = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(rad_lat, dtype=float)),
+            np.atleast_1d(np.asarray(rad_lon, dtype=float)),
+        )
+        self.fids = fids
+        self._check_bounds()
+
+    @property
+    def deg_lat(self):
+        return np.degrees(self.rad_lat)
+
+    @property
+    def deg_lon(self):
+        return np.degrees(self.rad_lon)
+
+    def __len__(self):
+        return len(self.rad_lat)
+
+    def __getitem__(self, idx):
+        if np.isscalar(idx):
+            return GeoLocation.from_radians(self.rad_lat[idx], self.rad_lon[idx])
+        fids = None if self.fids is None else self.fids[idx]
+        return GeoLocations(self.rad_lat[idx], self.rad_lon[idx], fids)
+
+    def __str__(self):
+        return "GeoLocations(%d points)" % len(self)
+
+    def _check_bounds(self):
+        # NaN (missing) coordinates are allowed and propagate to distances.
+        with np.errstate(invalid="ignore"):
+            if (
+                np.any(self.rad_lat < GeoLocation.MIN_LAT)
+                or np.any(self.rad_lat > GeoLocation.MAX_LAT)
+                or np.any(self.rad_lon < GeoLocation.MIN_LON)
+                or np.any(self.rad_lon > GeoLocation.MAX_LON)
+            ):
+                raise ValueError("Illegal arguments")
+
+    def distance_to(self, other, radius=EARTH_RADIUS, formula=haversine):
+        """
+        Computes the great circle distance between these locations and
+        other.  If other is a GeoLocation (or a GeoLocations with a single
+        point) the result is the distance from every location to it
+        (one-to-many); otherwise both must have the same length and the
+        distances are computed pair by pair.
+
+        Param:
+            formula  - haversine (default) or vincenty.
+        """
+        if isinstance(other, GeoLocations) and len(other) not in (1, len(self)):
+            raise ValueError("Illegal arguments")
+        return formula(self.rad_lat, self.rad_lon, other.rad_lat, other.rad_lon, radius)
+
+    def distance_matrix(self, other, radius=EARTH_RADIUS, formula=haversine):
+        """
+        Computes the great circle distance between every location and every
+        location in other.  Returns an array of shape (len(self),
+        len(other)).
+        """
+        return formula(
+            self.rad_lat[:, np.newaxis],
+            self.rad_lon[:, np.newaxis],
+            other.rad_lat[np.newaxis, :],
+            other.rad_lon[np.newaxis, :],
+            radius,
+        )
+
+    def bounding_locations(self, distance, radius=EARTH_RADIUS):
+        """
+        Vectorized version of GeoLocation.bounding_locations.  distance
+        can be a scalar or an array with one distance per location.
+
+        Returns a list of two GeoLocations - the SW corners and the NE
+        corners.  As with GeoLocation, the SW longitude is larger than the
+        NE longitude when a box crosses the 180th meridian.
+        """
+        distance = np.asarray(distance, dtype=float)
+        if radius < 0 or np.any(distance < 0):
+            raise ValueError("Illegal arguments")
+
+        # angular distance in radians on a great circle
+        rad_dist = np.broadcast_to(distance / radius, self.rad_lat.shape)
+
+        min_lat = self.rad_lat - rad_dist
+        max_lat = self.rad_lat + rad_dist
+        pole = (min_lat <= GeoLocation.MIN_LAT) | (max_lat >= GeoLocation.MAX_LAT)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta_lon = np.arcsin(
+                np.clip(np.sin(rad_dist) / np.cos(self.rad_lat), -1, 1)
+            )
+        min_lon = self.rad_lon - delta_lon
+        min_lon = np.where(
+            min_lon < GeoLocation.MIN_LON, min_lon + 2 * math.pi, min_lon
+        )
+        max_lon = self.rad_lon + delta_lon
+        max_lon = np.where(
+            max_lon > GeoLocation.MAX_LON, max_lon - 2 * math.pi, max_lon
+        )
+
+        # a pole is within the distance
+        min_lat = np.where(pole, np.maximum(min_lat, GeoLocation.MIN_LAT), min_lat)
+        max_lat = np.where(pole, np.minimum(max_lat, GeoLocation.MAX_LAT), max_lat)
+        min_lon = np.where(pole, GeoLocation.MIN_LON, min_lon)
+        max_lon = np.where(pole, GeoLocation.MAX_LON, max_lon)
+
+        return [
+            GeoLocations.from_radians(min_lat, min_lon),
+            GeoLocations.from_radians(max_lat, max_lon),
+        ]
+
+
 #
 # The osgeo.osr class is missing a few methods (which are available in
 # C/C++).  NOTE: the methods only work for WGS 84 (it should be simple
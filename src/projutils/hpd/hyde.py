@@ -1,3 +1,6 @@
+import zipfile
+
+import numpy as np
 import numpy.ma as ma
 from pylru import lrudecorator
 import rasterio
@@ -7,6 +10,10 @@ from .. import utils
 
 REFERENCE_YEAR = 2000
 
+# Number of header lines in an ESRI ASCII grid (ncols, nrows, xllcorner,
+# yllcorner, cellsize, NODATA_value).
+ASC_HEADER_LINES = 6
+
 
 class Hyde(object):
     def __init__(self, year):
@@ -40,7 +47,7 @@ def raster(year):
     return {
         "hpd": Raster(
             "netcdf:%s/luh2/hyde.nc:popd" % utils.outdir(),
-            bands=years().index(year),
+            bands=years().index(year) + 1,
             decode_times=False
         )
     }
@@ -63,3 +70,46 @@ def scale_grumps(year):
     )
     rasters["hpd"] = Hyde(year)
     return rasters
+
+
+def read_asc(fobj, dtype="f4"):
+    """Parse an ESRI ASCII grid from a (binary) file object.
+
+    The body of the grid is parsed in one go by numpy (much faster than
+    going through GDAL for a compressed archive member).  Returns the
+    header (a dictionary with lowercase keys) and a masked array where
+    cells equal to NODATA_value are masked.
+
+    """
+    header = {}
+    for _ in range(ASC_HEADER_LINES):
+        key, value = fobj.readline().split()
+        header[key.decode("ascii").lower()] = float(value)
+    nrows, ncols = int(header["nrows"]), int(header["ncols"])
+    data = np.fromstring(fobj.read().decode("ascii"), dtype=dtype, sep=" ")
+    if data.size != nrows * ncols:
+        raise RuntimeError(
+            "ASCII grid has %d cells (expected %d)" % (data.size, nrows * ncols)
+        )
+    data = data.reshape(nrows, ncols)
+    nodata = header.get("nodata_value")
+    if nodata is None:
+        return header, ma.array(data)
+    return header, ma.masked_equal(data, np.array(nodata, dtype=dtype), copy=False)
+
+
+def read_archive(version, year, variables=None):
+    """Read the ASCII grids of a HYDE year archive.
+
+    The zip file is opened once and every member decoded in turn.
+    Returns a dictionary that maps variable names to masked arrays.
+
+    """
+    if variables is None:
+        variables = utils.hyde_variables()
+    out = {}
+    with zipfile.ZipFile(utils.hyde_raw(version, year, None)) as archive:
+        for variable in variables:
+            with archive.open(utils.hyde_member(year, variable)) as fobj:
+                _, out[variable] = read_asc(fobj)
+    return out
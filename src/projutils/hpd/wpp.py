@@ -1,15 +1,27 @@
 #!/usr/bin/env python
 
-import tempfile
+import collections
+import hashlib
+import os
 
-from joblib import memory
 import numpy as np
+import numpy.ma as ma
 import pandas as pd
+from pylru import lrucache, lrudecorator
 
+from .. import utils
 
-MEMCACHE = memory.Memory(
-    cachedir=tempfile.mkdtemp(prefix="hpd-wpp"), verbose=0, mmap_mode="r"
-)
+# Growth (relative to the reference year) of every country for every
+# year of a trend.  years and codes index the rows and columns of growth
+# (a float32 year x country array).
+Table = collections.namedtuple("Table", ["years", "codes", "growth"])
+
+TABLE_PARTS = Table._fields
+
+# Code index (see code_index()) of the last few code rasters remapped.
+# The country raster is the same for every year so it is only indexed
+# once.
+CODE_INDEX = lrucache(4)
 
 
 class WPP(object):
@@ -17,8 +29,8 @@ class WPP(object):
         self._trend = "historical" if year < 2015 else trend
         self._year = year
         self._fname = fname
-        self._sheet = get_sheets(self._trend, fname)[0]
-        if year not in get_years(self.sheet):
+        self._table = load_table(self._trend, fname)
+        if year not in get_years(self.table):
             raise RuntimeError(
                 "year %d not available in trend %s projection" % (year, trend)
             )
@@ -33,8 +45,8 @@ class WPP(object):
         return self._trend
 
     @property
-    def sheet(self):
-        return self._sheet
+    def table(self):
+        return self._table
 
     @property
     def inputs(self):
@@ -42,8 +54,7 @@ class WPP(object):
 
     def eval(self, df):
         return project(
-            self.trend,
-            self.sheet,
+            self.table,
             df["un_code"],
             df["hpd_ref"],
             None,
@@ -52,22 +63,58 @@ class WPP(object):
         )
 
 
+def code_index(what):
+    """Returns the distinct codes in `what' and the index of the code of
+    every cell in that array (masked cells map to one past the last code).
+
+    Results are cached using a hash of the contents of the array.
+
+    """
+    data = np.ascontiguousarray(ma.getdata(what))
+    mask = ma.getmaskarray(what)
+    digest = hashlib.sha1(data).hexdigest()
+    if mask.any():
+        digest += hashlib.sha1(np.ascontiguousarray(mask)).hexdigest()
+    key = (digest, data.dtype.str, data.shape)
+    if key not in CODE_INDEX:
+        codes, index = np.unique(data, return_inverse=True)
+        index = index.reshape(data.shape)
+        index[mask] = len(codes)
+        CODE_INDEX[key] = (codes, index)
+    return CODE_INDEX[key]
+
+
 def remap(what, table, nomatch=None):
-    f = np.vectorize(lambda x: table[x] if x in table else nomatch, otypes=[np.float32])
-    shape = what.shape
-    tmp = f(what.flatten())
-    return tmp.reshape(*shape)
+    """Map every code in `what' to its value in `table' (a dictionary).
+
+    Codes not in the table (and masked cells) map to `nomatch'.  The
+    table is only consulted once per distinct code; cells are then
+    filled with a single gather.
+
+    """
+    if nomatch is None:
+        nomatch = np.nan
+    codes, index = code_index(what)
+    lut = np.empty(len(codes) + 1, dtype=np.float32)
+    lut[:-1] = [table.get(code, nomatch) for code in codes.tolist()]
+    lut[-1] = nomatch
+    return lut[index]
 
 
-def check_years(sheet, years):
+def check_years(table, years):
+    """Returns the years in `years' the table has no growth for.
+
+    Available years are those of the year header row (row 15 of the
+    sheet), the same row project() looks years up in.
+
+    """
     if years is None:
         return set()
-    available = set(sheet.iloc[14, 5:].astype(int).tolist())
+    available = set(get_years(table))
     yset = set(years)
     return yset - available
 
 
-@MEMCACHE.cache
 def get_sheets(trend, wpp):
     trend = "estimates" if trend == "historical" else trend
     xls = pd.ExcelFile(wpp)
@@ -76,35 +123,79 @@ def get_sheets(trend, wpp):
     else:
         assert trend.upper() in xls.sheet_names
         names = [trend.upper()]
+    names = list(names)
     sheets = [pd.read_excel(wpp, name) for name in names]
     for name, sheet in zip(names, sheets):
-        # FIXME: I store the name of the sheet (or tab) in cell (0, 0)
-        # becuase Memcache will not preserve metadata attributes.  Once
-        # this gets fixed in pandas, it would be cleaner to create an
-        # attribute (name) that stores the sheet name.
+        # Store the name of the sheet (or tab) in cell (0, 0).
         sheet.iloc[0, 0] = name.lower()
     return sheets
 
 
-def get_years(sheet):
-    return sheet.iloc[15, 5:].astype(int).tolist()
-
-
-def project(trend, sheet, countries, grumps, mask, year, nodata):
+def sheet_table(trend, sheet):
+    """Extract the growth table of a trend from its spreadsheet tab."""
     # Some of the cells representing the year are treated as strings and
-    # some as integers so check for both.
-    col = np.logical_or(sheet.iloc[15].isin([year]), sheet.iloc[15].isin([str(year)]))
-    if not np.any(col):
-        raise ValueError
-    ccode = sheet.iloc[16:, 4].astype(int).tolist()
-    hist = sheet.loc[16:, col]
+    # some as integers.
+    years = sheet.iloc[15, 5:].astype(int)
+    codes = sheet.iloc[16:, 4].astype(int).values
+    hist = sheet.iloc[16:, 5:]
     if trend == "historical":
         ref = sheet.loc[16:, u"Unnamed: 57"]
     else:
         ref = sheet.loc[16:, u"Unnamed: 5"]
-    pop = hist.divide(ref, axis="index").astype("float32").values
-
-    mydict = dict((v, pop[ii]) for ii, v in enumerate(ccode))
+    growth = hist.divide(ref, axis="index").astype("float32").values
+    return Table(
+        years.values.astype(np.int32),
+        codes.astype(np.int32),
+        np.ascontiguousarray(growth.T),
+    )
+
+
+@lrudecorator(10)
+def _file_digest(fname, mtime, size):
+    digest = hashlib.sha1()
+    with open(fname, "rb") as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def table_dir(trend, fname):
+    """Directory where the table of a trend is cached.  It is keyed by a
+    hash of the contents of the spreadsheet."""
+    st = os.stat(fname)
+    digest = _file_digest(os.path.abspath(fname), st.st_mtime, st.st_size)
+    return utils.cache_dir("wpp", digest, trend)
+
+
+def load_table(trend, fname):
+    """Returns the growth table of a trend.
+
+    The spreadsheet is only parsed the first time a trend is requested;
+    the table is then stored as .npy files in the cache directory (see
+    utils.cache_dir()) and memory mapped (read-only) so processes share
+    it.
+
+    """
+    path = table_dir(trend, fname)
+    names = [os.path.join(path, "%s.npy" % part) for part in TABLE_PARTS]
+    if not all(map(os.path.isfile, names)):
+        table = sheet_table(trend, get_sheets(trend, fname)[0])
+        for name, part in zip(names, table):
+            tmp = name + ".%d.npy" % os.getpid()
+            np.save(tmp, part)
+            os.replace(tmp, name)
+    return Table(*(np.load(name, mmap_mode="r") for name in names))
+
+
+def get_years(table):
+    return table.years.tolist()
+
+
+def project(table, countries, grumps, mask, year, nodata):
+    row = np.flatnonzero(table.years == year)
+    if len(row) == 0:
+        raise ValueError
+    mydict = dict(zip(table.codes.tolist(), table.growth[row[0]].tolist()))
     growth = remap(countries, mydict, nodata)
     unknown_mask = np.where(growth == nodata, True, False)
     if mask:
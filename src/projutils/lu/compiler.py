@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+"""Compile a table of land-use expressions into a single function.
+
+The LU tables (see rcp, luh2 and luh5) map every land use to an
+expression over input layers, e.g.
+
+  primary        -- gothr - gfvh1 - gfvh2
+  plantation_pri -- min(gothr, gfvh1 + gfvh2)
+
+Compiling the expressions one at a time evaluates shared terms (here
+gfvh1 + gfvh2) once per land use and allocates a full-grid temporary for
+every operation.  compile_table() instead builds one DAG for the whole
+table where identical sub-expressions are a single node and generates
+one function that computes every node once, with NumPy out= operations,
+into preallocated output and scratch buffers.
+
+Expressions are normalized so more terms are shared: chains of + and -
+are flattened (a - b - c is evaluated as a - (b + c)) and the operands of
++, max and min are sorted.  Results can therefore differ from evaluating
+each expression literally by floating point rounding.  max() and min()
+are element-wise (like R's pmax() and pmin()).
+
+"""
+
+import ast
+
+import numpy as np
+
+FUNCS = {"max": "np.maximum", "min": "np.minimum"}
+BINOPS = {ast.Mult: "np.multiply", ast.Div: "np.true_divide"}
+
+
+class _Dag(object):
+    """Hash-consed expression nodes.  A node is a tuple (op, args...)
+    where args are node ids (or a name / value for leaves)."""
+
+    def __init__(self):
+        self.nodes = []
+        self.ids = {}
+
+    def add(self, node):
+        if node not in self.ids:
+            self.ids[node] = len(self.nodes)
+            self.nodes.append(node)
+        return self.ids[node]
+
+    def sum(self, terms):
+        terms = tuple(sorted(terms))
+        if len(terms) == 1:
+            return terms[0]
+        return self.add(("sum",) + terms)
+
+    def visit(self, node):
+        if isinstance(node, ast.Expression):
+            return self.visit(node.body)
+        if isinstance(node, ast.Name):
+            return self.add(("input", node.id))
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return self.add(("const", node.value))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return self.add(("neg", self.visit(node.operand)))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.UAdd):
+            return self.visit(node.operand)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub)):
+            pos, neg = [], []
+            self.terms(node, pos, neg)
+            if not pos:
+                return self.add(("neg", self.sum(neg)))
+            if not neg:
+                return self.sum(pos)
+            return self.add(("sub", self.sum(pos), self.sum(neg)))
+        if isinstance(node, ast.BinOp) and type(node.op) in BINOPS:
+            return self.add(
+                (BINOPS[type(node.op)], self.visit(node.left), self.visit(node.right))
+            )
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id in FUNCS
+            and len(node.args) >= 2
+            and not node.keywords
+        ):
+            args = sorted(self.visit(arg) for arg in node.args)
+            ufunc = FUNCS[node.func.id]
+            res = args[0]
+            for arg in args[1:]:
+                res = self.add((ufunc, res, arg))
+            return res
+        raise ValueError("unsupported expression: '%s'" % ast.dump(node))
+
+    def terms(self, node, pos, neg, sign=1):
+        """Flatten a chain of + and - into positive and negative terms."""
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub)):
+            self.terms(node.left, pos, neg, sign)
+            right = sign if isinstance(node.op, ast.Add) else -sign
+            self.terms(node.right, pos, neg, right)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            self.terms(node.operand, pos, neg, -sign)
+        else:
+            (pos if sign > 0 else neg).append(self.visit(node))
+
+
+class CompiledTable(object):
+    """A function that evaluates every expression of a LU table.
+
+    Call it with a mapping (e.g. a DataFrame) from input name to array;
+    it returns a dictionary that maps land use to array.  Output arrays
+    can be passed in with `out' (a dictionary); otherwise they are
+    allocated.  Scratch buffers are kept between calls (for inputs of the
+    same shape and type) so evaluating a table allocates nothing else.
+
+    """
+
+    def __init__(self, table):
+        self.table = dict(table)
+        dag = _Dag()
+        roots = {}
+        for name, expr in self.table.items():
+            roots[name] = dag.visit(ast.parse(str(expr).strip(), mode="eval"))
+        self.outputs = list(self.table.keys())
+        self.inputs = sorted(n[1] for n in dag.nodes if n[0] == "input")
+        self.source, self.temps = _generate(dag, roots, self.outputs)
+        lokals = {}
+        exec(compile(self.source, "<lu table>", "exec"), {"np": np}, lokals)
+        self._func = lokals["evaluate"]
+        self._scratch = {}
+
+    def __call__(self, inputs, out=None, dtype=None):
+        arrays = [np.asarray(inputs[name]) for name in self.inputs]
+        if arrays:
+            shape = arrays[0].shape
+            if dtype is None:
+                dtype = np.result_type(*arrays)
+        else:
+            shape = (len(inputs),) if hasattr(inputs, "__len__") else ()
+            if dtype is None:
+                dtype = np.float64
+        if out is None:
+            out = {}
+        for name in self.outputs:
+            if name not in out:
+                out[name] = np.empty(shape, dtype=dtype)
+        key = (shape, np.dtype(dtype).str)
+        if key not in self._scratch:
+            self._scratch = {
+                key: [np.empty(shape, dtype=dtype) for _ in range(self.temps)]
+            }
+        self._func(arrays, [out[name] for name in self.outputs], self._scratch[key])
+        return out
+
+
+def _generate(dag, roots, outputs):
+    """Generate the source of evaluate(inp, out, tmp) for a DAG.  Returns
+    the source and the number of scratch buffers it needs.
+
+    Every node is computed once (in order of creation, which is a
+    topological order) into the buffer of the first output it is the
+    root of or into a scratch slot.  Scratch slots are reused once their
+    last reader has run.
+
+    """
+    inputs = sorted(n[1] for n in dag.nodes if n[0] == "input")
+    home = {}
+    for idx, name in enumerate(outputs):
+        home.setdefault(roots[name], "out[%d]" % idx)
+    # Last node that reads every node.
+    last_use = {}
+    for idx, node in enumerate(dag.nodes):
+        if node[0] not in ("input", "const"):
+            for arg in node[1:]:
+                last_use[arg] = idx
+
+    lines = ["def evaluate(inp, out, tmp):"]
+    where = {}
+    free, nslots = [], 0
+    for idx, node in enumerate(dag.nodes):
+        op = node[0]
+        if op == "input":
+            where[idx] = "inp[%d]" % inputs.index(node[1])
+            continue
+        if op == "const":
+            where[idx] = repr(node[1])
+            continue
+        if idx in home:
+            dst = home[idx]
+        elif idx in last_use:
+            if free:
+                slot = free.pop()
+            else:
+                slot, nslots = nslots, nslots + 1
+            dst = "tmp[%d]" % slot
+        else:
+            continue
+        args = [where[arg] for arg in node[1:]]
+        if op == "sum":
+            lines.append("    np.add(%s, %s, out=%s)" % (args[0], args[1], dst))
+            for arg in args[2:]:
+                lines.append("    np.add(%s, %s, out=%s)" % (dst, arg, dst))
+        elif op == "sub":
+            lines.append("    np.subtract(%s, %s, out=%s)" % (args[0], args[1], dst))
+        elif op == "neg":
+            lines.append("    np.negative(%s, out=%s)" % (args[0], dst))
+        else:
+            lines.append("    %s(%s, %s, out=%s)" % (op, args[0], args[1], dst))
+        where[idx] = dst
+        # Release the scratch slots of nodes this one was the last reader of.
+        for arg in set(node[1:]):
+            src = where.get(arg, "")
+            if last_use.get(arg) == idx and src.startswith("tmp[") and arg not in home:
+                free.append(int(src[4:-1]))
+    # Outputs that are an input, a constant or the root of another output.
+    for idx, name in enumerate(outputs):
+        root = roots[name]
+        dst = "out[%d]" % idx
+        if where.get(root) == dst:
+            continue
+        if dag.nodes[root][0] == "const":
+            lines.append("    out[%d].fill(%r)" % (idx, dag.nodes[root][1]))
+        else:
+            lines.append("    np.copyto(out[%d], %s)" % (idx, where[root]))
+    lines.append("    return")
+    return "\n".join(lines) + "\n", nslots
+
+
+_compiled = {}
+
+
+def compile_table(table):
+    """Compile a LU table (a dictionary of land use to expression).
+    Compiled tables are memoized."""
+    key = tuple(sorted((name, str(expr)) for name, expr in table.items()))
+    if key not in _compiled:
+        _compiled[key] = CompiledTable(table)
+    return _compiled[key]
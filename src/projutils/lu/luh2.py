@@ -1,6 +1,8 @@
 from r2py import reval as reval
 from r2py import rparser
 
+from . import compiler
+
 LU = {
     "annual": "c3ann + c4ann",
     "nitrogen": "c3nfx",
@@ -48,6 +50,14 @@ def func(lu):
     return funcs[lu]
 
 
+def compiled(what=None):
+    """Returns a function that evaluates the land uses in `what' (default:
+    all) at once (see compiler.compile_table())."""
+    if what is None:
+        what = types()
+    return compiler.compile_table(dict((lu, expr(lu)) for lu in what))
+
+
 def inputs(lu):
     if lu not in symbols:
         root = tree(lu)
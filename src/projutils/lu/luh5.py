@@ -1,3 +1,5 @@
+from . import compiler
+
 LU = {
     "primary": "primf + primn",
     "secondary": "secdf + secdn",
@@ -31,3 +33,9 @@ def types2(plus3=False):
     if plus3:
         return LUp3
     return LU
+
+
+def compiled(plus3=False):
+    """Returns a function that evaluates every land use at once (see
+    compiler.compile_table())."""
+    return compiler.compile_table(types2(plus3))
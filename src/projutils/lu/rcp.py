@@ -6,17 +6,16 @@ except ImportError:
     import gdal
 
 import click
-import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import os
-import numpy as np
 import pandas as pd
 import re
-import subprocess
-import sys
 import tarfile
-import tempfile
+import threading
 
+from . import compiler
 from .. import geotools
+from .. import raster_utils
 from .. import utils
 from .. import tiff_utils
 from r2py import reval as reval
@@ -77,6 +76,14 @@ def inputs(lu):
     return symbols[lu]
 
 
+def compiled(what=None):
+    """Returns a function that evaluates the land uses in `what' (default:
+    all) at once (see compiler.compile_table())."""
+    if what is None:
+        what = types()
+    return compiler.compile_table(dict((lu, expr(lu)) for lu in what))
+
+
 def all_files(hh):
     files = []
     for lu in hh:
@@ -84,8 +91,37 @@ def all_files(hh):
     return set(files)
 
 
-def extract(fileobj, outdir, years):
-    m = re.search(r"LUHa_u2(t1)?.v1(?:_([a-z]+).v\\d+(.\d+)?)?.tgz", fileobj.name)
+def translate(data, src_name, out_name):
+    """Convert an in-memory raster (bytes) to a Float32 LZW GeoTIFF.
+
+    The data is exposed to GDAL as a /vsimem/ file so no temporary file
+    or gdal_translate process is needed.
+
+    """
+    mem_name = "/vsimem/rcp-%d-%d/%s" % (
+        os.getpid(),
+        threading.get_ident(),
+        os.path.basename(src_name),
+    )
+    gdal.FileFromMemBuffer(mem_name, data)
+    try:
+        ds = gdal.Translate(
+            out_name,
+            mem_name,
+            format="GTiff",
+            outputType=gdal.GDT_Float32,
+            creationOptions=["COMPRESS=LZW", "PREDICTOR=3"],
+        )
+        if ds is None:
+            raise RuntimeError("error converting '%s'" % src_name)
+        ds = None
+    finally:
+        gdal.Unlink(mem_name)
+    return out_name
+
+
+def extract(fileobj, outdir, years, jobs=None):
+    m = re.search(r"LUHa_u2(t1)?.v1(?:_([a-z]+).v\d+(.\d+)?)?.tgz", fileobj.name)
     if m:
         scenario = m.group(2) if m.group(2) else "hyde"
         series = "1700" if m.group(1) else "1500"
@@ -96,80 +132,114 @@ def extract(fileobj, outdir, years):
     click.echo("Extracting RCP land use data [%s|%s]" % (scenario, series))
     allfiles = all_files(LU)
     regexp = re.compile(r"updated_states/(" + "|".join(allfiles) + r").\d{4}.txt$")
-    out_files = []
-    with tarfile.open(fileobj=fileobj) as tf:
-        members = tf.getmembers()
-        files = filter(lambda x: re.search(regexp, x.name), members)
 
-        with click.progressbar(files, length=len(files)) as bar:
-            for entry in bar:
-                if entry.type != tarfile.REGTYPE:
-                    continue
-                fileobj = tf.extractfile(entry)
-                dirn, name = os.path.split(entry.name)
-                base, suffix = os.path.splitext(name)
-                try:
-                    if years and int(base[-4:]) not in years:
-                        continue
-                except ValueError:
-                    # if the file name doesn't end in a year, skip it
+    def members(tf):
+        # Scan the archive once (as a stream) and read every matching
+        # member into memory; conversions happen in the pool.
+        for entry in tf:
+            if entry.type != tarfile.REGTYPE or not re.search(regexp, entry.name):
+                continue
+            dirn, name = os.path.split(entry.name)
+            base, suffix = os.path.splitext(name)
+            try:
+                if years and int(base[-4:]) not in years:
                     continue
-                # NOTE: this messing around with temp files and then calling
-                # gdal_translate is necessary because gdal doesn't provide a
-                # way to work with file-like objects.  Ideally instead of this
-                # mess I should be able to say
-                #  gdal.Open(file_like_obj)
-                # and have it read from that file descriptor.  But this doesn't
-                # work because gdal doesn (?) provide a way to create a dataset
-                # using a file descriptor.
-                tmpdir = os.path.join(outdir, scenario, dirn)
-                utils.mkpath(tmpdir)
-                temp = tempfile.NamedTemporaryFile(suffix=suffix)
-                while True:
-                    d = fileobj.read(1 << 16)
-                    if d:
-                        temp.write(d)
-                    else:
-                        break
-                temp.flush()
-                out_name = os.path.join(tmpdir, base + ".tif")
-                subprocess.check_output(
-                    [
-                        "gdal_translate",
-                        "-of",
-                        "GTiff",
-                        "-co",
-                        "COMPRESS=lzw",
-                        "-co",
-                        "PREDICTOR=3",
-                        "-ot",
-                        "Float32",
-                        temp.name,
-                        out_name,
-                    ]
-                )
+            except ValueError:
+                # if the file name doesn't end in a year, skip it
+                continue
+            out_dir = os.path.join(outdir, scenario, dirn)
+            utils.mkpath(out_dir)
+            data = tf.extractfile(entry).read()
+            yield data, entry.name, os.path.join(out_dir, base + ".tif")
+
+    def convert(item):
+        return translate(*item)
+
+    jobs = jobs or os.cpu_count()
+    out_files = []
+    size = os.fstat(fileobj.fileno()).st_size
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tf:
+        with ThreadPoolExecutor(jobs) as pool:
+            # Progress is measured in bytes of the (compressed) archive.
+            with click.progressbar(length=size) as bar:
+                pos = fileobj.tell()
+                for _, out_name in raster_utils.imap_ordered(
+                    pool, convert, members(tf), 2 * jobs
+                ):
+                    out_files.append(out_name)
+                    bar.update(fileobj.tell() - pos)
+                    pos = fileobj.tell()
     return out_files
 
 
-def project(lu, in_dir, year, mask):
+def load_year(in_dir, year, names, shape):
+    """Read the input layers of a year (each once) into a DataFrame with
+    one column per layer."""
     df = pd.DataFrame()
-    shape = mask.shape
-    for name in inputs(lu):
+    for name in sorted(names):
         fname = os.path.join(in_dir, "%s.%s.tif" % (name, year))
         ds = gdal.Open(fname)
         if ds is None:
-            print("error reading input raster '%s'" % fname)
-            sys.exit(1)
+            raise RuntimeError("error reading input raster '%s'" % fname)
         band = ds.GetRasterBand(1)
         array = band.ReadAsArray()
-        df[name] = array.reshape(-1)
         assert array.shape == shape
-    res = func(lu)(df).values.reshape(shape)
-    data = np.where(mask == 1, -9999, res)
-    return data
+        df[name] = array.reshape(-1)
+    return df
+
+
+def project_year(what, in_dir, year, mask):
+    """Project every land use in `what' for one year.
+
+    The inputs of all land uses are loaded once and shared.  Returns a
+    dictionary that maps land use to array.
+
+    """
+    shape = mask.shape
+    table = compiled(what)
+    df = load_year(in_dir, year, table.inputs, shape)
+    out = table(df)
+    for lu in what:
+        out[lu] = out[lu].reshape(shape)
+        out[lu][mask == 1] = -9999
+    return out
+
+
+def project(lu, in_dir, year, mask):
+    return project_year([lu], in_dir, year, mask)[lu]
+
+
+# Arguments shared by every year (set in each worker process).
+_worker = {}
+
+
+def _init_worker(what, in_dir, out_dir, mask, xsize, ysize, geotrans, geoproj):
+    _worker.update(
+        what=what,
+        in_dir=in_dir,
+        out_dir=out_dir,
+        mask=mask,
+        xsize=xsize,
+        ysize=ysize,
+        geotrans=geotrans,
+        geoproj=geoproj,
+    )
+
+
+def _process_year(year):
+    w = _worker
+    layers = project_year(w["what"], w["in_dir"], year, w["mask"])
+    for lu, data in layers.items():
+        # Write the data to a GeoTIFF file
+        oname = os.path.join(w["out_dir"], "%s_%d.tif" % (lu, year))
+        tiff_utils.from_array(
+            data, oname, w["xsize"], w["ysize"], trans=w["geotrans"],
+            proj=w["geoproj"]
+        )
+    return len(layers)
 
 
-def process(out_dir, years, maskf, what="all"):
+def process(out_dir, years, maskf, what="all", jobs=None):
     os.environ["GDAL_PAM_ENABLED"] = "NO"
     in_dir = os.path.join(out_dir, "updated_states")
 
@@ -186,17 +256,19 @@ def process(out_dir, years, maskf, what="all"):
     xsize = mask_ds.RasterXSize
     ysize = mask_ds.RasterYSize
     utils.mkpath(out_dir)
-    # Iterate through types x years
+    # Every year is projected (all land uses at once) by a worker process.
+    # At most two years per worker are in flight.
     what = types() if what == "all" else [what]
-    combos = itertools.product(what, years)
-    with click.progressbar(combos, length=len(years) * len(what)) as bar:
-        for lu, year in bar:
-            data = project(lu, in_dir, year, mask)
-            # 3 Write the data to a GeoTIFF file
-            oname = os.path.join(out_dir, "%s_%d.tif" % (lu, year))
-            tiff_utils.from_array(
-                data, oname, xsize, ysize, trans=geotrans, proj=geoproj
-            )
+    jobs = jobs or os.cpu_count()
+    initargs = (what, in_dir, out_dir, mask, xsize, ysize, geotrans, geoproj)
+    with ProcessPoolExecutor(
+        jobs, initializer=_init_worker, initargs=initargs
+    ) as pool:
+        with click.progressbar(length=len(years) * len(what)) as bar:
+            for _, count in raster_utils.imap_ordered(
+                pool, _process_year, years, 2 * jobs
+            ):
+                bar.update(count)
 
 
 def some_test_func():
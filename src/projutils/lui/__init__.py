@@ -1,5 +1,5 @@
+import collections
 import importlib
-import numpy as np
 import numpy.ma as ma
 import os
 import sys
@@ -8,12 +8,67 @@ from .rcp import RCP                                        # noqa F401
 from .luh2 import LUH2                                      # noqa F401
 from .luh5 import LUH5                                      # noqa F401
 from .onekm import OneKm                                    # noqa F401
+from .blocks import evaluate, finish, remainder             # noqa F401
 from .. import utils
 
 def intensities():
     return ('minimal', 'light', 'intense')
 
 
+class Intensities(object):
+    """Evaluate the intense, light and minimal models of a land use
+    together.
+
+    Wraps the three models of a land use (instances of one of the lui
+    classes, e.g. Intensities(LUH2, "pasture")) and evaluates them in
+    turn on the same inputs: the light model gets the intense output and
+    the minimal one both outputs straight from memory instead of as
+    separate layers, and computes the minimal intensity from them in a
+    single array (see remainder()).  eval() returns a dictionary that
+    maps intensity to array; use lui.evaluate() to fill three
+    (preallocated) outputs block by block.
+
+    Nothing else is shared.  The intense / total ratio is only used (and
+    computed, once) by the light model's finish().  The generated model
+    modules only export whole-model functions (intense() and light()),
+    so their common linear predictor cannot be shared without changing
+    the model compiler.
+
+    """
+
+    def __init__(self, cls, name, *args):
+        self._name = name
+        self._models = collections.OrderedDict(
+            (intensity, cls(name, intensity, *args))
+            for intensity in ("intense", "light", "minimal")
+        )
+        outputs = [model.name for model in self._models.values()]
+        inputs = []
+        for model in self._models.values():
+            inputs += [x for x in model.inputs if x not in outputs + inputs]
+        self._inputs = inputs
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def models(self):
+        return self._models
+
+    @property
+    def inputs(self):
+        return self._inputs
+
+    def eval(self, df):
+        out = {}
+        computed = {}
+        for intensity, model in self._models.items():
+            out[intensity] = model.eval(collections.ChainMap(computed, df))
+            computed[model.name] = out[intensity]
+        return out
+
+
 class LUI(object):
     def __init__(self, name, intensity, mod_name):
         self._name = name
@@ -83,14 +138,8 @@ class LUI(object):
 
     def eval(self, df):
         if self.is_minimal:
-            res = df[self._name] - df[self.as_intense] - df[self.as_light]
-            return res
+            return remainder(df[self._name], df[self.as_intense], df[self.as_light])
         res = self._pkg_func(**{self._mod_name: df[self._name],
                                 "hpd": df["hpd"], "unSub": df["unSub"]})
-        res[np.where(np.isnan(res))] = 1.0
-        res = np.clip(res, 0, 1)
-        if self.intensity == "light":
-            intense = df[self.as_intense] / (df[self._name] + 1e-10)
-            res = np.where(intense + res > 1, 1 - intense, res)
-        res *= df[self._name]
-        return res
+        intense = df[self.as_intense] if self.intensity == "light" else None
+        return finish(res, df[self._name], intense=intense)
@@ -0,0 +1,201 @@
+"""Evaluate land use intensity models in blocks of rows.
+
+The eval() method of the lui classes (RCP, LUH2, LUH5, OneKm and LUI)
+takes a mapping of full-map input layers and creates several full-size
+temporaries along the way.  evaluate() instead feeds a model blocks of
+rows of its inputs (views, nothing is copied), evaluates blocks
+concurrently (the generated model functions are plain NumPy) and writes
+every block into a single output array.  finish() implements the common
+tail of the eval() methods in place using per-thread scratch buffers
+that are reused between blocks, and remainder() the minimal intensity,
+so peak memory is proportional to the block size instead of the map
+size.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+import numpy as np
+import numpy.ma as ma
+
+from .. import raster_utils
+
+# Default number of rows per block.
+BLOCK_ROWS = 256
+
+_local = threading.local()
+
+
+def scratch(name, shape, dtype):
+    """Returns a scratch buffer.
+
+    Inside evaluate() buffers are kept per thread (keyed by name, shape
+    and type) and reused between blocks; otherwise a new array is
+    returned.
+
+    """
+    cache = getattr(_local, "scratch", None)
+    if cache is None:
+        return np.empty(shape, dtype=dtype)
+    key = (name, shape, np.dtype(dtype).str)
+    if key not in cache:
+        cache[key] = np.empty(shape, dtype=dtype)
+    return cache[key]
+
+
+def finish(res, total, ref=None, intense=None):
+    """Post-process the output of a model in place.
+
+    Computes
+
+      res = clip([ref +] where(isnan(res), 1, res), 0, 1)
+      if intense is given (light intensity):
+        ratio = intense / (total + 1e-10)
+        res = where(ratio + res > 1, 1 - ratio, res)
+      res *= total
+
+    `res' must be an array the caller owns; anything else (e.g. a pandas
+    Series, whose values are read-only under Copy-on-Write) is copied
+    first.  The result is masked wherever any of the inputs is masked.
+
+    """
+    if not isinstance(res, np.ndarray):
+        res = np.array(res, copy=True)
+    elif not res.flags.writeable:
+        res = res.copy()
+    data = ma.getdata(res)
+    mask = ma.getmask(res)
+    np.copyto(data, 1.0, where=np.isnan(data))
+    if ref is not None:
+        np.add(data, ma.getdata(ref), out=data)
+        mask = ma.mask_or(mask, ma.getmask(ref))
+    np.clip(data, 0, 1, out=data)
+    total_data = ma.getdata(total)
+    if intense is not None:
+        ratio = scratch("ratio", data.shape, data.dtype)
+        tmp = scratch("tmp", data.shape, data.dtype)
+        over = scratch("over", data.shape, bool)
+        np.add(total_data, 1e-10, out=ratio)
+        np.divide(ma.getdata(intense), ratio, out=ratio)
+        np.add(ratio, data, out=tmp)
+        np.greater(tmp, 1, out=over)
+        np.subtract(1, ratio, out=data, where=over)
+        mask = ma.mask_or(mask, ma.getmask(intense))
+    np.multiply(data, total_data, out=data)
+    mask = ma.mask_or(mask, ma.getmask(total))
+    if mask is ma.nomask:
+        return data
+    return ma.array(data, mask=np.array(mask, dtype=bool), copy=False)
+
+
+def remainder(total, intense, light):
+    """Returns total - intense - light (the minimal intensity) computed in
+    a single new array.  The result is masked wherever any of the inputs
+    is masked.
+
+    """
+    data = np.subtract(ma.getdata(total), ma.getdata(intense))
+    np.subtract(data, ma.getdata(light), out=data)
+    mask = ma.mask_or(ma.getmask(total), ma.getmask(intense))
+    mask = ma.mask_or(mask, ma.getmask(light))
+    if mask is ma.nomask:
+        return data
+    return ma.array(data, mask=np.array(mask, dtype=bool), copy=False)
+
+
+class RowBlock(object):
+    """A view of rows [start, stop) of a mapping of layers (e.g. a dict
+    of maps or a DataFrame).  Layers with `height' rows are sliced
+    (without copying); anything else (scalars, layers that broadcast) is
+    passed through."""
+
+    def __init__(self, df, start, stop, height):
+        self._df = df
+        self._start = start
+        self._stop = stop
+        self._height = height
+
+    def __getitem__(self, name):
+        value = self._df[name]
+        if getattr(value, "ndim", 0) >= 1 and value.shape[0] == self._height:
+            return getattr(value, "iloc", value)[self._start : self._stop]
+        return value
+
+    def __contains__(self, name):
+        return name in self._df
+
+    def values(self):
+        return [self[name] for name in self._df.keys()]
+
+
+def _eval_block(obj, df, height, rows, start):
+    if getattr(_local, "scratch", None) is None:
+        _local.scratch = {}
+    return obj.eval(RowBlock(df, start, min(start + rows, height), height))
+
+
+def _alloc(block, height):
+    shape = (height,) + np.shape(block)[1:]
+    if ma.isMaskedArray(block):
+        return ma.masked_all(shape, dtype=block.dtype)
+    return np.empty(shape, dtype=np.result_type(block))
+
+
+def _store(out, key, block, start, stop, height):
+    """Write a block into out[key] (allocating it if needed)."""
+    block = getattr(block, "values", block)
+    if out.get(key) is None:
+        out[key] = _alloc(block, height)
+    elif ma.isMaskedArray(block) and not ma.isMaskedArray(out[key]):
+        out[key] = ma.array(out[key], mask=np.zeros(out[key].shape, dtype=bool))
+    out[key][start:stop] = block
+
+
+def evaluate(obj, df, rows=BLOCK_ROWS, jobs=None, out=None):
+    """Evaluate a lui model (anything with an eval(df) method) in blocks.
+
+    Keyword Arguments:
+    obj  -- Model to evaluate
+    df   -- Mapping of input name to (height, width) array (or a
+            DataFrame of columns)
+    rows -- Number of rows per block
+    jobs -- Number of blocks to evaluate concurrently (default: one per
+            CPU)
+    out  -- Output array (default: allocated from the first block)
+
+    Returns the output (a masked array if any block is masked).  Models
+    whose eval() returns a dictionary of arrays (see lui.Intensities) get
+    a dictionary of outputs; `out' is then a dictionary too.
+
+    """
+    # Rows of the input with the most dimensions (1-D layers may be
+    # vectors that broadcast across the rows of 2-D maps).
+    height = max(
+        (df[name] for name in obj.inputs if getattr(df[name], "ndim", 0) >= 1),
+        key=lambda value: value.ndim,
+    ).shape[0]
+    jobs = jobs or os.cpu_count()
+    starts = range(0, height, rows)
+
+    def func(start):
+        return _eval_block(obj, df, height, rows, start)
+
+    outs = None
+    with ThreadPoolExecutor(jobs) as pool:
+        for start, block in raster_utils.imap_ordered(pool, func, starts, 2 * jobs):
+            stop = min(start + rows, height)
+            if outs is None:
+                if isinstance(block, dict):
+                    outs = dict(out or {})
+                else:
+                    outs = {None: out}
+            if isinstance(block, dict):
+                for key, value in block.items():
+                    _store(outs, key, value, start, stop, height)
+            else:
+                _store(outs, None, block, start, stop, height)
+    if outs is None or None not in outs:
+        return outs
+    return outs[None]
@@ -1,10 +1,10 @@
 from copy import copy
 import importlib
-import numpy as np
 import os
 import sys
 
 from .. import utils
+from .blocks import finish, remainder
 
 LUI_MODEL_MAP = {
     "annual": "cropland",
@@ -86,13 +86,6 @@ class LUH2(object):
 
     def eval(self, df):
         if self.intensity == "minimal":
-            res = df[self._name] - df[self.as_intense] - df[self.as_light]
-            return res
-        res = self._func(df)
-        res[np.where(np.isnan(res))] = 1.0
-        res = np.clip(df[self.name + "_ref"] + res, 0, 1)
-        if self.intensity == "light":
-            intense = df[self.as_intense] / (df[self._name] + 1e-10)
-            res = np.where(intense + res > 1, 1 - intense, res)
-        res *= df[self._name]
-        return res
+            return remainder(df[self._name], df[self.as_intense], df[self.as_light])
+        intense = df[self.as_intense] if self.intensity == "light" else None
+        return finish(self._func(df), df[self._name], df[self.name + "_ref"], intense)
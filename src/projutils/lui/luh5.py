@@ -5,6 +5,7 @@ import os
 import sys
 
 from .. import utils
+from .blocks import finish, remainder
 
 
 class LUH5(object):
@@ -79,13 +80,8 @@ class LUH5(object):
             return ma.where(df["secondary"] <= 0, 0,
                             df[self_name] * df[self._name] / (df["secondary"] + 1e-5))
         if self.intensity == "minimal":
-            res = df[self._name] - df[self.as_intense] - df[self.as_light]
-            return res
-        res = self._pkg_func(df)
-        res[np.where(np.isnan(res))] = 1.0
-        res = np.clip(df[f"{self.name}_ref"] + res, 0, 1)
-        if self.intensity == "light":
-            intense = df[self.as_intense] / (df[self._name] + 1e-10)
-            res = np.where(intense + res > 1, 1 - intense, res)
-        res *= df[self._name]
-        return res
+            return remainder(df[self._name], df[self.as_intense], df[self.as_light])
+        intense = df[self.as_intense] if self.intensity == "light" else None
+        return finish(
+            self._pkg_func(df), df[self._name], df[f"{self.name}_ref"], intense
+        )
@@ -1,10 +1,10 @@
 import importlib
-import numpy as np
 import numpy.ma as ma
 import os
 import sys
 
 from .. import utils
+from .blocks import finish, remainder
 
 
 class OneKm(object):
@@ -70,13 +70,6 @@ class OneKm(object):
                 / (df["secondary"] + 1e-5),
             )
         if self.intensity == "minimal":
-            res = df[self._name] - df[self.as_intense] - df[self.as_light]
-            return res
-        res = self._pkg_func(df)
-        res[np.where(np.isnan(res))] = 1.0
-        res = np.clip(res, 0, 1)
-        if self.intensity == "light":
-            intense = df[self.as_intense] / (df[self._name] + 1e-10)
-            res = np.where(intense + res > 1, 1 - intense, res)
-        res *= df[self._name]
-        return res
+            return remainder(df[self._name], df[self.as_intense], df[self.as_light])
+        intense = df[self.as_intense] if self.intensity == "light" else None
+        return finish(self._pkg_func(df), df[self._name], intense=intense)
@@ -4,6 +4,7 @@ import os
 import sys
 
 from .. import utils
+from .blocks import finish
 
 
 class RCP(object):
@@ -63,11 +64,9 @@ class RCP(object):
         if self.intensity == "minimal":
             res = 1 - df[self.as_intense] - df[self.as_light]
         else:
-            res = self._pkg_func(df)
-            res[np.where(np.isnan(res))] = 1.0
-            res = np.clip(df[self.name + "_ref"] + res, 0, 1)
-            if self.intensity == "light":
-                intense = df[self.as_intense] / (df[self._name] + 1e-10)
-                res = np.where(intense + res > 1, 1 - intense, res)
+            intense = df[self.as_intense] if self.intensity == "light" else None
+            return finish(
+                self._pkg_func(df), df[self._name], df[self.name + "_ref"], intense
+            )
         res *= df[self._name]
         return res
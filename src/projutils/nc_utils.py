@@ -0,0 +1,221 @@
+"""Helpers to write CF NetCDF files of (time, lat, lon) variables.
+
+All the gen_* scripts (and hyde2nc, secd-dist, tifftonc) write the same
+kind of file: a regular lat/lon grid, a time dimension, a crs variable
+and one or more compressed data variables.  init_nc() creates such a
+file with explicit chunking and compression settings and StepWriter
+writes it one time step at a time, buffering steps until it can write
+whole chunks.
+
+"""
+
+import time
+
+import numpy as np
+import numpy.ma as ma
+from osgeo import osr
+
+from . import geotools
+
+# Default chunk size (in cells) along each spatial axis.  Reading one
+# band of a variable (what GDAL does) touches whole chunks while keeping
+# single pixel time series reads reasonably cheap.
+CHUNK_SIZE = 512
+
+
+def lat_lon(transform, width, height):
+    """Returns the latitude and longitude of the center of every cell."""
+    ul = transform * (0.5, 0.5)
+    lr = transform * (width - 0.5, height - 0.5)
+    lats = np.linspace(ul[1], lr[1], height)
+    lons = np.linspace(ul[0], lr[0], width)
+    return lats, lons
+
+
+def chunk_shape(height, width, time_chunk=1, size=CHUNK_SIZE):
+    """Returns the (time, lat, lon) chunk shape for a grid."""
+    return (time_chunk, min(height, size), min(width, size))
+
+
+def init_nc(
+    dst_ds,
+    transform,
+    width,
+    height,
+    times,
+    variables,
+    time_units="years since 0000-01-01 00:00:00.0",
+    time_dtype="f8",
+    source=None,
+    unlimited=True,
+    dims=None,
+    chunks=None,
+    complevel=4,
+    shuffle=True,
+    least_significant_digit=4,
+    significant_digits=None,
+    spatial_ref=geotools.WGS84_WKT,
+):
+    """Initialize a CF NetCDF file and create its variables.
+
+    Keyword Arguments:
+    dst_ds      -- Dataset (opened for writing)
+    transform   -- Affine transform of the grid
+    width       -- Number of columns in the grid
+    height      -- Number of rows in the grid
+    times       -- Value of the time coordinate of every step
+    variables   -- Iterable of (name, dtype, units, fill) tuples.  An optional
+                   fifth element names the first dimension (default: time)
+                   and an optional sixth overrides least_significant_digit.
+    time_units  -- Units of the time coordinate
+    time_dtype  -- Type of the time coordinate
+    source      -- Name of the program that generated the file
+    unlimited   -- Whether the time dimension is unlimited
+    dims        -- Dictionary of extra dimensions (name -> size)
+    chunks      -- Chunk shape of data variables (default: chunk_shape())
+    complevel   -- zlib compression level (0 disables compression)
+    shuffle     -- Whether to use the HDF5 shuffle filter
+    least_significant_digit -- Quantization of data variables (None for
+                   lossless)
+    significant_digits -- Use netCDF quantization (netCDF4 >= 1.6) to keep
+                   this many significant digits instead
+    spatial_ref -- WKT of the grid CRS (default: WGS84)
+
+    Returns a dictionary that maps variable names to variables.
+
+    """
+    # Set attributes
+    dst_ds.setncattr("Conventions", "CF-1.5")
+    dst_ds.setncattr("GDAL", "GDAL 1.11.3, released 2015/09/16")
+
+    # Create dimensions
+    dst_ds.createDimension("time", None if unlimited else len(times))
+    dst_ds.createDimension("lat", height)
+    dst_ds.createDimension("lon", width)
+    for name, size in (dims or {}).items():
+        dst_ds.createDimension(name, size)
+
+    # Create variables
+    times_var = dst_ds.createVariable(
+        "time", time_dtype, ("time"), zlib=True, least_significant_digit=3
+    )
+    latitudes = dst_ds.createVariable(
+        "lat", "f4", ("lat"), zlib=True, least_significant_digit=3
+    )
+    longitudes = dst_ds.createVariable(
+        "lon", "f4", ("lon"), zlib=True, least_significant_digit=3
+    )
+    crs = dst_ds.createVariable("crs", "S1", ())
+
+    # Add metadata
+    dst_ds.history = "Created at " + time.ctime(time.time())
+    if source:
+        dst_ds.source = source
+    latitudes.units = "degrees_north"
+    latitudes.long_name = "latitude"
+    longitudes.units = "degrees_east"
+    longitudes.long_name = "longitude"
+    times_var.units = time_units
+    times_var.calendar = "gregorian"
+    times_var.standard_name = "time"
+    times_var.axis = "T"
+
+    # Assign data to variables
+    lats, lons = lat_lon(transform, width, height)
+    latitudes[:] = lats
+    longitudes[:] = lons
+    times_var[:] = times
+
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(spatial_ref)
+    crs.grid_mapping_name = "latitude_longitude"
+    crs.spatial_ref = srs.ExportToWkt()
+    crs.GeoTransform = " ".join(map(str, transform.to_gdal()))
+    crs.longitude_of_prime_meridian = geotools.srs_get_prime_meridian(srs)
+    crs.semi_major_axis = geotools.srs_get_semi_major(srs)
+    crs.inverse_flattening = geotools.srs_get_inv_flattening(srs)
+
+    if chunks is None:
+        chunks = chunk_shape(height, width)
+    out = {}
+    for spec in variables:
+        name, dtype, units, fill = spec[:4]
+        dimension = spec[4] if len(spec) > 4 else "time"
+        lsd = spec[5] if len(spec) > 5 else least_significant_digit
+        kwargs = {}
+        if significant_digits is not None:
+            kwargs["significant_digits"] = significant_digits
+        elif lsd is not None:
+            kwargs["least_significant_digit"] = lsd
+        dst_data = dst_ds.createVariable(
+            name,
+            dtype,
+            (dimension, "lat", "lon"),
+            zlib=complevel > 0,
+            complevel=complevel,
+            shuffle=shuffle,
+            chunksizes=chunks if dimension == "time" else (1,) + tuple(chunks[1:]),
+            fill_value=fill,
+            **kwargs,
+        )
+        dst_data.units = units
+        dst_data.grid_mapping = "crs"
+        out[name] = dst_data
+    return out
+
+
+class StepWriter(object):
+    """Write (time, lat, lon) variables one time step at a time.
+
+    Steps are buffered until a whole slab of chunks (along the time axis)
+    is complete so every chunk is compressed and written once.  With a
+    time chunk of 1 steps are written straight away.  Call flush() (or use
+    the writer as a context manager) once done.
+
+    """
+
+    def __init__(self, variables):
+        self.variables = variables
+        self.buffers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def write_step(self, var, t, array):
+        variable = self.variables[var]
+        step = variable.chunking()
+        step = 1 if step == "contiguous" else step[0]
+        if step == 1:
+            variable[t, :, :] = array
+            return
+        base = t - t % step
+        buf = self.buffers.get(var)
+        if buf is not None and buf[0] != base:
+            self.flush(var)
+            buf = None
+        if buf is None:
+            data = ma.masked_all((step,) + variable.shape[1:], dtype=variable.dtype)
+            buf = self.buffers[var] = (base, data, set())
+        buf[1][t - base] = array
+        buf[2].add(t - base)
+        if len(buf[2]) == step:
+            self.flush(var)
+
+    def flush(self, var=None):
+        names = list(self.buffers.keys()) if var is None else [var]
+        for name in names:
+            buf = self.buffers.pop(name, None)
+            if buf is None:
+                continue
+            base, data, steps = buf
+            # Write each run of consecutive steps in one call.
+            steps = sorted(steps)
+            start = 0
+            for idx in range(1, len(steps) + 1):
+                if idx == len(steps) or steps[idx] != steps[idx - 1] + 1:
+                    first, last = steps[start], steps[idx - 1] + 1
+                    self.variables[name][base + first : base + last] = data[first:last]
+                    start = idx
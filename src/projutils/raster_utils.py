@@ -1,25 +1,143 @@
 #!/usr/bin/env python3
 
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+import functools
+import itertools
+import os
+import threading
+
 import numpy as np
 import numpy.ma as ma
 import rasterio
+from rasterio.windows import Window
+
+# Per-worker dataset handles.  Each worker (thread or process) opens its
+# own copy of the sources so GDAL handles are never shared.
+_worker = threading.local()
+
+# Number of windows below which map_blocks() processes blocks serially
+# (starting a pool costs more than it saves).
+SERIAL_WINDOWS = 8
+
+
+def _open_sources(paths, opened=None):
+    _worker.sources = [rasterio.open(path) for path in paths]
+    if opened is not None:
+        # Thread workers: record the handles so they can be closed once
+        # the pool is done.
+        opened.extend(_worker.sources)
+
+
+def _run_block(func, args, window):
+    return func(_worker.sources, window, *args)
+
+
+def imap_ordered(pool, func, items, in_flight):
+    """Submit func(item) to `pool' for every item keeping at most
+    `in_flight' tasks pending.  Yields (item, result) tuples in the same
+    order as `items'.
+
+    """
+    items = iter(items)
+    pending = collections.deque(
+        (item, pool.submit(func, item)) for item in itertools.islice(items, in_flight)
+    )
+    while pending:
+        item, future = pending.popleft()
+        result = future.result()
+        for nxt in itertools.islice(items, 1):
+            pending.append((nxt, pool.submit(func, nxt)))
+        yield item, result
+
+
+def block_windows(path, bidx=1):
+    """Return the list of block windows of band `bidx' of a raster."""
+    with rasterio.open(path) as src:
+        return [window for _, window in src.block_windows(bidx)]
+
+
+def row_windows(path, bidx=1):
+    """Return full-width windows that cover a raster one row of blocks at
+    a time.  Use these when the destination is a stripped (not tiled)
+    raster so every write covers whole strips.
+
+    """
+    with rasterio.open(path) as src:
+        height = src.block_shapes[bidx - 1][0]
+        return [
+            Window(0, row, src.width, min(height, src.height - row))
+            for row in range(0, src.height, height)
+        ]
+
+
+def map_blocks(func, paths, windows, args=(), jobs=None, threads=False):
+    """Apply a function to every window of a set of rasters.
+
+    `func' is called as func(sources, window, *args) where `sources' is a
+    list of open datasets (one per entry in `paths').  Blocks are
+    processed by a pool of `jobs' workers (default: one per CPU), each
+    with its own dataset handles.  Small inputs (fewer
+    than SERIAL_WINDOWS windows) are processed serially.  Use `threads'
+    to run a thread pool rather than a process pool; in that case `func'
+    must release the GIL to see any benefit (thread handles are closed
+    when the pool is done).  With a process pool `func' and `args' must
+    be picklable.
+
+    Yields (window, result) tuples in the same order as `windows' so the
+    caller can serialize writes to the destination.  At most 2 * jobs
+    blocks are in flight at any time.
+
+    """
+    windows = list(windows)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs == 1 or len(windows) < SERIAL_WINDOWS:
+        with contextlib.ExitStack() as stack:
+            sources = [stack.enter_context(rasterio.open(path)) for path in paths]
+            for window in windows:
+                yield window, func(sources, window, *args)
+        return
+
+    executor = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    opened = [] if threads else None
+    try:
+        with executor(
+            max_workers=jobs, initializer=_open_sources, initargs=(paths, opened)
+        ) as pool:
+            yield from imap_ordered(
+                pool, functools.partial(_run_block, func, args), windows, 2 * jobs
+            )
+    finally:
+        for src in opened or []:
+            src.close()
+
+
+def _clip_block(sources, window, a_min, a_max, mask):
+    src = sources[0]
+    data = src.read(masked=True, window=window)
+    if mask:
+        clipped = data
+        if a_max:
+            clipped = ma.masked_greater(clipped, a_max)
+        if a_min:
+            clipped = ma.masked_less(clipped, a_min)
+    else:
+        clipped = np.clip(data, a_min, a_max)
+    return clipped.filled(src.nodata)
 
 
-def clip(infile, outfile, a_min=None, a_max=None, mask=False):
+def clip(infile, outfile, a_min=None, a_max=None, mask=False, jobs=None):
     if a_min is None and a_max is None:
         print("Please specify min, max, or both")
         return
 
     with rasterio.open(infile) as src:
-        with rasterio.open(outfile, "w", **src.meta) as dst:
-            for _, window in src.block_windows(1):
-                data = src.read(masked=True, window=window)
-                if mask:
-                    clipped = data
-                    if a_max:
-                        clipped = ma.masked_greater(clipped, a_max)
-                    if a_min:
-                        clipped = ma.masked_less(clipped, a_min)
-                else:
-                    clipped = np.clip(data, a_min, a_max)
-                dst.write(clipped.filled(src.nodata), window=window)
+        meta = src.meta
+        windows = [window for _, window in src.block_windows(1)]
+    with rasterio.open(outfile, "w", **meta) as dst:
+        for window, data in map_blocks(
+            _clip_block, [infile], windows, (a_min, a_max, mask), jobs
+        ):
+            dst.write(data, window=window)
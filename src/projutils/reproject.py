@@ -1,76 +1,29 @@
-import collections
+import collections.abc
+import os
+
 import numpy as np
 import numpy.ma as ma
 import rasterio
 import rasterio.warp as rwarp
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
 
 
-def reproject(filename, bidx, resolution, resampling):
-    """Returns the resampled Numpy array and the output metadata
+def _target(src, resolution):
+    """Compute the destination grid (at a new resolution) of a dataset.
 
-    Keyword Arguments:
-    filename   -- Input file
-    bidx       -- Raster band index (one-based indexing) (default 1)
-    resolution -- Multiplier to scale by
-    resampling -- Resampling method from rasterio.warp.Resampling enum
-
-    Nota Bene: Nodata value MUST be set or resampling on edges will be
-    incorrect!
+    Returns the CRS, transform, width and height of the destination and a
+    copy of the source metadata updated to match.
 
     """
-    with rasterio.open(filename) as src:
-        meta = src.meta.copy()
-        if not src.crs.is_valid:
-            crs = src.crs.from_string(u"epsg:4326")
-        else:
-            crs = src.crs
-        newaff, width, height = rwarp.calculate_default_transform(
-            crs, crs, src.width, src.height, *src.bounds, resolution=resolution
-        )
-        data = ma.empty((src.count, int(height), int(width)), dtype=meta["dtype"])
-        newarr = np.empty((int(height), int(width)), dtype=meta["dtype"])
-        meta.update(
-            {
-                "transform": newaff,
-                "width": int(width),
-                "height": int(height),
-                "nodata": src.nodata,
-            }
-        )
-
-        if bidx is None:
-            bidx = range(1, src.count + 1)
-        elif not isinstance(bidx, collections.Iterable):
-            bidx = [bidx]
-
-        for idx in bidx:
-            arr = src.read(idx, masked=True)
-            rwarp.reproject(
-                source=arr,
-                destination=newarr,
-                src_transform=src.transform,
-                dst_transform=newaff,
-                src_crs=src.crs,
-                dst_crs=crs,
-                src_nodata=src.nodatavals[idx - 1],
-                dst_nodata=src.nodatavals[idx - 1],
-                resampling=resampling,
-            )
-            data[idx - 1] = ma.masked_values(newarr, src.nodatavals[idx - 1])
-    return meta, data
-
-
-def reproject2(src, data, resolution, resampling):
     meta = src.meta.copy()
     if not src.crs.is_valid:
-        crs = src.crs.from_string(u"epsg:4326")
+        crs = src.crs.from_string("epsg:4326")
     else:
         crs = src.crs
     newaff, width, height = rwarp.calculate_default_transform(
         crs, crs, src.width, src.height, *src.bounds, resolution=resolution
     )
-    out = ma.empty((src.count, int(height), int(width)), dtype=meta["dtype"])
-    newarr = np.empty((int(height), int(width)), dtype=meta["dtype"])
     meta.update(
         {
             "transform": newaff,
@@ -79,18 +32,205 @@ def reproject2(src, data, resolution, resampling):
             "nodata": src.nodata,
         }
     )
+    return crs, newaff, int(width), int(height), meta
+
+
+def _nodata_key(nodata):
+    """Grouping key of a nodata value (NaN != NaN, so NaNs need a key of
+    their own)."""
+    if nodata is not None and np.isnan(nodata):
+        return "nan"
+    return nodata
+
+
+def _nodata_groups(nodatas):
+    """Indexes of the bands that share a nodata value, one list per value."""
+    groups = collections.OrderedDict()
+    for i, nd in enumerate(nodatas):
+        groups.setdefault(_nodata_key(nd), []).append(i)
+    return list(groups.values())
+
 
-    for idx in range(data.shape[0]):
+def _nodata_mask(arr, nodata):
+    """Mask of the cells of `arr' equal to `nodata' (close to it for floats,
+    as ma.masked_values())."""
+    if nodata is None:
+        return np.zeros(arr.shape, dtype=bool)
+    if _nodata_key(nodata) == "nan":
+        return np.isnan(arr)
+    return ma.getmaskarray(ma.masked_values(arr, nodata, copy=False, shrink=False))
+
+
+def _warp(
+    src, source, nodatas, crs, newaff, shape, resampling, num_threads, warp_mem_limit
+):
+    """Reproject a (bands, rows, cols) array.
+
+    All bands are warped in a single call so the source to destination
+    pixel mapping is computed once.  Bands with different nodata values
+    (rare) need one call per nodata value.
+
+    """
+    if num_threads is None:
+        num_threads = os.cpu_count()
+    out = np.empty((source.shape[0],) + shape, dtype=source.dtype)
+    for idx in _nodata_groups(nodatas):
+        nodata = nodatas[idx[0]]
+        if len(idx) == len(nodatas):
+            arr, dst = source, out
+        else:
+            arr, dst = source[idx], np.empty((len(idx),) + shape, dtype=out.dtype)
         rwarp.reproject(
-            source=data[idx],
-            destination=newarr,
+            source=arr,
+            destination=dst,
             src_transform=src.transform,
             dst_transform=newaff,
             src_crs=src.crs,
             dst_crs=crs,
-            src_nodata=src.nodatavals[idx],
-            dst_nodata=src.nodatavals[idx],
+            src_nodata=nodata,
+            dst_nodata=nodata,
             resampling=resampling,
+            num_threads=num_threads,
+            warp_mem_limit=warp_mem_limit,
         )
-        out[idx] = ma.masked_values(newarr, src.nodatavals[idx])
+        if dst is not out:
+            out[idx] = dst
+    mask = np.empty(out.shape, dtype=bool)
+    for i, nodata in enumerate(nodatas):
+        mask[i] = _nodata_mask(out[i], nodata)
+    return ma.array(out, mask=mask, copy=False)
+
+
+def reproject(
+    filename,
+    bidx,
+    resolution,
+    resampling,
+    num_threads=None,
+    warp_mem_limit=0,
+    chunk=4,
+):
+    """Returns the resampled Numpy array and the output metadata
+
+    Keyword Arguments:
+    filename   -- Input file
+    bidx       -- Raster band index (one-based indexing) (default 1)
+    resolution -- Multiplier to scale by
+    resampling -- Resampling method from rasterio.warp.Resampling enum
+    num_threads    -- Number of warp threads (default: one per CPU)
+    warp_mem_limit -- GDAL warp memory limit in MB (default: GDAL default)
+    chunk          -- Number of bands (with the same nodata value) read and
+                      warped together (default 4)
+
+    Only `chunk' bands of the source are in memory at a time; the output
+    is the only full (count, h, w) array.
+
+    Nota Bene: Nodata value MUST be set or resampling on edges will be
+    incorrect!
+
+    """
+    with rasterio.open(filename) as src:
+        crs, newaff, width, height, meta = _target(src, resolution)
+        if bidx is None:
+            bidx = range(1, src.count + 1)
+        elif not isinstance(bidx, collections.abc.Iterable):
+            bidx = [bidx]
+        bidx = list(bidx)
+
+        data = ma.masked_all((src.count, height, width), dtype=meta["dtype"])
+        nodatas = [src.nodatavals[idx - 1] for idx in bidx]
+        for group in _nodata_groups(nodatas):
+            for start in range(0, len(group), chunk):
+                bands = [bidx[i] for i in group[start : start + chunk]]
+                out = _warp(
+                    src,
+                    src.read(bands),
+                    [src.nodatavals[idx - 1] for idx in bands],
+                    crs,
+                    newaff,
+                    (height, width),
+                    resampling,
+                    num_threads,
+                    warp_mem_limit,
+                )
+                data[np.array(bands) - 1] = out
+    return meta, data
+
+
+def reproject2(src, data, resolution, resampling, num_threads=None, warp_mem_limit=0):
+    """Reproject an in-memory (masked) array read from `src'.
+
+    Returns the output metadata and a masked array with every band
+    reprojected.
+
+    """
+    crs, newaff, width, height, meta = _target(src, resolution)
+    nodatas = list(src.nodatavals[: data.shape[0]])
+    if ma.isMaskedArray(data):
+        fill = np.array(nodatas, dtype=data.dtype).reshape(-1, 1, 1)
+        data = np.where(ma.getmaskarray(data), fill, data.data)
+    out = _warp(
+        src,
+        data,
+        nodatas,
+        crs,
+        newaff,
+        (height, width),
+        resampling,
+        num_threads,
+        warp_mem_limit,
+    )
     return meta, out
+
+
+def reproject_to(
+    filename,
+    dst_fn,
+    resolution,
+    resampling,
+    bidx=None,
+    num_threads=None,
+    warp_mem_limit=0,
+    rows=None,
+    **kwargs,
+):
+    """Reproject a raster straight into an output file.
+
+    The source is wrapped in a warped VRT so the warp plan is computed
+    once; the destination is then filled in windows of `rows' rows
+    (default: one row of blocks) so no more than one window of every
+    band is held in memory.  Extra keyword arguments are passed as
+    creation options to the output dataset.  Returns the output
+    metadata.
+
+    """
+    if num_threads is None:
+        num_threads = os.cpu_count()
+    with rasterio.open(filename) as src:
+        crs, newaff, width, height, meta = _target(src, resolution)
+        if bidx is None:
+            bidx = range(1, src.count + 1)
+        elif not isinstance(bidx, collections.abc.Iterable):
+            bidx = [bidx]
+        bidx = list(bidx)
+        meta.update({"driver": "GTiff", "count": len(bidx)})
+        meta.update(kwargs)
+        with WarpedVRT(
+            src,
+            crs=crs,
+            transform=newaff,
+            width=width,
+            height=height,
+            resampling=resampling,
+            src_nodata=src.nodata,
+            nodata=src.nodata,
+            warp_mem_limit=warp_mem_limit,
+            warp_extras={"NUM_THREADS": num_threads},
+        ) as vrt:
+            with rasterio.open(dst_fn, "w", **meta) as dst:
+                if rows is None:
+                    rows = dst.block_shapes[0][0]
+                for row in range(0, height, rows):
+                    window = Window(0, row, width, min(rows, height - row))
+                    dst.write(vrt.read(bidx, window=window), window=window)
+    return meta
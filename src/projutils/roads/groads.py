@@ -1,13 +1,22 @@
 #!/usr/bin/env python
 
-import click
+from concurrent.futures import ProcessPoolExecutor
+import functools
 import gdal
+import math
+import numpy as np
 import os
 from osgeo import ogr
+import rasterio
+from rasterio.windows import Window
+from scipy import ndimage
+from scipy.spatial import cKDTree
+import shapely
 import sys
 import time
 
-from ..geotools import GeoLocation
+from ..geotools import GeoLocation, GeoLocations
+from .. import raster_utils
 from .. import tiff_utils
 
 
@@ -40,10 +49,11 @@ def create_fields(layer, db):
     return True
 
 
-def open_db(db_file):
+def open_db(db_file, quiet=False):
     """Open a DB file.
 
     @param db_file    Name of input GDB file
+    @param quiet      Don't report the number of features in the DB
     @return           DB object (OpenFileGDB)
     """
 
@@ -61,78 +71,195 @@ def open_db(db_file):
     if db is None:
         raise RuntimeError("Failed to opeb GDB directory: %s" % db_file)
 
-    layer = db.GetLayer()
-    print("Features in DB layer %s: %d" % (layer.GetName(), layer.GetFeatureCount()))
+    if not quiet:
+        layer = db.GetLayer()
+        print(
+            "Features in DB layer %s: %d" % (layer.GetName(), layer.GetFeatureCount())
+        )
     return db
 
 
-def distance_to_feature(p, layer, radius):
-    pgeom = ogr.CreateGeometryFromWkt("POINT(%s %s)" % (p.deg_lat, p.deg_lon))
-    SW, NE = p.bounding_locations(radius)
-    linearRing = ogr.Geometry(ogr.wkbLinearRing)
-    linearRing.AddPoint(SW.deg_lon, SW.deg_lat)
-    linearRing.AddPoint(NE.deg_lon, SW.deg_lat)
-    linearRing.AddPoint(NE.deg_lon, NE.deg_lat)
-    linearRing.AddPoint(SW.deg_lon, NE.deg_lat)
-    linearRing.AddPoint(SW.deg_lon, SW.deg_lat)
-    polygon = ogr.Geometry(ogr.wkbPolygon)
-    polygon.AddGeometry(linearRing)
+def load_roads(db):
+    """Load every road in the DB into a spatial index.
 
+    @param db         Input DB file
+    @return           STRtree of road geometries (in DB coordinates)
+    """
+    layer = db.GetLayer()
     layer.ResetReading()
-    layer.SetSpatialFilter(polygon)
-    nroads = layer.GetFeatureCount()
-    if nroads == 0:
-        return None
+    wkbs = [bytes(road.GetGeometryRef().ExportToWkb()) for road in layer]
+    layer.ResetReading()
+    return shapely.STRtree(shapely.from_wkb(wkbs))
 
-    roads = []
-    for road in layer:
-        roads.append(road)
-    if len(roads) == 0:
-        return None
-    distances = [road.GetGeometryRef().Distance(pgeom) for road in roads]
-    min_d = min(distances)
-    return min_d
+
+def site_locations(layer):
+    """Read the location of every site in a layer.
+
+    @param layer      Input layer (OGRLayer)
+    @return           Site locations sorted by FID (GeoLocations)
+    """
+    return GeoLocations.from_layer(layer, "Latitude", "Longitude")
+
+
+def closest_points(geoms, lats, lons):
+    """Find the point on each geometry closest to the matching site.
+
+    The search is done in a local equirectangular frame (longitude scaled
+    by the cosine of the latitude of the site) so the answer is not
+    distorted by the convergence of meridians.
+
+    @param geoms      Input geometries (array of shapely geometries)
+    @param lats       Input site latitudes (array of doubles, one per geometry)
+    @param lons       Input site longitudes (array of doubles, one per geometry)
+    @return           Latitudes and longitudes of the closest points
+    """
+    geoms = np.array(geoms, dtype=object)
+    lats = np.broadcast_to(np.asarray(lats, dtype=float), geoms.shape)
+    lons = np.broadcast_to(np.asarray(lons, dtype=float), geoms.shape)
+    scale = np.maximum(np.cos(np.radians(lats)), 1e-9)
+    coords, index = shapely.get_coordinates(geoms, return_index=True)
+    coords[:, 0] *= scale[index]
+    # geoms is a copy, the input geometries are left alone.
+    scaled = shapely.set_coordinates(geoms, coords)
+    lines = shapely.shortest_line(scaled, shapely.points(lons * scale, lats))
+    coords = shapely.get_coordinates(lines)[::2]
+    return coords[:, 1], coords[:, 0] / scale
+
+
+def bounding_boxes(SW, NE):
+    """Boxes (in degrees) covering the areas between the SW and NE corners.
+    An area that crosses the antimeridian gets two boxes.
+
+    @param SW         Input SW corners (GeoLocations)
+    @param NE         Input NE corners (GeoLocations)
+    @return           Boxes (array of shapely polygons) and the index of
+                      the corners of every box
+    """
+    west, east = SW.deg_lon, NE.deg_lon
+    wrap = west > east
+    owner = np.concatenate([np.arange(len(west)), np.flatnonzero(wrap)])
+    xmin = np.concatenate([west, np.full(wrap.sum(), -180.0)])
+    xmax = np.concatenate([np.where(wrap, 180.0, east), east[wrap]])
+    boxes = shapely.box(xmin, SW.deg_lat[owner], xmax, NE.deg_lat[owner])
+    return boxes, owner
+
+
+def geodesic_distance(tree, sites):
+    """Compute the great circle distance (in km) from every site to the
+    nearest road.
+
+    The planar nearest road (in degrees) gives an upper bound on the
+    distance.  Every road that intersects the bounding box of that
+    radius is a candidate and the closest one wins.  Sites for which no
+    road is found get the value -9999.
+
+    @param tree       Input spatial index (from load_roads())
+    @param sites      Input site locations (GeoLocations)
+    @return           Distance to the nearest road (array of doubles)
+    """
+    distances = np.full(len(sites), -9999.0)
+    if len(tree) == 0 or len(sites) == 0:
+        return distances
+    lats, lons = sites.deg_lat, sites.deg_lon
+    idx, roads = tree.query_nearest(shapely.points(lons, lats), all_matches=False)
+
+    # Upper bound: distance to the closest point of the planar nearest road.
+    clats, clons = closest_points(tree.geometries[roads], lats[idx], lons[idx])
+    radii = sites[idx].distance_to(GeoLocations.from_degrees(clats, clons))
+    SW, NE = sites[idx].bounding_locations(radii)
+
+    # Every (site, candidate road) pair, queried and measured in bulk.
+    boxes, owner = bounding_boxes(SW, NE)
+    box, cands = tree.query(boxes)
+    pairs = np.unique(
+        np.column_stack(
+            [np.concatenate([idx[owner[box]], idx]), np.concatenate([cands, roads])]
+        ),
+        axis=0,
+    )
+    site, road = pairs[:, 0], pairs[:, 1]
+    clats, clons = closest_points(tree.geometries[road], lats[site], lons[site])
+    dists = GeoLocations.from_degrees(clats, clons).distance_to(sites[site])
+    nearest = np.full(len(sites), np.inf)
+    np.minimum.at(nearest, site, dists)
+    distances[idx] = nearest[idx]
+    return distances
+
+
+# Each worker process opens its own (read-only) handle on the roads DB
+# and builds its own index.
+_roads = None
 
 
-def process(layer, db, quiet):
-    db_layer = db.GetLayer()
-    shortName = db_layer.GetName()[:10]
+def _init_worker(gdb_dir):
+    global _roads
+    _roads = load_roads(open_db(gdb_dir, quiet=True))
+
+
+def _worker_distance(sites):
+    return geodesic_distance(_roads, sites)
+
+
+def parallel_distance(gdb_dir, sites, jobs=None, chunk=1000):
+    """Compute the distance (in km) from every site to the nearest road
+    using a pool of worker processes.
+
+    Sites are split into chunks and the results are merged back in the
+    order of the input.
+
+    @param gdb_dir    Name of roads GDB file
+    @param sites      Input site locations (GeoLocations)
+    @param jobs       Number of worker processes (default: one per CPU)
+    @param chunk      Number of sites per task
+    @return           Distance to the nearest road (array of doubles)
+    """
+    if jobs is None:
+        jobs = os.cpu_count()
+    if jobs == 1:
+        return geodesic_distance(load_roads(open_db(gdb_dir, quiet=True)), sites)
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(gdb_dir,)
+    ) as pool:
+        futures = [
+            pool.submit(_worker_distance, sites[idx:idx + chunk])
+            for idx in range(0, len(sites), chunk)
+        ]
+        return np.concatenate([np.empty(0)] + [f.result() for f in futures])
+
+
+def write_distance(layer, fids, field, distances):
+    """Store the distance for every site in a field of the layer, updating
+    each feature once inside a single transaction.
+
+    """
+    values = dict(zip(fids, distances))
+    layer.StartTransaction()
+    layer.ResetReading()
+    for feature in layer:
+        feature.SetField(field, float(values[feature.GetFID()]))
+        if layer.SetFeature(feature) != 0:
+            print("Failed to update feature.")
+            layer.RollbackTransaction()
+            sys.exit(1)
+    layer.CommitTransaction()
+
+
+def process(layer, gdb_dir, field, quiet, jobs=None):
     start = time.time()
-    radii = [10, 100, 1000]
-    retries = {r: 0 for r in radii}
-    with click.progressbar(
-        layer, label="Computing distance to road", length=layer.GetFeatureCount()
-    ) as bar:
-        for feature in bar:
-            p = GeoLocation.from_degrees(
-                float(feature.GetField("Latitude")),
-                float(feature.GetField("Longitude")),
-            )
-            for radius in radii:
-                distance = distance_to_feature(p, db_layer, radius)
-                if distance is not None:
-                    break
-                retries[radius] += 1
-            # If we don't find a road, set the value to a known code
-            if distance is None:
-                distance = -9999
-            feature.SetField(shortName, distance)
-            if layer.SetFeature(feature) != 0:
-                print("Failed to update feature.")
-                sys.exit(1)
+    sites = site_locations(layer)
+    distances = parallel_distance(gdb_dir, sites, jobs)
+    write_distance(layer, sites.fids, field, distances)
 
     if not quiet:
         print("\nCompleted in %.2f sec" % (time.time() - start))
-        print("Retries:")
-        for r in radii:
-            print("%4d: %4d" % (r, retries[r]))
+        print("Sites without a road: %d" % np.count_nonzero(distances == -9999))
 
 
-def compute_distance(gdb_dir, shapefile):
-    """For every point in `shapefile' find the diatance to the neartest
-    feature (in our case a road) and save it in a new field.  The field
-    has the same name as the layer in the feature file (perhaps truncated
-    due to length).
+def compute_distance(gdb_dir, shapefile, jobs=None):
+    """For every point in `shapefile' find the distance (in km) to the
+    nearest feature (in our case a road) and save it in a new field.  The
+    field has the same name as the layer in the feature file (perhaps
+    truncated due to length).
 
     """
 
@@ -157,10 +284,32 @@ def compute_distance(gdb_dir, shapefile):
     layer = shape.GetLayer(0)
     # add new fields to the shapefile
     create_fields(layer, db)
-    process(layer, db, False)
+    field = db.GetLayer().GetName()[:10]
 
-    # clean close
+    # clean close; workers open their own handles
     del db
+    process(layer, gdb_dir, field, False, jobs)
+
+
+def raster_grid(layer, resolution):
+    """Compute the raster grid that covers a layer.
+
+    @param layer      Input layer (OGRLayer)
+    @param resolution Input cell size (in layer units)
+    @return           Origin (x_min, y_max) and size (x_size, y_size)
+    """
+    x_min, x_max, y_min, y_max = layer.GetExtent()
+
+    # Round bounds to a multiple of the resolution
+    # FIXME: shoud I use round or ceil?
+    x_min = round(x_min / resolution) * resolution
+    x_max = round(x_max / resolution) * resolution
+    y_min = round(y_min / resolution) * resolution
+    y_max = round(y_max / resolution) * resolution
+
+    x_size = int(round((x_max - x_min) / resolution))
+    y_size = int(round((y_max - y_min) / resolution))
+    return x_min, y_max, x_size, y_size
 
 
 def rasterize(gdb_dir, resolution, raster_fn):
@@ -174,18 +323,9 @@ def rasterize(gdb_dir, resolution, raster_fn):
     gdb = open_db(gdb_dir)
     source_layer = gdb.GetLayer()
     source_srs = source_layer.GetSpatialRef()
-    x_min, x_max, y_min, y_max = source_layer.GetExtent()
-
-    # Round bounds to a multiple of the resolution
-    # FIXME: shoud I use round or ceil?
-    x_min = round(x_min / x_res) * x_res
-    x_max = round(x_max / x_res) * x_res
-    y_min = round(y_min / y_res) * y_res
-    y_max = round(y_max / y_res) * y_res
 
     # Create the destination data source
-    x_size = int(round((x_max - x_min) / x_res))
-    y_size = int(round((y_max - y_min) / y_res))
+    x_min, y_max, x_size, y_size = raster_grid(source_layer, resolution)
     target_ds = gdal.GetDriverByName("GTiff").Create(
         raster_fn,
         x_size,
@@ -221,13 +361,357 @@ def proximitize(raster_fn, src_band, dst_band):
     gdal.ComputeProximity(src, dst, options)
 
 
-def proximity(gdb_dir, resolution, raster_fn):
-    rasterize(gdb_dir, resolution, raster_fn)
-    proximitize(raster_fn, 2, 1)
+# Distance units of proximity(): degrees or great circle km.
+UNITS = ("geo", "km")
+
+# Cells of the coarse grid used to bound the search distance of every
+# tile are COARSE x COARSE cells of the output grid.
+COARSE = 16
+
+# Each worker process keeps its own (read-only) handle on the roads DB.
+_tile_db = None
+
+
+def _init_tile_worker(gdb_dir):
+    global _tile_db
+    _tile_db = open_db(gdb_dir, quiet=True)
+
+
+def tile_halo(grid, window, units, max_distance):
+    """Number of extra rows and columns needed around a tile so every road
+    within `max_distance' of the tile is rasterized.
+
+    """
+    x_min, y_max, resolution, x_size, y_size = grid
+    if units == "geo":
+        rows = cols = int(math.ceil(max_distance / resolution))
+    else:
+        cell = math.radians(resolution) * GeoLocation.EARTH_RADIUS
+        rows = int(math.ceil(max_distance / cell))
+        # Meridians converge: use the latitude closest to a pole.
+        top = y_max - (window.row_off - rows) * resolution
+        bottom = y_max - (window.row_off + window.height + rows) * resolution
+        lat = min(max(abs(top), abs(bottom)), 90.0)
+        scale = math.cos(math.radians(lat))
+        cols = (
+            x_size
+            if scale * x_size * cell < max_distance
+            else int(math.ceil(max_distance / (cell * scale)))
+        )
+    return min(rows, y_size), min(cols, x_size)
+
+
+def rasterize_roads(layer, left, top, resolution, width, height):
+    """Rasterize (ALL_TOUCHED) the roads of a layer onto a grid.
+
+    @param layer      Input roads layer (OGRLayer)
+    @param left       Input left edge of the grid
+    @param top        Input top edge of the grid
+    @param resolution Input cell size (in degrees)
+    @param width      Input grid width (in cells)
+    @param height     Input grid height (in cells)
+    @return           True where a road passes (array of booleans)
+    """
+    ds = gdal.GetDriverByName("MEM").Create("", width, height, 1, gdal.GDT_Byte)
+    ds.SetGeoTransform((left, resolution, 0, top, 0, -resolution))
+    if layer.GetSpatialRef():
+        ds.SetProjection(layer.GetSpatialRef().ExportToWkt())
+    layer.SetSpatialFilterRect(
+        left, top - height * resolution, left + width * resolution, top
+    )
+    err = gdal.RasterizeLayer(
+        ds, [1], layer, burn_values=[1], options=["ALL_TOUCHED=TRUE"]
+    )
+    layer.SetSpatialFilter(None)
+    if err != 0:
+        raise RuntimeError("error rasterizing layer: %s" % err)
+    return ds.ReadAsArray().astype(bool)
+
+
+def road_distance(roads, left, top, resolution, units, inner=None):
+    """Distance from the center of every cell to the center of the
+    nearest road cell.
+
+    In "geo" units this is the planar distance in degrees (like
+    gdal.ComputeProximity with DISTUNITS=GEO).  In "km" it is the great
+    circle distance to the nearest road cell on the sphere: cell centers
+    are mapped to 3-D unit vectors, where the (chord) distance grows with
+    the great circle distance, and the nearest road cell is found with a
+    KD-tree, so the answer does not depend on the latitude or the height
+    of the grid.
+
+    @param roads      Input road cells (array of booleans, with a road)
+    @param left       Input left edge of the grid
+    @param top        Input top edge of the grid
+    @param resolution Input cell size (in degrees)
+    @param units      Input distance units ("geo" or "km")
+    @param inner      Cells to return the distance of (a pair of slices,
+                      default: every cell)
+    @return           Distance to the nearest road (array of doubles)
+    """
+    if inner is None:
+        inner = (slice(None), slice(None))
+    if units == "geo":
+        return ndimage.distance_transform_edt(~roads)[inner] * resolution
+    rows, cols = roads.shape
+    lats = np.radians(top - (np.arange(rows) + 0.5) * resolution)
+    lons = np.radians(left + (np.arange(cols) + 0.5) * resolution)
+    road_rows, road_cols = np.nonzero(roads)
+    tree = cKDTree(unit_vectors(lats[road_rows], lons[road_cols]))
+    lat, lon = np.meshgrid(lats[inner[0]], lons[inner[1]], indexing="ij")
+    chord, _ = tree.query(unit_vectors(lat.ravel(), lon.ravel()))
+    angle = 2 * np.arcsin(np.minimum(chord / 2, 1))
+    return (angle * GeoLocation.EARTH_RADIUS).reshape(lat.shape)
+
+
+def unit_vectors(rad_lat, rad_lon):
+    """3-D unit vectors (one row per location) of locations on a sphere."""
+    cos_lat = np.cos(rad_lat)
+    return np.column_stack(
+        [cos_lat * np.cos(rad_lon), cos_lat * np.sin(rad_lon), np.sin(rad_lat)]
+    )
+
+
+def search_bounds(layer, grid, units, factor=COARSE):
+    """Upper bound of the distance to the nearest road of the cells of a
+    grid, per cell of a grid `factor' times coarser.
 
+    The roads are rasterized onto the coarse grid.  The distance between
+    the centers of a coarse cell and of its nearest coarse road cell,
+    plus a coarse cell diagonal (the cell and the road can be anywhere
+    within their coarse cells) and half a fine cell diagonal (the road to
+    the center of its fine cell), bounds the distance of every fine cell
+    within it.
 
-def regularize(src_fn, dst_fn, src_band=1, offset=1.0, low=0.0, high=1):
-    tiff_utils.regularize(src_fn, dst_fn, src_band, offset, low, high)
+    @param layer      Input roads layer (OGRLayer)
+    @param grid       Input grid (x_min, y_max, resolution, x_size, y_size)
+    @param units      Input distance units ("geo" or "km")
+    @param factor     Input coarse cell size (in cells)
+    @return           Bounds (array of doubles) or None if there is no road
+    """
+    x_min, y_max, resolution, x_size, y_size = grid
+    coarse = resolution * factor
+    roads = rasterize_roads(
+        layer,
+        x_min,
+        y_max,
+        coarse,
+        int(math.ceil(x_size / factor)),
+        int(math.ceil(y_size / factor)),
+    )
+    if not roads.any():
+        return None
+    margin = math.sqrt(2) * (coarse + resolution / 2)
+    if units == "km":
+        # A degree is longest along a meridian (or the equator).
+        margin = math.radians(margin) * GeoLocation.EARTH_RADIUS
+    return road_distance(roads, x_min, y_max, coarse, units) + margin
+
+
+def tile_search(bounds, window, factor=COARSE):
+    """Search distance of a tile: the largest bound of the coarse cells
+    it overlaps (None if there is no road at all)."""
+    if bounds is None:
+        return None
+    rows = slice(
+        window.row_off // factor,
+        -(-(window.row_off + window.height) // factor),
+    )
+    cols = slice(
+        window.col_off // factor,
+        -(-(window.col_off + window.width) // factor),
+    )
+    return float(bounds[rows, cols].max())
+
+
+def _proximity_tile(grid, units, max_distance, nodata, item):
+    window, search = item
+    x_min, y_max, resolution, x_size, y_size = grid
+    out = np.full((2, window.height, window.width), nodata, dtype=np.float32)
+    if search is None:
+        return out
+    rows, cols = tile_halo(grid, window, units, search)
+    row0 = max(window.row_off - rows, 0)
+    row1 = min(window.row_off + window.height + rows, y_size)
+    col0 = max(window.col_off - cols, 0)
+    col1 = min(window.col_off + window.width + cols, x_size)
+
+    # Rasterize the roads that fall inside the tile (plus halo).
+    left = x_min + col0 * resolution
+    top = y_max - row0 * resolution
+    roads = rasterize_roads(
+        _tile_db.GetLayer(), left, top, resolution, col1 - col0, row1 - row0
+    )
+    inner = (
+        slice(window.row_off - row0, window.row_off - row0 + window.height),
+        slice(window.col_off - col0, window.col_off - col0 + window.width),
+    )
+    out[1, roads[inner]] = 1
+    if not roads.any():
+        return out
+    dist = road_distance(roads, left, top, resolution, units, inner)
+    if max_distance is not None:
+        dist = np.where(dist <= max_distance, dist, nodata)
+    out[0] = dist
+    return out
+
+
+def overview_levels(width, height, block=256):
+    """Overview decimation factors (2, 4, 8, ...) until the raster fits
+    in a single block."""
+    levels = []
+    factor = 2
+    while max(width, height) > block * factor // 2:
+        levels.append(factor)
+        factor *= 2
+    return levels
+
+
+def write_cog(src_fn, dst_fn, width, height, block=256):
+    """Convert a GeoTIFF into a Cloud Optimized GeoTIFF.
+
+    The GDAL pinned in setup.py predates the COG driver, so the layout is
+    built with the GTiff driver: internal overviews are added to the
+    source, which is then copied to a tiled GeoTIFF with
+    COPY_SRC_OVERVIEWS (overviews and tiles ordered for range reads).
+
+    @param src_fn     Name of input raster (modified: overviews are added)
+    @param dst_fn     Name of destination raster
+    @param width      Raster width (in cells)
+    @param height     Raster height (in cells)
+    @param block      Tile size (in cells)
+    """
+    src = gdal.Open(src_fn, gdal.GA_Update)
+    if src is None:
+        raise RuntimeError("Failed to open raster: %s" % src_fn)
+    levels = overview_levels(width, height, block)
+    if levels and src.BuildOverviews("NEAREST", levels) != 0:
+        raise RuntimeError("Failed to build overviews: %s" % src_fn)
+    gdal.Translate(
+        dst_fn,
+        src,
+        format="GTiff",
+        creationOptions=[
+            "TILED=YES",
+            "BLOCKXSIZE=%d" % block,
+            "BLOCKYSIZE=%d" % block,
+            "COMPRESS=LZW",
+            "PREDICTOR=3",
+            "BIGTIFF=IF_SAFER",
+            "COPY_SRC_OVERVIEWS=YES",
+        ],
+    )
+    src = None
+
+
+def proximity(
+    gdb_dir,
+    resolution,
+    raster_fn,
+    units="geo",
+    max_distance=None,
+    tile_size=1024,
+    jobs=None,
+    cog=False,
+):
+    """Generate a raster with the distance to the nearest road for every
+    cell.
+
+    The raster is processed in tiles (in parallel).  Roads are first
+    rasterized onto a coarse grid to bound the distance to the nearest
+    road of every tile (see search_bounds()); each tile is then
+    rasterized with a halo that wide (or `max_distance' wide, if
+    smaller) so the distance is exact while memory use depends on the
+    tile size and the distance of its cells to a road, not on the size
+    of the raster.  Cells farther than `max_distance' (if given) from a
+    road are set to NoData.  Band 1 holds the distance and band 2 the
+    rasterized roads.
+
+    @param gdb_dir      Name of roads GDB file
+    @param resolution   Cell size (in degrees)
+    @param raster_fn    Name of destination raster (tiled, compressed GTiff)
+    @param units        Distance units: "geo" (degrees) or "km" (great circle)
+    @param max_distance Maximum search distance (in units) or None (no
+                        cutoff); cells farther from a road are set to
+                        NoData
+    @param tile_size    Tile size in cells (a multiple of 256)
+    @param jobs         Number of worker processes (default: one per CPU)
+    @param cog          Convert the output to a Cloud Optimized GeoTIFF
+                        (see write_cog())
+    """
+    nodata = -9999
+    if units not in UNITS:
+        raise ValueError("unknown distance units: %s" % units)
+    if jobs is None:
+        jobs = os.cpu_count()
+
+    db = open_db(gdb_dir)
+    layer = db.GetLayer()
+    x_min, y_max, x_size, y_size = raster_grid(layer, resolution)
+    srs = layer.GetSpatialRef()
+    crs = srs.ExportToWkt() if srs else None
+    grid = (x_min, y_max, resolution, x_size, y_size)
+    bounds = search_bounds(layer, grid, units)
+    del db
+
+    windows = [
+        Window(col, row, min(tile_size, x_size - col), min(tile_size, y_size - row))
+        for row in range(0, y_size, tile_size)
+        for col in range(0, x_size, tile_size)
+    ]
+    items = []
+    for window in windows:
+        search = tile_search(bounds, window)
+        if search is not None and max_distance is not None:
+            search = min(search, max_distance)
+        items.append((window, search))
+    meta = {
+        "driver": "GTiff",
+        "width": x_size,
+        "height": y_size,
+        "count": 2,
+        "dtype": "float32",
+        "nodata": nodata,
+        "crs": crs,
+        "transform": rasterio.transform.from_origin(
+            x_min, y_max, resolution, resolution
+        ),
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "compress": "lzw",
+        "predictor": 3,
+        "bigtiff": "IF_SAFER",
+    }
+    func = functools.partial(_proximity_tile, grid, units, max_distance, nodata)
+    with rasterio.open(raster_fn, "w", **meta) as dst:
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_tile_worker, initargs=(gdb_dir,)
+        ) as pool:
+            for (window, _), data in raster_utils.imap_ordered(
+                pool, func, items, 2 * jobs
+            ):
+                dst.write(data, window=window)
+    if cog:
+        tmp_fn = raster_fn + ".tmp.tif"
+        os.rename(raster_fn, tmp_fn)
+        write_cog(tmp_fn, raster_fn, x_size, y_size)
+        os.remove(tmp_fn)
+
+
+def regularize(
+    src_fn,
+    dst_fn,
+    src_band=1,
+    offset=1.0,
+    low=0.0,
+    high=1,
+    streaming=True,
+    jobs=None,
+):
+    tiff_utils.regularize(
+        src_fn, dst_fn, src_band, offset, low, high, streaming, jobs
+    )
 
 
 def ref_to_path(ref_str):
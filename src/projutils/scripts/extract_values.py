@@ -42,7 +42,9 @@ import os.path
 import glob
 import math
 import numpy as np
+import pandas as pd
 
+from .. import geotools
 from ..progressbar import ProgressBar
 
 outFormat = "ESRI Shapefile"
@@ -125,13 +127,102 @@ def invertGeoTransform(geoTransform):
     return outGeoTransform
 
 
+def mapToPixels(mX, mY, geoTransform):
+    """Convert arrays of map coordinates to pixel coordinates.
+
+    Vectorized version of mapToPixel().
+
+    @param mX              Input map X coordinates (array of doubles)
+    @param mY              Input map Y coordinates (array of doubles)
+    @param geoTransform    Input geotransform (six doubles)
+    @return pX, pY         Output coordinates (two arrays of ints)
+    """
+    if geoTransform[2] + geoTransform[4] == 0:
+        pX = (mX - geoTransform[0]) / geoTransform[1]
+        pY = (mY - geoTransform[3]) / geoTransform[5]
+    else:
+        pX, pY = applyGeoTransform(mX, mY, invertGeoTransform(geoTransform))
+    return np.floor(pX).astype(np.int64), np.floor(pY).astype(np.int64)
+
+
+def layerPoints(inLayer):
+    """Read the FID and coordinates of every point in a layer.
+
+    @param inLayer         Input point layer (OGRLayer)
+    @return fids, xs, ys   Output FIDs and coordinates (three arrays, sorted
+                           by FID)
+    """
+    return geotools.layer_coordinates(inLayer)
+
+
+def transformPoints(xs, ys, coordTransform):
+    """Transform arrays of coordinates with a single osr call.
+
+    @param xs              Input X coordinates (array of doubles)
+    @param ys              Input Y coordinates (array of doubles)
+    @param coordTransform  Input transformation (OSRCoordinateTransformation)
+    @return xs, ys         Output coordinates (two arrays of doubles)
+    """
+    if len(xs) == 0:
+        return xs, ys
+    res = np.array(coordTransform.TransformPoints(list(zip(xs, ys))))
+    return res[:, 0], res[:, 1]
+
+
+def wgs84ToPixels(lons, lats, info):
+    """Convert WGS84 coordinates to pixel coordinates of a raster.
+
+    Same semantics as gdallocationinfo -wgs84: the points are transformed
+    to the CRS of the raster (if it has one) and mapped to the pixel that
+    contains them using the (cached) inverse geotransform.
+
+    @param lons            Input longitudes (array of doubles)
+    @param lats            Input latitudes (array of doubles)
+    @param info            Input raster (fileInfo object)
+    @return pX, pY         Output pixel coordinates (two arrays of ints)
+    """
+    wgs84 = osr.SpatialReference()
+    wgs84.SetWellKnownGeogCS("WGS84")
+    if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+        wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    if info.projection.ExportToWkt() != "" and not info.projection.IsSame(wgs84):
+        coordTransform = osr.CoordinateTransformation(wgs84, info.projection)
+        lons, lats = transformPoints(lons, lats, coordTransform)
+    pX, pY = applyGeoTransform(lons, lats, info.invGeotransform)
+    return np.floor(pX).astype(np.int64), np.floor(pY).astype(np.int64)
+
+
+def readPixels(ds, pX, pY):
+    """Read the value of every band of a raster at the given pixels.
+
+    Each band is read once, restricted to the window that bounds all the
+    pixels, and values are gathered with fancy indexing.
+
+    @param ds              Input raster (GDALDataset)
+    @param pX              Input pixel X coordinates (array of ints)
+    @param pY              Input pixel Y coordinates (array of ints)
+    @return values         Output values (array of shape points x bands)
+    """
+    values = np.empty((len(pX), ds.RasterCount))
+    if len(pX) == 0:
+        return values
+    xOff = int(pX.min())
+    yOff = int(pY.min())
+    xSize = int(pX.max()) - xOff + 1
+    ySize = int(pY.max()) - yOff + 1
+    for b in range(ds.RasterCount):
+        band = ds.GetRasterBand(b + 1).ReadAsArray(xOff, yOff, xSize, ySize)
+        values[:, b] = band[pY - yOff, pX - xOff]
+    return values
+
+
 # =============================================================================
 
 
 def usage():
     """Show usage synopsis."""
     print(
-        "Usage: extract_values.py [-q] [-r] [-g] [-f] point_shapefile [raster_file(s)] [-d directory_with_rasters] [-rl list,of,rasters] [-e extension]"  # noqa E501
+        "Usage: extract_values.py [-q] [-r] [-g] [-f] [-c] [-p] point_shapefile [raster_file(s)] [-d directory_with_rasters] [-rl list,of,rasters] [-e extension]"  # noqa E501
     )
     sys.exit(1)
 
@@ -165,45 +256,106 @@ def createFields(inLayer, infos):
     @param infos      Input fileInfos (list of fileInfo objects)
     @return           True on success, False on any error
     """
+    names = iter(uniqueFieldNames(infos))
     for i in infos:
-        if i.bands == 1:
-            shortName = i.fileBaseName[:10]
+        for b in range(i.bands):
+            shortName, _ = next(names)
             fieldDef = ogr.FieldDefn(shortName, ogr.OFTReal)
             fieldDef.SetWidth(18)
             fieldDef.SetPrecision(8)
             if fields_descript:
-                fields_csv.write(i.fileBaseName + ";" + shortName + ";1" + "\n")
-            if create_csv:
-                extract_csv.write(";" + i.fileBaseName)
-            else:
+                fields_csv.write(
+                    i.fileBaseName
+                    + ";"
+                    + shortName
+                    + ";"
+                    + ("1" if i.bands == 1 else str(b))
+                    + "\n"
+                )
+            if not columnar:
                 if inLayer.CreateField(fieldDef) != 0:
                     print("Can't create field %s" % fieldDef.GetNameRef())
                     return False
-        else:
-            shortName = i.fileBaseName[:8]
-            for b in range(i.bands):
-                fieldDef = ogr.FieldDefn(shortName + str(b + 1), ogr.OFTReal)
-                fieldDef.SetWidth(18)
-                fieldDef.SetPrecision(8)
-                if fields_descript:
-                    fields_csv.write(
-                        i.fileBaseName
-                        + ";"
-                        + shortName
-                        + str(b + 1)
-                        + ";"
-                        + str(b)
-                        + "\n"
-                    )
-                if create_csv:
-                    extract_csv.write(";" + i.fileBaseName + str(b))
-                else:
-                    if inLayer.CreateField(fieldDef) != 0:
-                        print("Can't create field %s" % fieldDef.GetNameRef())
-                        return False
     return True
 
 
+def fieldNames(info):
+    """Names of the fields that hold the values of a raster.
+
+    @param info       Input raster (fileInfo object)
+    @return           (short, long) name tuples, one per band; the short
+                      name is the shapefile field (bands numbered from 1)
+                      and the long name the column in CSV / Parquet output
+                      (bands numbered from 0, as in the old CSV header)
+    """
+    if info.bands == 1:
+        return [(info.fileBaseName[:10], info.fileBaseName)]
+    return [
+        (info.fileBaseName[:8] + str(b + 1), info.fileBaseName + str(b))
+        for b in range(info.bands)
+    ]
+
+
+def uniqueFieldNames(infos):
+    """Field names of the values of a list of rasters.
+
+    Rasters with the same base name (e.g. in different directories) or
+    whose names are the same once truncated to the shapefile limit of 10
+    characters get a _2, _3, ... suffix so every name is unique.
+
+    @param infos      Input fileInfos (list of fileInfo objects)
+    @return           (short, long) name tuples, one per band of every
+                      raster (see fieldNames())
+    """
+    out = []
+    shorts, longs = set(), set()
+    for info in infos:
+        for short, long in fieldNames(info):
+            base, n = long, 1
+            while long in longs:
+                n += 1
+                long = "%s_%d" % (base, n)
+            base, n = short, 1
+            while short in shorts:
+                n += 1
+                suffix = "_%d" % n
+                short = base[: 10 - len(suffix)] + suffix
+            shorts.add(short)
+            longs.add(long)
+            out.append((short, long))
+    return out
+
+
+def writeLayer(inLayer, table, names):
+    """Write a table of extracted values back into a layer.
+
+    Every feature is updated once (with all its new fields) inside a
+    single transaction.  For a GeoPackage this is a single SQLite
+    transaction; for drivers without transactions it is a no-op.
+
+    @param inLayer    Input layer to update (OGRLayer)
+    @param table      Input values (DataFrame indexed by FID)
+    @param names      Input map from table column to field name (dict)
+    @return           True on success, False on any error
+    """
+    columns = [names[c] for c in table.columns]
+    rows = dict(zip(table.index, table.values))
+    inLayer.StartTransaction()
+    inLayer.ResetReading()
+    for inFeat in inLayer:
+        fid = inFeat.GetFID()
+        if fid not in rows:
+            continue
+        for name, value in zip(columns, rows[fid]):
+            if not np.isnan(value):
+                inFeat.SetField(name, float(value))
+        if inLayer.SetFeature(inFeat) != 0:
+            print("Failed to update feature.")
+            inLayer.RollbackTransaction()
+            return False
+    return inLayer.CommitTransaction() == 0
+
+
 # =============================================================================
 
 
@@ -224,8 +376,11 @@ class fileInfo:
             fh.GetRasterBand(i).GetNoDataValue() for i in range(1, self.bands + 1)
         ]
         self.geotransform = fh.GetGeoTransform()
+        self.invGeotransform = invertGeoTransform(self.geotransform)
         self.projection = osr.SpatialReference()
         self.projection.ImportFromWkt(fh.GetProjectionRef())
+        if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+            self.projection.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
         return 1
 
     def reportInfo(self):
@@ -317,7 +472,7 @@ class gdalInfo:
 
 
 def main():                                                 # noqa C901
-    global create_csv
+    global columnar
     global fields_descript
     global fields_csv
 
@@ -330,6 +485,7 @@ def main():                                                 # noqa C901
     gdalalloc = False
     fields_descript = False
     create_csv = False
+    create_parquet = False
     rasterPaths2 = None
     quiet = False
 
@@ -357,6 +513,8 @@ def main():                                                 # noqa C901
             fields_descript = True
         elif arg == "-c":
             create_csv = True
+        elif arg == "-p":
+            create_parquet = True
         elif arg == "-rl":
             inRasters.extend(args[i + 1].split(","))
         elif arg == "-d":
@@ -394,8 +552,7 @@ def main():                                                 # noqa C901
         fields_csv = open(inShapeName.replace(".shp", "_fields.csv"), "wb")
         fields_csv.write("RASTER;NEWFIELD;BAND\n")
 
-    if create_csv:
-        extract_csv = open(inShapeName.replace(".shp", "_extract.csv"), "wb")
+    columnar = create_csv or create_parquet
 
     # -d is set
     if rasterPaths2 is not None:
@@ -441,31 +598,24 @@ def main():                                                 # noqa C901
                 + ";1\n"
             )
 
-    if create_csv:
-        extract_csv.write("FID")
-    featCount = inLayer.GetFeatureCount()
     layerCRS = inLayer.GetSpatialRef()
 
     # add new fields to the shapefile
     createFields(inLayer, fileInfos)
 
-    # init progressbar
-    if gdalalloc:
-        max = featCount * len(inRasters)
-    else:
-        max = featCount * bands
+    # process points and rasters
+    fids, xs, ys = layerPoints(inLayer)
+    # init progressbar: every raster advances it by the number of values
+    # read (points x bands)
     if not quiet:
-        pb = ProgressBar(max + 1, 65)
+        pb = ProgressBar(max(len(fids) * bands, 1), 65)
     i = 0
-    # process points and rasters
-    fi = 0
-    if create_csv:
-        arExt = np.zeros((featCount, len(fileInfos) + 1))
+    # Accumulate all values in a table (keyed by FID) and write them in
+    # one go at the end.
+    names = dict((long, short) for short, long in uniqueFieldNames(fileInfos))
+    data = np.full((len(fids), bands), np.nan)
+    col = 0
     for f in fileInfos:
-        fi += 1
-        i += 1
-        if not quiet:
-            pb.update(i)
         gt = f.geotransform
         rasterCRS = f.projection
         # print("Layer", layerCRS.ExportToWkt())
@@ -475,115 +625,40 @@ def main():                                                 # noqa C901
             if coordTransform is None and needTransform:
                 print("Error while creating coordinate transformation.")
                 sys.exit(1)
-        if not gdalalloc:
-            ds = gdal.Open(f.fileName)
-        if f.bands == 1:
-            shortName = f.fileBaseName[:10]
-            if not gdalalloc:
-                band = ds.ReadAsArray()
-            inLayer.ResetReading()
-            inFeat = inLayer.GetNextFeature()
-            while inFeat is not None:
-                i += 1
-                if not quiet:
-                    pb.update(i)
-                geom = inFeat.GetGeometryRef()
-                x = geom.GetX()
-                y = geom.GetY()
-                # print("BEFORE", x, y)
-                if needTransform:
-                    res = coordTransform.TransformPoint(x, y, 0)
-                    x = res[0]
-                    y = res[1]
-                rX, rY = mapToPixel(x, y, gt)
-                if rX > f.xSize or rY > f.ySize:
-                    inFeat = inLayer.GetNextFeature()
-                    continue
-                if gdalalloc:
-                    value = os.popen(
-                        "gdallocationinfo -valonly -wgs84 %s %s %s" % (f.fileName, x, y)
-                    ).read()
-                else:
-                    value = band[rY, rX]
-                if np.isclose(float(value), f.nodata[0]):
-                    value = -9999
-                if create_csv:
-                    arExt[inFeat.GetFID(), 0] = inFeat.GetFID()
-                    arExt[inFeat.GetFID(), fi] = value
-                else:
-                    inFeat.SetField(shortName, float(value))
-                    if inLayer.SetFeature(inFeat) != 0:
-                        print("Failed to update feature.")
-                        sys.exit(1)
-
-                inFeat = inLayer.GetNextFeature()
+        # Sample all the points in one go.
+        if needTransform:
+            x, y = transformPoints(xs, ys, coordTransform)
         else:
-            shortName = f.fileBaseName[:8]
-            inLayer.ResetReading()
-            inFeat = inLayer.GetNextFeature()
-            while inFeat is not None:
-                i += 1
-                if not quiet:
-                    pb.update(i)
-                geom = inFeat.GetGeometryRef()
-                x = geom.GetX()
-                y = geom.GetY()
-                if needTransform:
-                    res = coordTransform.TransformPoint(x, y, 0)
-                    x = res[0]
-                    y = res[1]
-                rX, rY = mapToPixel(x, y, gt)
-                if rX > f.xSize or rY > f.ySize:
-                    inFeat = inLayer.GetNextFeature()
-                    continue
-                if gdalalloc:
-                    # TODO: check that raster has CRS assigned
-                    values = (
-                        os.popen(
-                            "gdallocationinfo -valonly -wgs84 %s %s %s"
-                            % (f.fileName, x, y)
-                        )
-                        .read()
-                        .split("\n")
-                    )
-                    values = [v.replace(".#IND", "") for v in values]
-                    values = [
-                        -9999 if np.isclose(float(v), f.nodata[idx]) else v
-                        for idx, v in enumerate(values)
-                    ]
-                    for b in range(f.bands):
-                        if create_csv:
-                            arExt[inFeat.GetFID(), 0] = inFeat.GetFID()
-                            arExt[inFeat.GetFID(), fi] = float(values[b])
-                        else:
-                            inFeat.SetField(shortName + str(b + 1), float(values[b]))
-                            if inLayer.SetFeature(inFeat) != 0:
-                                print("Failed to update feature.")
-                                sys.exit(1)
-                else:
-                    for b in range(f.bands):
-                        rband = ds.GetRasterBand(b + 1)
-                        band = rband.ReadAsArray()
-                        value = band[rY, rX]
-                        rband = None
-                        if create_csv:
-                            arExt[inFeat.GetFID(), 0] = inFeat.GetFID()
-                            arExt[inFeat.GetFID(), fi] = value
-                        else:
-                            inFeat.SetField(shortName + str(b + 1), float(value))
-                            if inLayer.SetFeature(inFeat) != 0:
-                                print("Failed to update feature.")
-                                sys.exit(1)
-                inFeat = inLayer.GetNextFeature()
+            x, y = xs, ys
+        if gdalalloc:
+            rX, rY = wgs84ToPixels(x, y, f)
+        else:
+            rX, rY = mapToPixels(x, y, gt)
+        inside = (rX >= 0) & (rX < f.xSize) & (rY >= 0) & (rY < f.ySize)
+        ds = gdal.Open(f.fileName)
+        values = readPixels(ds, rX[inside], rY[inside])
         ds = None
+        for b in range(f.bands):
+            if f.nodata[b] is not None:
+                values[np.isclose(values[:, b], f.nodata[b]), b] = -9999
+        data[inside, col:col + f.bands] = values
+        col += f.bands
+        i += f.bands * len(fids)
+        if not quiet:
+            pb.update(i)
 
+    table = pd.DataFrame(
+        data, index=pd.Index(fids, name="FID"), columns=list(names.keys())
+    )
     if create_csv:
-        for r in range(featCount):
-            extract_csv.write("\n")
-            extract_csv.write(str(arExt[r, 0]) + ";")
-            for c in range(1, fi):
-                extract_csv.write(str(arExt[r, c]) + ";")
-            extract_csv.write(str(arExt[r, fi]))
+        table.to_csv(
+            os.path.splitext(inShapeName)[0] + "_extract.csv", sep=";", na_rep=""
+        )
+    if create_parquet:
+        table.to_parquet(os.path.splitext(inShapeName)[0] + "_extract.parquet")
+    if not columnar:
+        if not writeLayer(inLayer, table, names):
+            sys.exit(1)
     if not quiet:
         pb.done()
 
@@ -1,18 +1,27 @@
 #!/usr/bin/env python3
 
-import time
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
 
 import click
 from netCDF4 import Dataset
 import numpy as np
 import numpy.ma as ma
 
-import osr
 import rasterio
+from rasterio.crs import CRS
 import rasterio.warp as rwarp
 
-import projections.utils as utils
-import projections.geotools as geotools
+import projutils.nc_utils as nc_utils
+import projutils.raster_utils as raster_utils
+import projutils.utils as utils
+
+# The netCDF/HDF5 libraries are not thread-safe.  The source bands (read
+# through GDAL's netCDF driver) and the output file share them, so every
+# access to either must hold this lock.
+NC_LOCK = threading.Lock()
 
 
 def get_transform(r1, r2):
@@ -31,93 +40,56 @@ def get_transform(r1, r2):
     return affine, lats, lons, dst.res, cratio
 
 
-def resample(ds, bidx, resolution, resampling, out):
-    arr = ds.read(bidx, masked=True)
-    nodata = ds.nodatavals[bidx - 1]
+def resample(fname, bidx, transform, shape, resampling, num_threads):
+    """Read band `bidx' of `fname' and warp it to the given grid.
+
+    Every call opens its own dataset so bands can be resampled from
+    several threads at once.  Only the read holds NC_LOCK; the warp runs
+    on the in-memory band.  Returns a masked array.
+
+    """
+    with NC_LOCK, rasterio.open(fname) as ds:
+        arr = ds.read(bidx)
+        nodata = ds.nodatavals[bidx - 1]
+        src_transform = ds.transform
+        crs = ds.crs
     if nodata is None:  # "'nodata' must be set!"
         nodata = -9999
-    if ds.crs.data == {}:
-        crs = ds.crs.from_string(u"epsg:4326")
-    else:
-        crs = ds.crs
-    newaff, width, height = rwarp.calculate_default_transform(
-        crs, crs, ds.width, ds.height, *ds.bounds, resolution=resolution
-    )
-    out.mask.fill(False)
+    if not crs:
+        crs = CRS.from_string("epsg:4326")
+    out = np.empty(shape, dtype=arr.dtype)
     rwarp.reproject(
         arr,
         out,
-        src_transform=ds.affine,
-        dst_transform=newaff,
-        width=width,
-        height=height,
+        src_transform=src_transform,
+        dst_transform=transform,
         src_nodata=nodata,
         dst_nodata=nodata,
         src_crs=crs,
+        dst_crs=crs,
         resampling=resampling,
+        num_threads=num_threads,
     )
-    out.mask = np.where(out == nodata, 1, 0)
+    return ma.masked_equal(out, nodata, copy=False)
 
 
-def init_nc(dst_ds, transform, lats, lons, years, variables):
-    # Set attributes
-    dst_ds.setncattr("Conventions", u"CF-1.5")
-    dst_ds.setncattr("GDAL", u"GDAL 1.11.3, released 2015/09/16")
+def write_years(writer, results, errors):
+    """Append every (index, array) item of the `results' queue to the
+    output file until a None item arrives.  An exception is stored in
+    `errors' (and the queue drained) so the producer never blocks.
 
-    # Create dimensions
-    dst_ds.createDimension("time", None)
-    dst_ds.createDimension("lat", len(lats))
-    dst_ds.createDimension("lon", len(lons))
-
-    # Create variables
-    times = dst_ds.createVariable(
-        "time", "f8", ("time"), zlib=True, least_significant_digit=3
-    )
-    latitudes = dst_ds.createVariable(
-        "lat", "f4", ("lat"), zlib=True, least_significant_digit=3
-    )
-    longitudes = dst_ds.createVariable(
-        "lon", "f4", ("lon"), zlib=True, least_significant_digit=3
-    )
-    crs = dst_ds.createVariable("crs", "S1", ())
-
-    # Add metadata
-    dst_ds.history = "Created at " + time.ctime(time.time())
-    dst_ds.source = "foo.py"
-    latitudes.units = "degrees_north"
-    latitudes.long_name = "latitude"
-    longitudes.units = "degrees_east"
-    longitudes.long_name = "longitude"
-    times.units = "years since 0000-01-01 00:00:00.0"
-    times.calendar = "gregorian"
-    times.standard_name = "time"
-    times.axis = "T"
-
-    # Assign data to variables
-    latitudes[:] = lats
-    longitudes[:] = lons
-    times[:] = years
-
-    srs = osr.SpatialReference()
-    srs.ImportFromWkt(geotools.WGS84_WKT)
-    crs.grid_mapping_name = "latitude_longitude"
-    crs.spatial_ref = srs.ExportToWkt()
-    crs.GeoTransform = " ".join(map(str, transform))
-    crs.longitude_of_prime_meridian = geotools.srs_get_prime_meridian(srs)
-    crs.semi_major_axis = geotools.srs_get_semi_major(srs)
-    crs.inverse_flattening = geotools.srs_get_inv_flattening(srs)
-
-    for name, dtype, units, fill in variables:
-        dst_data = dst_ds.createVariable(
-            name,
-            dtype,
-            ("time", "lat", "lon"),
-            zlib=True,
-            least_significant_digit=4,
-            fill_value=fill,
-        )
-        dst_data.units = units
-        dst_data.grid_mapping = "crs"
+    """
+    while True:
+        item = results.get()
+        if item is None:
+            return
+        if errors:
+            continue
+        try:
+            with NC_LOCK:
+                writer.write_step("popd", *item)
+        except Exception as e:
+            errors.append(e)
 
 
 @click.command()
@@ -127,34 +99,76 @@ def init_nc(dst_ds, transform, lats, lons, years, variables):
     default="32",
     help="Which version of HYDE to convert to NetCDF (default: 3.2)",
 )
-def main(version):
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.INT,
+    default=None,
+    metavar="jobs",
+    help="Number of bands to resample in parallel (default: 2)",
+)
+@click.option(
+    "-t",
+    "--threads",
+    type=click.INT,
+    default=None,
+    metavar="threads",
+    help="Number of warper threads per band (default: CPUs / jobs)",
+)
+def main(version, jobs, threads):
     fname = "%s/hyde/hyde-%s.nc" % (utils.outdir(), version)
-    # fname = 'netcdf:%s/hyde/hyde-%s.nc:popc' % (utils.outdir(), version)
+    src_name = "netcdf:" + fname + ":popc"
     uncodes = "%s/luh2/un_codes-full.tif" % utils.outdir()
     oname = "%s/luh2/hyde.nc" % utils.outdir()
     variables = [("popd", "f4", "ppl/km^2", -9999)]
-    affine, lats, lons, res, cfudge = get_transform(
-        uncodes, "netcdf:" + fname + ":popc"
-    )
-    arr = ma.empty((len(lats), len(lons)), fill_value=-9999)
+    affine, lats, lons, res, cfudge = get_transform(uncodes, src_name)
+    shape = (len(lats), len(lons))
+    jobs = jobs or 2
+    threads = threads or max(1, (os.cpu_count() or 1) // jobs)
 
     with rasterio.open(utils.luh2_static("carea")) as carea_ds:
         carea = carea_ds.read(1, masked=True)
 
-    with rasterio.open("netcdf:" + fname + ":popc") as ds:
-        years = tuple(map(lambda idx: int(ds.tags(idx)["NETCDF_DIM_time"]), ds.indexes))
-        with Dataset(oname, "w") as out:
-            init_nc(out, affine.to_gdal(), lats, lons, years, variables)
-            print(ds.name)
-            print(years)
-            # with click.progressbar(enumerate(years), length=len(years)) as bar:
-            # for idx, year in bar:
-            for idx, year in zip(ds.indexes, years):
-                # pdb.set_trace()
-                # time.sleep(100)
-                print(idx, year)
-                resample(ds, idx, res, rwarp.Resampling.average, arr)
-                out.variables["popd"][idx - 1, :, :] = arr * cfudge / carea
+    with rasterio.open(src_name) as ds:
+        indexes = ds.indexes
+        years = tuple(map(lambda idx: int(ds.tags(idx)["NETCDF_DIM_time"]), indexes))
+
+    def popd(bidx):
+        arr = resample(src_name, bidx, affine, shape, rwarp.Resampling.average, threads)
+        return arr * cfudge / carea
+
+    # Bands are resampled by a pool of workers and handed (in order) to
+    # a single thread that appends them to the output file.
+    results = queue.Queue(maxsize=jobs)
+    errors = []
+    with Dataset(oname, "w") as out, nc_utils.StepWriter(
+        nc_utils.init_nc(
+            out,
+            affine,
+            len(lons),
+            len(lats),
+            years,
+            variables,
+            source="gen_hyde.py",
+        )
+    ) as writer:
+        thread = threading.Thread(target=write_years, args=(writer, results, errors))
+        thread.start()
+        try:
+            with ThreadPoolExecutor(jobs) as pool:
+                with click.progressbar(length=len(years)) as bar:
+                    for bidx, arr in raster_utils.imap_ordered(
+                        pool, popd, indexes, jobs
+                    ):
+                        results.put((bidx - 1, arr))
+                        bar.update(1)
+                        if errors:
+                            break
+        finally:
+            results.put(None)
+            thread.join()
+        if errors:
+            raise errors[0]
 
 
 if __name__ == "__main__":
@@ -1,83 +1,23 @@
 #!/usr/bin/env python
 
-import time
-
 from affine import Affine
 import click
+from concurrent.futures import ProcessPoolExecutor
 import datetime
+import multiprocessing
+import queue
 from netCDF4 import Dataset
 import numpy as np
 import numpy.ma as ma
 import rasterio
 from rasterio.coords import BoundingBox
-from rasterio.crs import CRS
 from rasterio.transform import rowcol
 from rasterio.windows import Window
 
+from .. import nc_utils
 from .. import utils
 
 
-def init_nc(dst_ds, transform, lats, lons, years, variables):
-    # Set attributes
-    dst_ds.setncattr("Conventions", "CF-1.5")
-    dst_ds.setncattr("GDAL", "GDAL 1.11.3, released 2015/09/16")
-
-    # Create dimensions
-    dst_ds.createDimension("time", None)
-    dst_ds.createDimension("lat", len(lats))
-    dst_ds.createDimension("lon", len(lons))
-
-    # Create variables
-    times = dst_ds.createVariable(
-        "time", "i4", ("time"), zlib=True
-    )
-    latitudes = dst_ds.createVariable(
-        "lat", "f4", ("lat"), zlib=True, least_significant_digit=3
-    )
-    longitudes = dst_ds.createVariable(
-        "lon", "f4", ("lon"), zlib=True, least_significant_digit=3
-    )
-    crs = dst_ds.createVariable("crs", "S1", ())
-
-    # Add metadata
-    dst_ds.history = "Created at " + time.ctime(time.time())
-    dst_ds.source = "gen-sps.py"
-    latitudes.units = "degrees_north"
-    latitudes.long_name = "latitude"
-    longitudes.units = "degrees_east"
-    longitudes.long_name = "longitude"
-    times.units = "days since 1970-01-01 00:00:00.0"
-    times.calendar = "gregorian"
-    times.standard_name = "time"
-    times.axis = "T"
-
-    # Assign data to variables
-    latitudes[:] = lats
-    longitudes[:] = lons
-    epoch = datetime.datetime(1970, 1, 1)
-    times[:] = [(datetime.datetime(y, 1, 1) - epoch).days for y in years]
-
-    crs.grid_mapping_name = "latitude_longitude"
-    crs.spatial_ref = CRS.from_epsg(4326).to_wkt()
-    crs.GeoTransform = " ".join(map(str, transform))
-    crs.longitude_of_prime_meridian = 0
-
-    out = {}
-    for name, dtype, units, fill in variables:
-        dst_data = dst_ds.createVariable(
-            name,
-            dtype,
-            ("time", "lat", "lon"),
-            zlib=True,
-            least_significant_digit=4,
-            fill_value=fill,
-        )
-        dst_data.units = units
-        dst_data.grid_mapping = "crs"
-        out[name] = dst_data
-    return out
-
-
 def round_window(win):
     return win.round_offsets('floor').round_lengths('ceil')
 
@@ -105,14 +45,6 @@ def get_transform(bounds, res):
     return xform # , window.width, window.height
 
 
-def get_lat_lon(affine, width, height):
-    ul = affine * (0.5, 0.5)
-    lr = affine * (width - 0.5, height - 0.5)
-    lats = np.linspace(ul[1], lr[1], height)
-    lons = np.linspace(ul[0], lr[0], width)
-    return lats, lons
-
-
 def mixing(year):
     if year % 10 == 0:
         return [year]
@@ -120,14 +52,131 @@ def mixing(year):
     return (y0, y0 + 10)
 
 
-def resample(data, width, height, factor):
-    return data.reshape(height, factor, width, factor).sum(3).sum(1)
+class DecadeCache(object):
+    """Holds the SPS data of at most two decades.
+
+    Interpolating year y only needs the decades that bracket it so, as
+    years are processed in order, the oldest decade is dropped when a
+    third one is needed.  The log of every decade is computed once when
+    it is read and kept with the raw data (and the mask) so decade years
+    are written exactly as read.
+
+    """
+
+    def __init__(self, ssp, window, size=2):
+        self.ssp = ssp
+        self.window = window
+        self.size = size
+        self.decades = {}
+
+    def __getitem__(self, year):
+        if year not in self.decades:
+            if len(self.decades) >= self.size:
+                del self.decades[min(self.decades)]
+            with rasterio.open(utils.sps(self.ssp, year)) as ds:
+                data = ds.read(1, masked=True, window=self.window, boundless=True)
+            self.decades[year] = log_data(data)
+        return self.decades[year]
+
+
+def log_data(data):
+    """Returns the data of a masked array (a plain array), its log (-inf
+    for zeros and NaN for negative values) and its mask."""
+    mask = ma.getmaskarray(data)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logs = np.log(data.filled(1))
+    return ma.getdata(data), logs, mask
+
+
+def interpolate(d0, d1, f0, out):
+    """Linear mix of two decades in log-space, i.e.
+
+      exp((1 - f) * ln(a) + f * ln(b)) == a ** (1 - f) * b ** f
+
+    computed in place in `out' (a plain array) from the tuples returned
+    by log_data().  Returns the mask of the result.
+
+    """
+    (_, log0, mask0), (_, log1, mask1) = d0, d1
+    np.multiply(log0, 1 - f0, out=out)
+    out += f0 * log1
+    np.exp(out, out=out)
+    return mask0 | mask1 | np.isnan(out)
+
+
+def resample(data, mask, width, height, factor):
+    """Aggregate (sum) factor x factor blocks of cells.  A block is masked
+    only when all of its cells are."""
+    blocks = np.where(mask, 0, data).reshape(height, factor, width, factor)
+    out = blocks.sum(3).sum(1)
+    return ma.array(out, mask=mask.reshape(height, factor, width, factor).all(
+        axis=(1, 3)))
+
+
+# Queue the SSP workers send their results to and event the parent sets
+# to stop them (set in each worker).
+_results = None
+_stop = None
+
+
+def _init_worker(results, stop):
+    global _results, _stop
+    _results, _stop = results, stop
+    # The parent drains the queue until every worker is done; don't let a
+    # worker hang on exit flushing items nobody reads.
+    _results.cancel_join_thread()
+
+
+def _send(item):
+    """Put an item on the results queue.  Gives up (returns False) once
+    the parent sets the stop event, so a worker never blocks forever on
+    a full queue the parent no longer reads."""
+    while not _stop.is_set():
+        try:
+            _results.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def process_ssp(ssp, years, src_window, width, height, factor):
+    """Compute every year of an SSP and send (ssp, idx, array) tuples to
+    the results queue.  Errors are sent to the queue too.  Stops early
+    when the parent sets the stop event."""
+    try:
+        cache = DecadeCache(ssp, src_window)
+        mixed = None
+        for idx, year in enumerate(years):
+            yy = mixing(year)
+            if len(yy) == 1:
+                data, _, mask = cache[yy[0]]
+            else:
+                d0, d1 = cache[yy[0]], cache[yy[1]]
+                if mixed is None:
+                    mixed = np.empty_like(d0[1])
+                mask = interpolate(d0, d1, (year % 10) / 10.0, mixed)
+                data = mixed
+            arr = resample(data, mask, width, height, factor)
+            arr.set_fill_value(-9999)
+            if not _send((ssp, idx, arr)):
+                return
+    except Exception as e:
+        _send(e)
 
 
 @click.command()
 @click.argument("resolution", type=click.Choice(("rcp", "luh2")))
 @click.option("-d", "--density", is_flag=True, default=False)
-def main(resolution, density):
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.INT,
+    default=None,
+    metavar="jobs",
+    help="Number of SSPs to process in parallel (default: 2)",
+)
+def main(resolution, density, jobs):
     years = range(2010, 2101)
     ssps = ["ssp%d" % i for i in range(1, 6)]
     variables = [(ssp, "f4", "ppl", -9999) for ssp in ssps]
@@ -140,36 +189,64 @@ def main(resolution, density):
             bounds = BoundingBox(*ref.window_bounds(window))
             src_window = round_window(src.window(*bounds))
             xform = get_transform(bounds, ref.res)
-    lats, lons = get_lat_lon(xform, window.width, window.height)
     oname = f"%s/{resolution}/sps.nc" % utils.outdir()
-    with Dataset(oname, "w") as out:
-        data = init_nc(out, xform.to_gdal(), lats, lons, years, variables)
-
-        for ssp in ssps:
-            print(ssp)
-            source = {}
-            with click.progressbar(enumerate(years), length=len(years)) as bar:
-                for idx, year in bar:
-                    yy = mixing(year)
-                    for yyy in yy:
-                        if yyy not in source:
-                            ds = rasterio.open(utils.sps(ssp, yyy))
-                            source[yyy] = ds.read(1, masked=True,
-                                                  window=src_window,
-                                                  boundless=True)
-                    if len(yy) == 1:
-                        mixed = source[yy[0]]
-                    else:
-                        f0 = (year % 10) / 10.0
-                        # This is the equivalent of a linear mix in log-space, i.e.
-                        # exp((1 - f) * ln(a) + f * ln(b))
-                        mixed = ma.power(source[yy[0]], 1 - f0) * ma.power(
-                            source[yy[1]], f0
-                        )
-                    arr = resample(mixed, window.width, window.height, factor)
-                    arr.set_fill_value(-9999)
-                    # arr = ma.masked_equal(arr, -9999)
-                    data[ssp][idx, :, :] = arr
+    epoch = datetime.datetime(1970, 1, 1)
+    days = [(datetime.datetime(y, 1, 1) - epoch).days for y in years]
+    # Every worker holds two decades (and a few full-size temporaries) so
+    # memory, not CPUs, limits the number of workers.
+    jobs = min(jobs or 2, len(ssps))
+    # Every SSP is computed by a worker process; this process writes the
+    # results (in whatever order they arrive) as they come.  The queue is
+    # bounded so a slow writer stalls the workers instead of piling up
+    # arrays in memory.
+    results = multiprocessing.Queue(maxsize=2 * jobs)
+    stop = multiprocessing.Event()
+    with Dataset(oname, "w") as out, nc_utils.StepWriter(
+        nc_utils.init_nc(
+            out,
+            xform,
+            window.width,
+            window.height,
+            days,
+            variables,
+            time_units="days since 1970-01-01 00:00:00.0",
+            time_dtype="i4",
+            source="gen-sps.py",
+        )
+    ) as writer, ProcessPoolExecutor(
+        jobs, initializer=_init_worker, initargs=(results, stop)
+    ) as pool:
+        futures = [
+            pool.submit(process_ssp, ssp, years, src_window, window.width,
+                        window.height, factor)
+            for ssp in ssps
+        ]
+        try:
+            with click.progressbar(length=len(ssps) * len(years)) as bar:
+                for _ in range(len(ssps) * len(years)):
+                    while True:
+                        try:
+                            item = results.get(timeout=1)
+                            break
+                        except queue.Empty:
+                            for future in futures:
+                                if future.done() and future.exception():
+                                    raise future.exception()
+                    if isinstance(item, Exception):
+                        raise item
+                    writer.write_step(*item)
+                    bar.update(1)
+        finally:
+            # On error, stop the workers (and SSPs not started yet) and
+            # drain the queue so none is left blocked on a put().
+            stop.set()
+            for future in futures:
+                future.cancel()
+            while not all(future.done() for future in futures):
+                try:
+                    results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
     return
 
 
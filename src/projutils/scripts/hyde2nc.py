@@ -1,17 +1,18 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ProcessPoolExecutor
+import functools
 import os
 import re
-import time
 
 import click
 from netCDF4 import Dataset
-import numpy as np
-import osr
 import rasterio
 
-from .. import geotools
+from .. import nc_utils
+from .. import raster_utils
 from .. import utils
+from ..hpd import hyde
 
 
 def adbc_conv(ss):
@@ -46,7 +47,15 @@ def get_years(hdir):
 @click.option(
     "--start-year", type=int, default=0, help="Start from given year (default: 0AD)"
 )
-def main(version, outdir, start_year):
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.INT,
+    default=None,
+    metavar="jobs",
+    help="Number of years to decode in parallel (default: one per CPU)",
+)
+def main(version, outdir, start_year, jobs):
     oname = os.path.join(outdir, "hyde-%s.nc" % version)
     variables = tuple(
         [(layer, "f4", "ppl/km^2", -9999, "time") for layer in utils.hyde_variables()]
@@ -56,81 +65,30 @@ def main(version, outdir, start_year):
     )
     with Dataset(oname, "w") as out:
         with rasterio.open(utils.hyde_area()) as area_ds:
-            init_nc(out, area_ds, years, variables)
-            with click.progressbar(years, length=len(years)) as bar:
-                for year in bar:
-                    idx = years.index(year)
-                    for variable in utils.hyde_variables():
-                        with rasterio.open(
-                            utils.hyde_raw(version, year, variable)
-                        ) as ds:
-                            data = ds.read(1, masked=True)
-                            out.variables[variable][idx, :, :] = data
-
-
-def init_nc(dst_ds, src_ds, steps, variables):
-    # Set attributes
-    dst_ds.setncattr("Conventions", u"CF-1.5")
-    dst_ds.setncattr("GDAL", u"GDAL 1.11.3, released 2015/09/16")
-
-    # Create dimensions
-    dst_ds.createDimension("time", len(steps))
-    dst_ds.createDimension("lat", src_ds.height)
-    dst_ds.createDimension("lon", src_ds.width)
-
-    # Create variables
-    times = dst_ds.createVariable(
-        "time", "f8", ("time"), zlib=True, least_significant_digit=3
-    )
-    latitudes = dst_ds.createVariable(
-        "lat", "f4", ("lat"), zlib=True, least_significant_digit=3
-    )
-    longitudes = dst_ds.createVariable(
-        "lon", "f4", ("lon"), zlib=True, least_significant_digit=3
-    )
-    crs = dst_ds.createVariable("crs", "S1", ())
-
-    # Add metadata
-    dst_ds.history = "Created at " + time.ctime(time.time())
-    dst_ds.source = "hyde2nc.py"
-    latitudes.units = "degrees_north"
-    latitudes.long_name = "latitude"
-    longitudes.units = "degrees_east"
-    longitudes.long_name = "longitude"
-    times.units = "years since 0000-01-01 00:00:00.0"
-    times.calendar = "gregorian"
-    times.standard_name = "time"
-    times.axis = "T"
-
-    # Assign data to variables
-    ul = src_ds.affine * (0.5, 0.5)
-    lr = src_ds.affine * (src_ds.width - 0.5, src_ds.height - 0.5)
-    latitudes[:] = np.linspace(ul[1], lr[1], src_ds.height)
-    longitudes[:] = np.linspace(ul[0], lr[0], src_ds.width)
-    times[:] = steps
-
-    srs = osr.SpatialReference()
-    srs.ImportFromWkt(geotools.WGS84_WKT)
-    src_trans = src_ds.affine.to_gdal()
-    crs.grid_mapping_name = "latitude_longitude"
-    crs.spatial_ref = srs.ExportToWkt()
-    crs.GetTransform = " ".join(tuple(map(str, src_trans)))
-    # FIXME: Attribute getters don't work in python3 or GDAL2
-    crs.longitude_of_prime_meridian = geotools.srs_get_prime_meridian(srs)
-    crs.semi_major_axis = geotools.srs_get_semi_major(srs)
-    crs.inverse_flattening = geotools.srs_get_inv_flattening(srs)
-
-    for name, dtype, units, fill, dimension in variables:
-        dst_data = dst_ds.createVariable(
-            name,
-            dtype,
-            (dimension, "lat", "lon"),
-            zlib=True,
-            least_significant_digit=4,
-            fill_value=fill,
-        )
-        dst_data.units = units
-        dst_data.grid_mapping = "crs"
+            writer = nc_utils.StepWriter(
+                nc_utils.init_nc(
+                    out,
+                    area_ds.transform,
+                    area_ds.width,
+                    area_ds.height,
+                    years,
+                    variables,
+                    unlimited=False,
+                    source="hyde2nc.py",
+                )
+            )
+            # Years are decoded in worker processes (each opens its
+            # archive once) and written in order by this process.
+            jobs = jobs or os.cpu_count()
+            decode = functools.partial(hyde.read_archive, version)
+            with writer, ProcessPoolExecutor(jobs) as pool:
+                with click.progressbar(length=len(years)) as bar:
+                    for idx, (year, grids) in enumerate(
+                        raster_utils.imap_ordered(pool, decode, years, jobs)
+                    ):
+                        for variable, data in grids.items():
+                            writer.write_step(variable, idx, data)
+                        bar.update(1)
 
 
 if __name__ == "__main__":
@@ -144,7 +144,15 @@ def rcp():
     help="Directory where to store (or read from) land-use rasters"
     + " (default: /out/lu/rcp/<scenario>)",
 )
-def extract(tarfile, years, raster_dir):
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.INT,
+    default=None,
+    metavar="jobs",
+    help="Number of rasters to convert in parallel (default: one per CPU)",
+)
+def extract(tarfile, years, raster_dir, jobs):
     """Extract RCS land-use data for the a specific <scenario>.
 
     RCP land-use data is distributed as a large, compressed tar file.
@@ -157,7 +165,7 @@ def extract(tarfile, years, raster_dir):
 
     if raster_dir is None:
         raster_dir = os.path.join("ds", "lu", "rcp")
-    lu.rcp.extract(tarfile, raster_dir, years)
+    lu.rcp.extract(tarfile, raster_dir, years, jobs)
 
 
 @rcp.command()
@@ -177,7 +185,15 @@ def extract(tarfile, years, raster_dir):
     + "non-zero pixels are considered water or ice "
     + "(default: %s)" % lu.rcp.icew_mask(),
 )
-def project(scenario, years, mask, name):
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.INT,
+    default=None,
+    metavar="jobs",
+    help="Number of years to project in parallel (default: one per CPU)",
+)
+def project(scenario, years, mask, name, jobs):
 
     """Project (convert) RCS land-use for the year(s) given.
 
@@ -189,7 +205,7 @@ def project(scenario, years, mask, name):
     years    -- Year range to project, e.g. 2005 or 2010:2050
     """
     out_dir = os.path.join("ds", "lu", "rcp", scenario)
-    lu.rcp.process(out_dir, years, mask, name)
+    lu.rcp.process(out_dir, years, mask, name, jobs)
 
 
 #
@@ -326,9 +342,16 @@ def roads():
 @roads.command()
 @click.argument("roads-db", type=click.Path())
 @click.argument("shape-file", type=click.File(mode="rw"))
-def compute(roads_db, shape_file):
+@click.option(
+    "-j",
+    type=click.INT,
+    default=None,
+    help="Number of parallel workers (default: one per CPU)",
+    metavar="jobs",
+)
+def compute(roads_db, shape_file, j):
     """Compute the distance to the nearest road for each site in the
-    PREDICTS database.
+    PREDICTS database.  Distances are great circle distances in km.
 
       \b
       roads_db   -- Path to the roads database
@@ -338,7 +361,7 @@ def compute(roads_db, shape_file):
     """
 
     click.echo("Computing distance to nearest road for each site")
-    groads.compute_distance(roads_db, shape_file)
+    groads.compute_distance(roads_db, shape_file, j)
 
 
 @roads.command()
@@ -350,13 +373,36 @@ def compute(roads_db, shape_file):
     help="name of destination raster file",
 )
 @click.option("--resolution", type=float, default=0.5, help="output resolution")
-def proximity(roads_db, resolution, dst_raster=None):
+@click.option(
+    "--units",
+    type=click.Choice(["geo", "km"]),
+    default="geo",
+    help="Distance units: degrees (geo) or great circle km (default: geo)",
+)
+@click.option(
+    "--max-distance",
+    type=float,
+    default=None,
+    help="Maximum search distance (in units); processes the raster in tiles and "
+    "sets farther cells to NoData (default: no cutoff)",
+)
+@click.option("--cog", is_flag=True, help="Write a Cloud Optimized GeoTIFF")
+@click.option(
+    "-j",
+    type=click.INT,
+    default=None,
+    help="Number of parallel workers (default: one per CPU)",
+    metavar="jobs",
+)
+def proximity(roads_db, resolution, units, max_distance, cog, j, dst_raster=None):
     """Generate a raster with proximity to roads for every cell.
 
     Compute a raster whose value is the distance to the nearest cell with
     a road.  It does this by generating a raster that has a 1 in each cell
-    through which a road passes and then computing the Euclidean distance
-    for each cell.
+    through which a road passes and then computing the distance for each
+    cell.  With --max-distance the raster is processed in tiles, each with
+    a halo as wide as the maximum search distance, and cells farther from
+    a road are NoData.
 
     \b
     roads_db   --  Path to the roads database
@@ -367,7 +413,15 @@ def proximity(roads_db, resolution, dst_raster=None):
             utils.data_root(), "groads1.0/groads-v1-global-gdb/gROADS_v1.gdb"
         )
     utils.mkpath(os.path.dirname(dst_raster.name))
-    groads.proximity(roads_db, resolution, dst_raster.name)
+    groads.proximity(
+        roads_db,
+        resolution,
+        dst_raster.name,
+        units=units,
+        max_distance=max_distance,
+        jobs=j,
+        cog=cog,
+    )
 
 
 @roads.command()
@@ -405,7 +459,30 @@ def proximity(roads_db, resolution, dst_raster=None):
     default=1.0,
     help="Maximum value in output scale (default: 1.0)",
 )
-def regularize(src_raster, dst_raster, band=1, offset=1, min=0.0, max=1.0):
+@click.option(
+    "--streaming/--in-memory",
+    default=True,
+    help="Process the raster one block at a time rather than reading it"
+    + " into memory (default: streaming)",
+)
+@click.option(
+    "-j",
+    type=click.INT,
+    default=None,
+    help="Number of parallel workers when streaming (default: one per CPU;"
+    + " rasters with only a few blocks are processed serially)",
+    metavar="jobs",
+)
+def regularize(
+    src_raster,
+    dst_raster,
+    band=1,
+    offset=1,
+    min=0.0,
+    max=1.0,
+    streaming=True,
+    j=None,
+):
     """Regularize distance to nearest road raster.
 
       Because distance to nearest road is a continuous variable in the
@@ -414,7 +491,9 @@ def regularize(src_raster, dst_raster, band=1, offset=1, min=0.0, max=1.0):
     """
 
     click.echo("Regularizing distance to nearest road raster")
-    groads.regularize(src_raster.name, dst_raster.name, band, offset, min, max)
+    groads.regularize(
+        src_raster.name, dst_raster.name, band, offset, min, max, streaming, j
+    )
 
 
 #
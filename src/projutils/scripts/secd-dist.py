@@ -9,27 +9,172 @@ classes match those defined by the PREDICTS database.
 
 """
 
+from concurrent.futures import ProcessPoolExecutor
 import os
+import queue
 import re
-import time
+import threading
 
+from affine import Affine
 import click
 from netCDF4 import Dataset
 import numpy as np
 import numpy.ma as ma
-import osr
 
-import projections.geotools as geotools
-import projections.utils as utils
+import projutils.nc_utils as nc_utils
+import projutils.utils as utils
 
 BINS = 52
 
-
-def sum_layers(ds, idx, layers, out):
-    out.fill(0)
-    for layer in layers:
-        out += ds.variables[layer][idx]
-    return
+# The netCDF/HDF5 libraries are not thread-safe.  Every access to a
+# Dataset from a process that runs a YearLoader must hold this lock.
+NC_LOCK = threading.Lock()
+
+
+class AgeBins(object):
+    """Ring buffer of secondary vegetation age bins.
+
+    Logical bin 0 holds the secondary added this year, bins 1 to 49 the
+    secondary of that age, bin 50 the mature (50+ years) secondary and
+    bin 51 the total.  Aging the bins by one year rotates the buffer by
+    moving the index of bin 0 rather than copying the whole cube.
+
+    """
+
+    def __init__(self, data, head=0):
+        # Give the cube a full mask so every bin (a view) shares it.
+        if ma.getmask(data) is ma.nomask:
+            data.mask = np.zeros(data.shape, dtype=bool)
+        self.data = data
+        self.head = head
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def _index(self, idx):
+        return (self.head + idx) % len(self)
+
+    def __getitem__(self, idx):
+        return self.data[self._index(idx)]
+
+    def __setitem__(self, idx, value):
+        self.data[self._index(idx)] = value
+
+    def put(self, idx, value):
+        """Store `value' in bin `idx'.  Cells masked in the bin stay
+        masked, as when summing `value' into the bin in place."""
+        idx = self._index(idx)
+        np.copyto(ma.getdata(self.data)[idx], ma.getdata(value))
+        self.data.mask[idx] |= ma.getmaskarray(value)
+
+    def sum(self, start, stop, out):
+        """Sum (in bin order) bins [start, stop) into `out' (a masked
+        array) like ma.sum(axis=0): masked entries count as 0 and a cell
+        is only masked if it is masked in every bin."""
+        if ma.getmask(out) is ma.nomask:
+            out.mask = np.zeros(out.shape, dtype=bool)
+        data = ma.getdata(out)
+        mask = ma.getmask(out)
+        first = self[start]
+        np.copyto(data, ma.getdata(first))
+        np.copyto(mask, ma.getmaskarray(first))
+        data[mask] = 0
+        for idx in range(start + 1, stop):
+            layer = self[idx]
+            layer_mask = ma.getmask(layer)
+            if layer_mask is ma.nomask:
+                data += ma.getdata(layer)
+                mask.fill(False)
+            else:
+                np.add(data, ma.getdata(layer), out=data, where=~layer_mask)
+                mask &= layer_mask
+        return out
+
+    def scale(self, start, stop, frac):
+        """Multiply bins [start, stop) by `frac'."""
+        for idx in range(start, stop):
+            self[idx] *= frac
+
+    def age(self):
+        """Age every bin by one year."""
+        self[-3] += self[-2]
+        self.sum(0, len(self) - 2, self[-2])
+        self.head = (self.head - 1) % len(self)
+
+
+class YearLoader(object):
+    """Read the transitions and states needed for every year.
+
+    Each transition variable is read (and decompressed) once per year and
+    added in place to the sum of every group it belongs to.  A background
+    thread reads year t + 1 while the caller works on year t; two sets of
+    buffers are used in turn so nothing is allocated per year.
+
+    Iterating yields (idx, sums, states) tuples where `sums' maps group
+    names to the sum of their variables and `states' maps state names to
+    their value.  Both are only valid until the next iteration.  Every
+    year the sums start from zero masked like `template'.
+
+    """
+
+    def __init__(self, trans, state, groups, states, indexes, template):
+        self.trans = trans
+        self.state = state
+        self.groups = groups
+        self.states = states
+        self.indexes = indexes
+        # Read variables in file order so every sum is accumulated in the
+        # same order as adding the variables of a group one by one.
+        members = set(v for names in groups.values() for v in names)
+        self.variables = [v for v in trans.variables.keys() if v in members]
+        self.mask = ma.getmaskarray(template).copy()
+        self.free = queue.Queue()
+        for _ in range(2):
+            self.free.put(dict((name, ma.empty_like(template)) for name in groups))
+        self.ready = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _read(self, idx, sums):
+        for buf in sums.values():
+            # fill() only resets the data; reset the mask too so masks
+            # do not carry over from the previous years.
+            buf.fill(0)
+            buf.mask = self.mask
+        for name in self.variables:
+            with NC_LOCK:
+                layer = self.trans.variables[name][idx]
+            for group, names in self.groups.items():
+                if name in names:
+                    sums[group] += layer
+        with NC_LOCK:
+            states = dict(
+                (name, self.state.variables[name][idx]) for name in self.states
+            )
+        return sums, states
+
+    def _run(self):
+        try:
+            for idx in self.indexes:
+                sums, states = self._read(idx, self.free.get())
+                self.ready.put((idx, sums, states))
+        except Exception as e:
+            self.ready.put(e)
+            return
+        self.ready.put(None)
+
+    def __iter__(self):
+        self.thread.start()
+        previous = None
+        while True:
+            item = self.ready.get()
+            if previous is not None:
+                self.free.put(previous)
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            previous = item[1]
+            yield item
 
 
 def find_frac(values, tot, frac):
@@ -42,7 +187,7 @@ def find_frac(values, tot, frac):
 
 def dorem(values, remove, frac):
     find_frac(values, remove, frac)
-    values[1:-1] *= np.broadcast_to(frac, values[1:-1].shape)
+    values.scale(1, len(values) - 1, frac)
     return
 
 
@@ -52,25 +197,112 @@ def to_year(scenario, idx):
     return idx + 2015
 
 
-def asserts(state, idx, name, values, atol):
+def asserts(secd, values, atol):
     assert np.all(values[0] <= 1.0 + atol), "current > 1"
     assert np.all(values[0] >= 0.0 - atol), "current < 0"
-    secd = state.variables[name][idx]
     assert np.allclose(values[-1] - secd, 0, atol=atol)
 
 
-def write_data(out, fnf, idx, values):
-    out.variables["secdy%s" % fnf][idx, :, :] = values[0:30].sum(axis=0)
-    out.variables["secdi%s" % fnf][idx, :, :] = values[30:50].sum(axis=0)
+def write_data(out, fnf, idx, values, scratch):
+    out.variables["secdy%s" % fnf][idx, :, :] = values.sum(0, 30, scratch)
+    out.variables["secdi%s" % fnf][idx, :, :] = values.sum(30, 50, scratch)
     out.variables["secdm%s" % fnf][idx, :, :] = values[50]
 
 
 def write_bins(out, vname, values):
     # FIXME: verify masked values are written and read correctly.
-    out.variables[vname][:] = values
+    for idx in range(len(values)):
+        out.variables[vname][idx, :, :] = values[idx]
     return values
 
 
+def read_bins(ds, vname):
+    return AgeBins(ds.variables[vname][:])
+
+
+def checkpoint(out, next_index, valuesf, valuesn):
+    """Save the state of the bins so a run can resume at `next_index'.
+
+    The checkpoint index is invalidated while the bins are written so an
+    interrupted checkpoint is never mistaken for a good one.
+
+    """
+    out.setncattr("checkpoint_index", -1)
+    out.sync()
+    write_bins(out, "binsf", valuesf)
+    write_bins(out, "binsn", valuesn)
+    out.setncattr("checkpoint_index", next_index)
+    out.sync()
+
+
+def checkpoint_index(fname):
+    """Return the index from which the run saved in `fname' can resume (or
+    None if there is no valid checkpoint).
+
+    """
+    if not os.path.isfile(fname):
+        return None
+    with Dataset(fname) as ds:
+        if "checkpoint_index" not in ds.ncattrs():
+            return None
+        index = int(ds.getncattr("checkpoint_index"))
+    return index if index >= 0 else None
+
+
+def bins_file(outdir, vname, part):
+    return os.path.join(outdir, "secd-historical-%s-%s.npy" % (vname, part))
+
+
+def bins_exported(outdir, vname):
+    """True if the exported bins are newer than secd-historical.nc."""
+    hname = os.path.join(outdir, "secd-historical.nc")
+    mname = bins_file(outdir, vname, "mask")
+    return os.path.isfile(mname) and os.path.getmtime(mname) >= os.path.getmtime(hname)
+
+
+def export_bins(outdir):
+    """Save the final historical bins as .npy files (data and mask) that
+    future scenarios can memory map.
+
+    """
+    for vname in ("binsf", "binsn"):
+        if bins_exported(outdir, vname):
+            continue
+        with Dataset(os.path.join(outdir, "secd-historical.nc")) as hist:
+            bins = hist.variables[vname][:]
+        # Write the mask last: its timestamp marks a complete export.
+        np.save(bins_file(outdir, vname, "data"), ma.getdata(bins))
+        np.save(bins_file(outdir, vname, "mask"), ma.getmaskarray(bins))
+
+
+def shared_bins(outdir, vname):
+    """Map the historical bins saved by export_bins().
+
+    The mapping is copy-on-write: pages are shared between processes
+    until a scenario modifies them.
+
+    """
+    data = np.load(bins_file(outdir, vname, "data"), mmap_mode="c")
+    mask = np.load(bins_file(outdir, vname, "mask"), mmap_mode="c")
+    return AgeBins(ma.array(data, mask=mask, copy=False, fill_value=-9999))
+
+
+def scenario_footprint(outdir):
+    """Estimate the memory (in bytes) one future scenario needs: two
+    52-bin cubes (data and mask) plus the per-year buffers.
+
+    """
+    with Dataset(os.path.join(outdir, "secd-historical.nc")) as hist:
+        cells = len(hist.dimensions["lat"]) * len(hist.dimensions["lon"])
+    # 2 cubes + 2 x 4 loader buffers + bin 0, scratch and frac
+    layers = 2 * BINS + 8 + 3
+    return layers * cells * (np.dtype("f4").itemsize + 1)
+
+
+def physical_memory():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
 def init_values(state, vname, start_index, mask):
     shape = state.variables[vname].shape
     values = ma.zeros(
@@ -79,13 +311,7 @@ def init_values(state, vname, start_index, mask):
     values.mask = np.broadcast_to(mask == 1.0, values.shape)
     values[-1] = state.variables[vname][start_index]
     values[-2] = state.variables[vname][start_index]
-    return values
-
-
-def roll_values(values):
-    values[-3] += values[-2]
-    values[-2] = values[0:-2].sum(axis=0)
-    return np.roll(values, 1, 0)
+    return AgeBins(values)
 
 
 def neg_re(fnf):
@@ -96,6 +322,137 @@ def pos_re(fnf):
     return r"^(?!secd{fnf}).*_to_secd{fnf}$|prim{fnf}_harv$".format(fnf=fnf)
 
 
+VARIABLES = tuple(
+    [
+        (x % fnf, "f4", "1", -9999, "time")
+        for fnf in ("f", "n")
+        for x in ("secd%s%%s" % n for n in ("y", "i", "m"))
+    ]
+    # Bins are stored losslessly so runs can resume exactly.
+    + [("bins%s" % fnf, "f4", "1", -9999, "bins", None) for fnf in ("f", "n")]
+)
+
+
+def run_scenario(scenario, outdir, start_index=0, resume=False, every=10):
+    """Compute the secondary age distribution for one scenario.
+
+    The historical scenario starts from the LUH2 states; every other
+    scenario starts from the bins saved at the end of the historical run
+    (in secd-historical.nc).  The bins are saved to the output every
+    `every' years so an interrupted run can `resume' from the last
+    checkpoint.
+
+    """
+    oname = os.path.join(outdir, "secd-%s.nc" % scenario)
+    tname = utils.luh2_transitions(scenario)
+    sname = utils.luh2_states(scenario)
+    if not (os.path.isfile(tname) and os.path.isfile(sname)):
+        click.echo("skipping %s" % scenario)
+        return
+    click.echo("%s -> %s" % (scenario, oname))
+    atol = 5e-5
+
+    resume_index = checkpoint_index(oname) if resume else None
+    with Dataset(oname, "w" if resume_index is None else "a") as out:
+        click.echo(sname)
+        click.echo(tname)
+        with Dataset(tname) as trans:
+            with Dataset(sname) as state:
+                if resume_index is not None:
+                    year = to_year(scenario, resume_index)
+                    click.echo("  resuming from year %d" % year)
+                    start_index = resume_index
+                    valuesf = read_bins(out, "binsf")
+                    valuesn = read_bins(out, "binsn")
+                else:
+                    _ = init_nc(out, state)
+                    if scenario == "historical":
+                        static = Dataset(
+                            os.path.join(utils.luh2_dir(), "staticData_quarterdeg.nc")
+                        )
+                        icwtr = static.variables["icwtr"][:, :]
+                        # Create a 3-D array to hold the last 50 years (plus 2)
+                        valuesf = init_values(state, "secdf", start_index, icwtr)
+                        valuesn = init_values(state, "secdn", start_index, icwtr)
+                    elif bins_exported(outdir, "binsf") and bins_exported(
+                        outdir, "binsn"
+                    ):
+                        valuesf = shared_bins(outdir, "binsf")
+                        valuesn = shared_bins(outdir, "binsn")
+                    else:
+                        with Dataset(
+                            os.path.join(outdir, "secd-historical.nc")
+                        ) as hist:
+                            valuesf = read_bins(hist, "binsf")
+                            valuesn = read_bins(hist, "binsn")
+
+                scratch = ma.empty_like(valuesf[0])
+                if resume_index is None:
+                    # Write initial data to output.
+                    valuesf[0].fill(0)
+                    valuesn[0].fill(0)
+                    write_data(out, "f", start_index, valuesf, scratch)
+                    write_data(out, "n", start_index, valuesn, scratch)
+
+                frac = ma.empty_like(valuesf[0])
+                posf = tuple(
+                    filter(lambda x: re.match(pos_re("f"), x), trans.variables.keys())
+                )
+                posn = tuple(
+                    filter(lambda x: re.match(pos_re("n"), x), trans.variables.keys())
+                )
+                negf = tuple(
+                    filter(lambda x: re.match(neg_re("f"), x), trans.variables.keys())
+                )
+                negn = tuple(
+                    filter(lambda x: re.match(neg_re("n"), x), trans.variables.keys())
+                )
+                click.echo("  " + ", ".join(posf))
+                click.echo("  " + ", ".join(negf))
+                click.echo("  " + ", ".join(posn))
+                click.echo("  " + ", ".join(negn))
+                last = trans.variables["time"].shape[0]
+                loader = YearLoader(
+                    trans,
+                    state,
+                    {"posf": posf, "negf": negf, "posn": posn, "negn": negn},
+                    ("secdf", "secdn"),
+                    range(start_index, last),
+                    valuesf[0],
+                )
+                for idx, sums, states in loader:
+                    click.echo("  year %d" % to_year(scenario, idx))
+                    # Compute transitions from / to secondary.
+                    valuesf.put(0, sums["posf"])
+                    # Adjust secondary history
+                    dorem(valuesf, sums["negf"], frac)
+
+                    # Repeat for non-forested
+                    valuesn.put(0, sums["posn"])
+                    dorem(valuesn, sums["negn"], frac)
+
+                    # Check consistency of data.
+                    asserts(states["secdf"], valuesf, atol)
+                    asserts(states["secdn"], valuesn, atol)
+
+                    # Write data to output.
+                    with NC_LOCK:
+                        write_data(out, "f", idx + 1, valuesf, scratch)
+                        write_data(out, "n", idx + 1, valuesn, scratch)
+
+                    # Rotate the bins.
+                    valuesf.age()
+                    valuesn.age()
+
+                    if (idx + 1 - start_index) % every == 0 and idx + 1 < last:
+                        with NC_LOCK:
+                            checkpoint(out, idx + 1, valuesf, valuesn)
+
+                # The final checkpoint holds the bins future scenarios
+                # start from.
+                checkpoint(out, last, valuesf, valuesn)
+
+
 @click.command()
 @click.option(
     "--scenario",
@@ -115,185 +472,83 @@ def pos_re(fnf):
     default=0,
     help="Start from given index skipping earlier years (default: 0)",
 )
-def doit(scenario, outdir, start_index=0):
-    static = Dataset(os.path.join(utils.luh2_dir(), "staticData_quarterdeg.nc"))
-    icwtr = static.variables["icwtr"][:, :]
-    atol = 5e-5
-
-    variables = tuple(
-        [
-            (x % fnf, "f4", "1", -9999, "time")
-            for fnf in ("f", "n")
-            for x in ("secd%s%%s" % n for n in ("y", "i", "m"))
-        ]
-        + [("bins%s" % fnf, "f4", "1", -9999, "bins") for fnf in ("f", "n")]
-    )
-    baselinef = None
-    baselinen = None
-
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Resume each scenario from its last checkpoint (if any)",
+)
+@click.option(
+    "--checkpoint-every",
+    type=int,
+    default=10,
+    help="Save the bins every N years (default: 10)",
+)
+@click.option(
+    "-j",
+    type=click.INT,
+    default=1,
+    help="Number of future scenarios to run in parallel",
+    metavar="jobs",
+)
+@click.option(
+    "--memory",
+    type=float,
+    default=None,
+    help="Memory budget (in GB) for parallel scenarios (default: 80% of RAM)",
+)
+def doit(
+    scenario,
+    outdir,
+    start_index=0,
+    resume=False,
+    checkpoint_every=10,
+    j=1,
+    memory=None,
+):
     if scenario == "all":
         # historical must be the first scenario processed
         scenarios = sorted(utils.luh2_scenarios())
     else:
         scenarios = [scenario]
 
-    for scenario in scenarios:
-        oname = os.path.join(outdir, "secd-%s.nc" % scenario)
-        tname = utils.luh2_transitions(scenario)
-        sname = utils.luh2_states(scenario)
-        if not (os.path.isfile(tname) and os.path.isfile(sname)):
-            click.echo("skipping %s" % scenario)
-            continue
-        click.echo("%s -> %s" % (scenario, oname))
-
-        with Dataset(oname, "w") as out:
-            click.echo(sname)
-            click.echo(tname)
-            with Dataset(tname) as trans:
-                with Dataset(sname) as state:
-                    _ = init_nc(out, state, variables)
-                    if scenario == "historical":
-                        # Create a 3-D array to hold the last 50 years (plus 2)
-                        valuesf = init_values(state, "secdf", start_index, icwtr)
-                        valuesn = init_values(state, "secdn", start_index, icwtr)
-                    elif baselinef is None or baselinen is None:
-                        with Dataset(
-                            os.path.join(outdir, "secd-historical.nc")
-                        ) as hist:
-                            valuesf = hist.variables["binsf"][:]
-                            valuesn = hist.variables["binsn"][:]
-                    else:
-                        valuesf = baselinef.copy()
-                        valuesn = baselinen.copy()
-
-                    # Write initial data to output.
-                    valuesf[0].fill(0)
-                    valuesn[0].fill(0)
-                    write_data(out, "f", start_index, valuesf)
-                    write_data(out, "n", start_index, valuesn)
-
-                    remove = ma.empty_like(valuesf[0])
-                    frac = ma.empty_like(valuesf[0])
-                    posf = tuple(
-                        filter(
-                            lambda x: re.match(pos_re("f"), x), trans.variables.keys()
-                        )
-                    )
-                    posn = tuple(
-                        filter(
-                            lambda x: re.match(pos_re("n"), x), trans.variables.keys()
-                        )
-                    )
-                    negf = tuple(
-                        filter(
-                            lambda x: re.match(neg_re("f"), x), trans.variables.keys()
-                        )
-                    )
-                    negn = tuple(
-                        filter(
-                            lambda x: re.match(neg_re("n"), x), trans.variables.keys()
-                        )
-                    )
-                    click.echo("  " + ", ".join(posf))
-                    click.echo("  " + ", ".join(negf))
-                    click.echo("  " + ", ".join(posn))
-                    click.echo("  " + ", ".join(negn))
-                    for idx in range(start_index, trans.variables["time"].shape[0]):
-                        click.echo("  year %d" % to_year(scenario, idx))
-                        # Compute transitions from / to secondary.
-                        sum_layers(trans, idx, negf, remove)
-                        sum_layers(trans, idx, posf, valuesf[0])
-                        # Adjust secondary history
-                        dorem(valuesf, remove, frac)
-
-                        # Repeat for non-forested
-                        sum_layers(trans, idx, negn, remove)
-                        sum_layers(trans, idx, posn, valuesn[0])
-                        dorem(valuesn, remove, frac)
-
-                        # Check consistency of data.
-                        asserts(state, idx, "secdf", valuesf, atol)
-                        asserts(state, idx, "secdn", valuesn, atol)
-
-                        # Write data to output.
-                        write_data(out, "f", idx + 1, valuesf)
-                        write_data(out, "n", idx + 1, valuesn)
-
-                        # Rotate the array.
-                        valuesf = roll_values(valuesf)
-                        valuesn = roll_values(valuesn)
-
-            if scenario == "historical":
-                baselinef = write_bins(out, "binsf", valuesf).copy()
-                baselinen = write_bins(out, "binsn", valuesn).copy()
-                start_index = 0
-
-
-def init_nc(dst_ds, src_ds, variables):
-    # Set attributes
-    dst_ds.setncattr("Conventions", u"CF-1.5")
-    dst_ds.setncattr("GDAL", u"GDAL 1.11.3, released 2015/09/16")
-
-    # Create dimensions
-    dst_ds.createDimension("time", None)
-    dst_ds.createDimension("lat", len(src_ds.variables["lat"]))
-    dst_ds.createDimension("lon", len(src_ds.variables["lon"]))
-    dst_ds.createDimension("bins", BINS)
-
-    # Create variables
-    times = dst_ds.createVariable(
-        "time", "f8", ("time"), zlib=True, least_significant_digit=3
-    )
-    latitudes = dst_ds.createVariable(
-        "lat", "f4", ("lat"), zlib=True, least_significant_digit=3
-    )
-    longitudes = dst_ds.createVariable(
-        "lon", "f4", ("lon"), zlib=True, least_significant_digit=3
+    if "historical" in scenarios:
+        scenarios.remove("historical")
+        run_scenario("historical", outdir, start_index, resume, checkpoint_every)
+        start_index = 0
+
+    # Future scenarios only depend on the historical bins so they can run
+    # in parallel, as many at a time as fit in the memory budget.
+    args = (outdir, start_index, resume, checkpoint_every)
+    if j > 1 and len(scenarios) > 1:
+        export_bins(outdir)
+        budget = memory * 2 ** 30 if memory else 0.8 * physical_memory()
+        fits = max(int(budget // scenario_footprint(outdir)), 1)
+        if fits < j:
+            click.echo("memory budget allows %d concurrent scenarios" % fits)
+        j = min(j, fits)
+    if j == 1 or len(scenarios) < 2:
+        for name in scenarios:
+            run_scenario(name, *args)
+    else:
+        with ProcessPoolExecutor(max_workers=j) as pool:
+            futures = [pool.submit(run_scenario, name, *args) for name in scenarios]
+            for future in futures:
+                future.result()
+
+
+def init_nc(dst_ds, src_ds):
+    return nc_utils.init_nc(
+        dst_ds,
+        Affine(0.25, 0.0, -180.0, 0.0, -0.25, 90.0),
+        len(src_ds.variables["lon"]),
+        len(src_ds.variables["lat"]),
+        src_ds.variables["time"][:],
+        VARIABLES,
+        time_units="years since 850-01-01 00:00:00.0",
+        source="secd-dist.py",
+        dims={"bins": BINS},
     )
-    crs = dst_ds.createVariable("crs", "S1", ())
-
-    # Add metadata
-    dst_ds.history = "Created at " + time.ctime(time.time())
-    dst_ds.source = "secd-dist.py"
-    latitudes.units = "degrees_north"
-    latitudes.long_name = "latitude"
-    longitudes.units = "degrees_east"
-    longitudes.long_name = "longitude"
-    times.units = "years since 850-01-01 00:00:00.0"
-    times.calendar = "gregorian"
-    times.standard_name = "time"
-    times.axis = "T"
-
-    # Assign data to variables
-    latitudes[:] = src_ds.variables["lat"][:]
-    longitudes[:] = src_ds.variables["lon"][:]
-    times[:] = src_ds.variables["time"][:]
-
-    srs = osr.SpatialReference()
-    srs.ImportFromWkt(geotools.WGS84_WKT)
-    src_trans = (-180.0, 0.25, 0.0, 90.0, 0.0, -0.25)
-    crs.grid_mapping_name = "latitude_longitude"
-    crs.spatial_ref = srs.ExportToWkt()
-    crs.GetTransform = " ".join(tuple(map(str, src_trans)))
-    # FIXME: Attribute getters don't work in python3 or GDAL2
-    crs.longitude_of_prime_meridian = geotools.srs_get_prime_meridian(srs)
-    crs.semi_major_axis = geotools.srs_get_semi_major(srs)
-    crs.inverse_flattening = geotools.srs_get_inv_flattening(srs)
-
-    out = {}
-    for name, dtype, units, fill, dimension in variables:
-        dst_data = dst_ds.createVariable(
-            name,
-            dtype,
-            (dimension, "lat", "lon"),
-            zlib=True,
-            least_significant_digit=4,
-            fill_value=fill,
-        )
-        dst_data.units = units
-        dst_data.grid_mapping = "crs"
-        out[name] = dst_data
-    return out
 
 
 if __name__ == "__main__":
@@ -5,8 +5,11 @@ except ImportError:
 import numpy as np
 import numpy.ma as ma
 import pandas as pd
+import rasterio
 import subprocess
 
+from . import raster_utils
+
 
 def get_props(fname):
     ds = gdal.Open(fname)
@@ -222,7 +225,14 @@ def get_stats(tiffs):
     return (min(low), max(high), x_size, y_size, all_bands)
 
 
-def mask(name, mask):
+def _mask_block(sources, window):
+    raster, rmask = sources
+    nodata = rmask.nodata
+    nodata_mask = rmask.read(1, window=window) == nodata
+    return np.where(nodata_mask, nodata, raster.read(1, window=window))
+
+
+def mask(name, mask, jobs=None):
     """
 
     Propagate No Data Values (NODATA) from one raster to another.  Any
@@ -231,19 +241,20 @@ def mask(name, mask):
 
     @param name filename of raster
     @param mask filename of mask raster
+    @param jobs number of parallel workers (default: see raster_utils.map_blocks)
     """
 
-    rmask = gdal.Open(mask)
-    nodata = rmask.GetRasterBand(1).GetNoDataValue()
-    mask_arr = np.array(rmask.GetRasterBand(1).ReadAsArray())
-    nodata_mask = mask_arr == nodata
-
-    raster = gdal.Open(name, gdal.GA_Update)
-    band = raster.GetRasterBand(1)
-    raster_arr = np.array(band.ReadAsArray())
-    out_arr = np.where(nodata_mask == True, nodata, raster_arr) # noqa E712
-    band.WriteArray(out_arr)
-    band.SetNoDataValue(nodata)
+    with rasterio.open(mask) as rmask:
+        nodata = rmask.nodata
+    # Every block is read (by a worker) before it is re-written here so
+    # updating the raster in-place is safe.
+    windows = raster_utils.block_windows(name)
+    with rasterio.open(name, "r+") as dst:
+        for window, data in raster_utils.map_blocks(
+            _mask_block, [name, mask], windows, jobs=jobs
+        ):
+            dst.write(data, 1, window=window)
+        dst.nodata = nodata
 
 
 def areg(data, mask, nodata, offset, low, high):
@@ -257,10 +268,115 @@ def areg(data, mask, nodata, offset, low, high):
     return
 
 
-def regularize(src_fn, dst_fn, src_band=1, offset=1.0, low=0.0, high=1):
+def _log_range_block(sources, window, bidx, offset):
+    data = sources[0].read(bidx, window=window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        valid = np.log(data[data != sources[0].nodatavals[bidx - 1]] + offset)
+    if valid.size == 0:
+        return None
+    return valid.min(), valid.max()
+
+
+def _regularize_block(sources, window, bidx, offset, low, high, X_min, X_max):
+    nodata = sources[0].nodatavals[bidx - 1]
+    data = sources[0].read(bidx, window=window)
+    mask = data == nodata
+    with np.errstate(invalid="ignore", divide="ignore"):
+        X = np.log(data + offset)
+    X_std = (X - X_min) / (X_max - X_min)
+    scaled = X_std * (high - low) + low
+    return np.stack((np.where(mask, nodata, scaled), np.where(mask, nodata, X)))
+
+
+def _regularize_blocks(src_fn, dst_fn, bidx, offset, low, high, jobs):
+    """
+    Block-streaming version of regularize().  Makes two passes over the
+    source band.  The first computes the min and max of log(x + offset)
+    over the non-NoData cells; the second scales each block and writes
+    both output bands.  Peak memory is bounded by the block size (times
+    the number of blocks in flight).
+
+    The arithmetic is done element-wise exactly as in the in-memory path
+    so the output is bit-identical.
+    """
+
+    with rasterio.open(src_fn) as src:
+        meta = src.meta.copy()
+        nodata = src.nodatavals[bidx - 1]
+    meta.update(
+        {
+            "driver": "GTiff",
+            "count": 2,
+            "dtype": "float32",
+            "nodata": nodata,
+            "compress": "lzw",
+            "predictor": 3,
+        }
+    )
+    windows = raster_utils.row_windows(src_fn, bidx)
+
+    X_min = X_max = None
+    for _, minmax in raster_utils.map_blocks(
+        _log_range_block, [src_fn], windows, (bidx, offset), jobs
+    ):
+        if minmax is None:
+            continue
+        if X_min is None:
+            X_min, X_max = minmax
+        else:
+            X_min = min(X_min, minmax[0])
+            X_max = max(X_max, minmax[1])
+    if X_min is None:
+        raise RuntimeError("source raster has no valid data")
+
+    with rasterio.open(dst_fn, "w", **meta) as dst:
+        for window, data in raster_utils.map_blocks(
+            _regularize_block,
+            [src_fn],
+            windows,
+            (bidx, offset, low, high, X_min, X_max),
+            jobs,
+        ):
+            dst.write(data.astype("float32"), window=window)
+
+
+def regularize(
+    src_fn,
+    dst_fn,
+    src_band=1,
+    offset=1.0,
+    low=0.0,
+    high=1,
+    streaming=True,
+    jobs=None,
+):
+    """
+    Scale a raster to [low, high] in log space, i.e. compute
+    log(x + offset) and linearly map its range to [low, high].  NoData
+    cells are preserved.
+
+    @param src_fn     file name of input raster
+    @param dst_fn     file name of output raster; band 1 holds the scaled
+                      values and band 2 the (unscaled) log values.  If
+                      None the scaled array is returned instead.
+    @param src_band   band of input raster to process
+    @param offset     offset added before taking the log
+    @param low        low end of output range
+    @param high       high end of output range
+    @param streaming  process the raster one block at a time (in two
+                      passes) rather than reading it all into memory.
+                      Ignored when dst_fn is None.
+    @param jobs       number of parallel workers used when streaming
+                      (default: see raster_utils.map_blocks)
+    """
+
     src_ds = gdal.Open(src_fn)
     if src_ds is None:
         raise RuntimeError("Error: could not open raster file '%s'" % src_fn)
+    if dst_fn is not None and streaming:
+        src_ds = None
+        _regularize_blocks(src_fn, dst_fn, src_band, offset, low, high, jobs)
+        return
     if dst_fn is not None:
         geotiff = gdal.GetDriverByName("GTiff")
         if geotiff is None:
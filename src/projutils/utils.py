@@ -80,6 +80,21 @@ def data_root():
     return os.path.abspath(dr)
 
 
+def cache_dir(*args):
+    """Returns the directory where to keep (re-computable) cached data.
+    Defaults to ~/.cache/projutils unless PROJUTILS_CACHE is set.  Any
+    arguments are appended as a path.  The directory is created if
+    needed.
+
+    """
+    root = os.environ.get(
+        "PROJUTILS_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "projutils")
+    )
+    path = os.path.join(os.path.abspath(root), *args)
+    mkpath(path)
+    return path
+
+
 def data_file(*args):
     """Return the name of an data file as a string.  It creates a path by joining all the argument with DATA_ROOT prepended."""
     return os.path.join(data_root(), *args)
@@ -228,21 +243,31 @@ def hyde_variables():
 def hyde_raw(version, year, variable):
     if year < 0:
         suffix = "bc"
-        year *= -1
     else:
         suffix = "ad"
     if version == "32":
         suffix = suffix.upper()
         p = os.path.join(
-            data_root(), "hyde" + version, "baseline", "%d%s_pop.zip" % (year, suffix)
+            data_root(),
+            "hyde" + version,
+            "baseline",
+            "%d%s_pop.zip" % (abs(year), suffix),
         )
     else:
-        p = os.path.join(data_root(), "hyde" + version, "%d%s_pop.zip" % (year, suffix))
+        p = os.path.join(
+            data_root(), "hyde" + version, "%d%s_pop.zip" % (abs(year), suffix)
+        )
     if variable:
-        return "zip:" + p + "!%s_%d%s.asc" % (variable, year, suffix.upper())
+        return "zip:" + p + "!" + hyde_member(year, variable)
     return p
 
 
+def hyde_member(year, variable):
+    """Name of the ASCII grid of a variable inside a HYDE year archive."""
+    suffix = "BC" if year < 0 else "AD"
+    return "%s_%d%s.asc" % (variable, abs(year), suffix)
+
+
 def run(cmd, sem=None):
     try:
         if sem is None:
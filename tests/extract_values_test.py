@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+from projutils.scripts.extract_values import fieldNames, uniqueFieldNames
+
+
+def _info(path, bands=1):
+    name = path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    return SimpleNamespace(fileName=path, fileBaseName=name, bands=bands)
+
+
+def test_unique_field_names():
+    infos = [_info("a/popdensity.tif"), _info("b/popdensity.tif"),
+             _info("a/landuse.tif", 2), _info("b/landuse.tif", 2)]
+    names = uniqueFieldNames(infos)
+    assert len(names) == 6
+    shorts = [short for short, _ in names]
+    longs = [long for _, long in names]
+    assert len(set(shorts)) == 6
+    assert len(set(longs)) == 6
+    assert all(len(short) <= 10 for short in shorts)
+    assert longs[:2] == ["popdensity", "popdensity_2"]
+    assert shorts[:2] == ["popdensity", "popdensi_2"]
+    assert longs[2:] == ["landuse0", "landuse1", "landuse0_2", "landuse1_2"]
+    return
+
+
+def test_field_names_multiband():
+    # Shapefile fields number bands from 1, CSV / Parquet columns keep
+    # the names of the old CSV header (numbered from 0).
+    assert fieldNames(_info("a/landcover_2015.tif", 3)) == [
+        ("landcove1", "landcover_20150"),
+        ("landcove2", "landcover_20151"),
+        ("landcove3", "landcover_20152"),
+    ]
+    assert fieldNames(_info("a/popdensity.tif")) == [("popdensity", "popdensity")]
+    return
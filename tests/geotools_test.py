@@ -0,0 +1,47 @@
+import numpy as np
+
+from projutils.geotools import GeoLocation, GeoLocations, vincenty
+
+
+def test_geolocations_distance():
+    lats = np.array([26.062951, -33.9, 51.5])
+    lons = np.array([-80.238853, 151.2, -0.12])
+    locs = GeoLocations.from_degrees(lats, lons)
+    other = GeoLocation.from_degrees(26.060484, -80.207268)
+    expected = [GeoLocation.from_degrees(lat, lon).distance_to(other)
+                for lat, lon in zip(lats, lons)]
+    assert np.allclose(locs.distance_to(other), expected)
+    assert np.allclose(locs.distance_to(other, formula=vincenty), expected)
+    matrix = locs.distance_matrix(locs)
+    assert matrix.shape == (3, 3)
+    assert np.allclose(matrix, matrix.T)
+    assert np.allclose(np.diag(matrix), 0)
+    assert np.allclose(locs.distance_to(locs[::-1]), matrix[:, ::-1].diagonal())
+    return
+
+
+def test_geolocations_small_distance():
+    locs = GeoLocations.from_degrees([45.0], [7.0])
+    near = GeoLocations.from_degrees([45.0], [7.0 + 1e-9])
+    dist = locs.distance_to(near)[0]
+    expected = (np.radians(1e-9) * np.cos(np.radians(45.0))
+                * GeoLocation.EARTH_RADIUS)
+    assert np.isclose(dist, expected, rtol=1e-6)
+    assert np.isclose(locs.distance_to(near, formula=vincenty)[0], expected,
+                      rtol=1e-6)
+    return
+
+
+def test_geolocations_bounding_locations():
+    lats = np.array([26.062951, 60.5, 89.99])
+    lons = np.array([-80.238853, 179.9, 10.0])
+    dists = np.array([1, 20, 5])
+    SW, NE = GeoLocations.from_degrees(lats, lons).bounding_locations(dists)
+    for i in range(len(lats)):
+        sw, ne = GeoLocation.from_degrees(lats[i],
+                                          lons[i]).bounding_locations(dists[i])
+        assert np.isclose(SW.deg_lat[i], sw.deg_lat)
+        assert np.isclose(SW.deg_lon[i], sw.deg_lon)
+        assert np.isclose(NE.deg_lat[i], ne.deg_lat)
+        assert np.isclose(NE.deg_lon[i], ne.deg_lon)
+    return
@@ -0,0 +1,26 @@
+import numpy as np
+import shapely
+
+from projutils.geotools import GeoLocations
+from projutils.roads import groads
+
+
+def test_road_distance_km_high_latitude():
+    rng = np.random.default_rng(0)
+    left, top, res = 10.0, 85.0, 0.1
+    roads = np.zeros((150, 200), dtype=bool)
+    roads[rng.integers(0, 150, 12), rng.integers(0, 200, 12)] = True
+    dist = groads.road_distance(roads, left, top, res, "km")
+    assert dist.shape == roads.shape
+
+    # Roads as points at the centers of the road cells.
+    rows, cols = np.nonzero(roads)
+    tree = shapely.STRtree(
+        shapely.points(left + (cols + 0.5) * res, top - (rows + 0.5) * res)
+    )
+    lat, lon = np.meshgrid(top - (np.arange(150) + 0.5) * res,
+                           left + (np.arange(200) + 0.5) * res, indexing="ij")
+    sites = GeoLocations.from_degrees(lat.ravel(), lon.ravel())
+    expected = groads.geodesic_distance(tree, sites).reshape(dist.shape)
+    assert np.allclose(dist, expected, rtol=1e-6, atol=1e-6)
+    return
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from projutils.lu.compiler import compile_table
+
+TABLE = {
+    "primary": "gothr - gfvh1 - gfvh2",
+    "secondary": "max(gsecd - gfsh1 - gfsh2 - gfsh3, 0)",
+    "cropland": "gcrop",
+    "plantation_pri": "min(gothr, gfvh1 + gfvh2)",
+    "plantation_sec": "min(gsecd, gfsh1 + gfsh2 + gfsh3)",
+    "timber": 0,
+}
+
+
+def test_compile_table():
+    table = compile_table(TABLE)
+    assert table.inputs == sorted(["gothr", "gfvh1", "gfvh2", "gsecd", "gfsh1",
+                                   "gfsh2", "gfsh3", "gcrop"])
+    # gfvh1 + gfvh2 and gfsh1 + gfsh2 + gfsh3 are computed once.
+    assert table.source.count("np.add") == 3
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(dict((name, rng.random(100)) for name in table.inputs))
+    out = table(df)
+    env = {"max": np.maximum, "min": np.minimum}
+    for name, expr in TABLE.items():
+        expected = eval(str(expr), env, dict((k, df[k].values) for k in df))
+        assert np.allclose(out[name], expected)
+    assert table(df, out=out) is out
+    return
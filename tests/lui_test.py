@@ -1,7 +1,13 @@
+import os
+import time
+
 import numpy as np
+import numpy.ma as ma
 import pandas as pd
+import pytest
 
-from projutils.lui import LUI
+from projutils import utils
+from projutils.lui import LUI, Intensities, evaluate, finish
 
 def test_lui_base():
     hpd = np.arange(0, 11, 0.1, dtype="float32")
@@ -66,3 +72,128 @@ def test_lui_sum():
                              "crop_light": crop_light})
     assert np.allclose(crop, crop_int + crop_light + crop_min)
     return
+
+
+class _Model(object):
+    """Stand-in for a lui model: intense and light are finish()ed from a
+    scaled hpd (NaN where hpd > 5), minimal is what is left."""
+
+    def __init__(self, name="crop", intensity="light"):
+        self._name = name
+        self.intensity = intensity
+        self.name = name + "_" + intensity
+        self.inputs = [name, "hpd"] + {"intense": [],
+                                       "light": [name + "_intense"],
+                                       "minimal": [name + "_intense",
+                                                   name + "_light"]}[intensity]
+
+    def eval(self, df):
+        name = self._name
+        if self.intensity == "minimal":
+            return df[name] - df[name + "_intense"] - df[name + "_light"]
+        scale = 0.1 if self.intensity == "intense" else 0.2
+        # A Series (read-only values under Copy-on-Write) for DataFrames.
+        res = df["hpd"] * scale + np.where(df["hpd"] > 5, np.nan, 0)
+        intense = df[name + "_intense"] if self.intensity == "light" else None
+        return finish(res, df[name], intense=intense)
+
+
+def test_evaluate_blocks():
+    shape = (100, 30)
+    df = {"crop": np.random.rand(*shape),
+          "hpd": np.random.rand(*shape) * 10,
+          "crop_intense": np.random.rand(*shape) * 0.5}
+    model = _Model()
+    expected = model.eval(df)
+    assert np.array_equal(evaluate(model, df, rows=7, jobs=3), expected)
+    masked = dict((k, ma.masked_less(v, 0.05)) for k, v in df.items())
+    res = evaluate(model, masked, rows=16, jobs=2)
+    assert ma.isMaskedArray(res)
+    assert ma.allequal(res, model.eval(masked))
+    assert np.array_equal(res.mask, ma.getmaskarray(model.eval(masked)))
+    frame = pd.DataFrame(dict((k, v.ravel()) for k, v in df.items()))
+    copy = frame.copy()
+    res = evaluate(model, frame, rows=256, jobs=3)
+    assert np.array_equal(res, expected.ravel())
+    assert np.array_equal(model.eval(frame), expected.ravel())
+    assert frame.equals(copy)
+    return
+
+
+def test_intensities():
+    shape = (50, 20)
+    df = {"crop": np.random.rand(*shape),
+          "hpd": np.random.rand(*shape) * 10}
+    combined = Intensities(_Model, "crop")
+    assert combined.inputs == ["crop", "hpd"]
+    intense = _Model("crop", "intense").eval(df)
+    light = _Model("crop", "light").eval(dict(df, crop_intense=intense))
+    minimal = _Model("crop", "minimal").eval(dict(df, crop_intense=intense,
+                                                  crop_light=light))
+    out = dict((k, np.empty(shape)) for k in ("intense", "light", "minimal"))
+    res = evaluate(combined, df, rows=8, jobs=2, out=out)
+    for key, expected in (("intense", intense), ("light", light),
+                          ("minimal", minimal)):
+        assert res[key] is out[key]
+        assert np.array_equal(res[key], expected)
+    assert np.allclose(df["crop"], intense + light + minimal)
+    return
+
+
+# A generated model module (as written by the model compiler).
+_GENERATED = """
+import numpy as np
+
+def inputs():
+    return ["gencrop", "hpd", "unSub"]
+
+def intense(gencrop, hpd, unSub):
+    res = 1 / (1 + np.exp(-(0.3 * hpd - 0.1 * unSub - 1)))
+    return np.where(hpd > 9, np.nan, res)
+
+def light(gencrop, hpd, unSub):
+    return 1 / (1 + np.exp(-(0.5 - 0.2 * hpd + 0.05 * unSub)))
+"""
+
+
+@pytest.fixture
+def model_dir(monkeypatch, tmp_path):
+    models = tmp_path / "lui_models"
+    models.mkdir()
+    (models / "gencrop.rds").write_text("")
+    (models / "gencrop.py").write_text(_GENERATED)
+    stamp = time.time()
+    os.utime(models / "gencrop.rds", (stamp - 10, stamp - 10))
+    monkeypatch.setenv("DATA_ROOT", str(tmp_path))
+    monkeypatch.syspath_prepend(str(models))
+    utils.data_root.clear()
+    yield models
+    utils.data_root.clear()
+
+
+def test_evaluate_lui_end_to_end(model_dir):
+    shape = (90, 40)
+    rng = np.random.default_rng(1)
+    df = {"crop": ma.masked_greater(rng.random(shape), 0.95),
+          "hpd": rng.random(shape).astype("float32") * 10,
+          "unSub": np.full(shape, 5, dtype="float32")}
+    models = [LUI("crop", intensity, "gencrop")
+              for intensity in ("intense", "light", "minimal")]
+    # Evaluating every model on the full maps, in turn.
+    expected = {}
+    layers = dict(df)
+    for model in models:
+        expected[model.intensity] = model.eval(layers)
+        layers[model.name] = expected[model.intensity]
+    combined = Intensities(LUI, "crop", "gencrop")
+    assert sorted(combined.inputs) == ["crop", "hpd", "unSub"]
+    res = evaluate(combined, df, rows=16, jobs=3)
+    for intensity, value in expected.items():
+        assert ma.allequal(res[intensity], value)
+        assert np.array_equal(ma.getmaskarray(res[intensity]),
+                              ma.getmaskarray(value))
+    light = evaluate(models[1], layers, rows=7, jobs=2)
+    assert ma.allequal(light, expected["light"])
+    assert ma.allclose(df["crop"], res["intense"] + res["light"] +
+                       res["minimal"])
+    return
@@ -0,0 +1,28 @@
+import numpy as np
+import numpy.ma as ma
+from affine import Affine
+from netCDF4 import Dataset
+
+from projutils import nc_utils
+
+
+def test_step_writer(tmp_path):
+    xform = Affine(1, 0, -180, 0, -1, 90)
+    fname = str(tmp_path / "test.nc")
+    with Dataset(fname, "w") as ds:
+        variables = nc_utils.init_nc(ds, xform, 360, 180, list(range(10)),
+                                     [("var", "f4", "1", -9999)],
+                                     chunks=nc_utils.chunk_shape(180, 360, 4))
+        assert variables["var"].chunking() == [4, 180, 360]
+        with nc_utils.StepWriter(variables) as writer:
+            for step in (0, 1, 2, 3, 5, 4, 8):
+                writer.write_step("var", step, np.full((180, 360), step, "f4"))
+    with Dataset(fname) as ds:
+        data = ds.variables["var"][:]
+        assert data.shape == (10, 180, 360)
+        for step in (0, 1, 2, 3, 4, 5, 8):
+            assert np.all(data[step] == step)
+        assert ma.getmaskarray(data[6]).all()
+        assert ma.getmaskarray(data[7]).all()
+        assert np.allclose(ds.variables["lat"][[0, -1]], [89.5, -89.5])
+    return
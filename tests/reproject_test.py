@@ -0,0 +1,67 @@
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import Resampling
+
+from projutils.reproject import reproject, reproject_to
+
+
+def test_reproject_nan_nodata(tmp_path):
+    data = np.arange(2 * 8 * 8, dtype="float32").reshape(2, 8, 8)
+    data[:, :4, :4] = np.nan
+    data[1, 6:, 6:] = -9999
+    path = str(tmp_path / "nan.tif")
+    with rasterio.open(path, "w", driver="GTiff", width=8, height=8, count=2,
+                       dtype="float32", crs="epsg:4326", nodata=np.nan,
+                       transform=from_origin(0, 8, 1, 1)) as dst:
+        dst.write(data)
+    meta, out = reproject(path, None, 2, Resampling.nearest, num_threads=1)
+    assert out.shape == (2, 4, 4)
+    assert np.array_equal(out.mask, np.isnan(out.data))
+    assert out.mask[:, :2, :2].all()
+    assert out[:, 2:, :2].count() == 2 * 4
+    assert out[1, 3, 3] == -9999
+    return
+
+
+def _write(path, data, nodata):
+    with rasterio.open(path, "w", driver="GTiff", width=data.shape[2],
+                       height=data.shape[1], count=data.shape[0],
+                       dtype=data.dtype, crs="epsg:4326", nodata=nodata,
+                       transform=from_origin(0, data.shape[1], 1, 1)) as dst:
+        dst.write(data)
+    return path
+
+
+def test_reproject_chunks(tmp_path):
+    data = np.arange(5 * 8 * 8, dtype="float32").reshape(5, 8, 8)
+    data[:, :2, :2] = -9999
+    # Close to (but not exactly) nodata: masked like ma.masked_values().
+    data[2, 7, 7] = -9999.001
+    path = _write(str(tmp_path / "bands.tif"), data, -9999)
+    _, whole = reproject(path, None, 2, Resampling.nearest, chunk=5)
+    _, chunked = reproject(path, None, 2, Resampling.nearest, chunk=2)
+    assert np.array_equal(whole.mask, chunked.mask)
+    assert np.array_equal(whole.filled(0), chunked.filled(0))
+    assert whole.mask[:, 0, 0].all()
+    assert whole.mask[2, 3, 3] and not whole.mask[1, 3, 3]
+    _, some = reproject(path, [2, 4], 2, Resampling.nearest, chunk=1)
+    assert some.mask[[0, 2, 4]].all()
+    assert np.array_equal(some[[1, 3]].filled(0), whole[[1, 3]].filled(0))
+    return
+
+
+def test_reproject_to(tmp_path):
+    data = np.arange(3 * 8 * 8, dtype="float32").reshape(3, 8, 8)
+    data[:, :4, :4] = -9999
+    path = _write(str(tmp_path / "src.tif"), data, -9999)
+    dst_fn = str(tmp_path / "dst.tif")
+    meta = reproject_to(path, dst_fn, 2, Resampling.nearest, rows=1)
+    _, expected = reproject(path, None, 2, Resampling.nearest)
+    with rasterio.open(dst_fn) as ds:
+        assert (ds.count, ds.height, ds.width) == (3, 4, 4)
+        assert ds.transform == meta["transform"]
+        out = ds.read(masked=True)
+    assert np.array_equal(out.mask, expected.mask)
+    assert np.array_equal(out.filled(0), expected.filled(0))
+    return
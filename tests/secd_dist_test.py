@@ -0,0 +1,122 @@
+import importlib.util
+import os
+
+import numpy as np
+import numpy.ma as ma
+import pytest
+
+from projutils import utils
+
+SCRIPT = os.path.join(
+    os.path.dirname(__file__), "..", "src", "projutils", "scripts", "secd-dist.py"
+)
+
+
+@pytest.fixture
+def secd(monkeypatch, tmp_path):
+    # The command line options list the LUH2 scenarios found in DATA_ROOT
+    # (data_root() is memoized: don't leak it to other tests).
+    (tmp_path / "luh2_v2").mkdir()
+    monkeypatch.setenv("DATA_ROOT", str(tmp_path))
+    utils.data_root.clear()
+    spec = importlib.util.spec_from_file_location("secd_dist", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    utils.data_root.clear()
+
+
+def random_bins(rng, shape):
+    data = rng.random(shape).astype("f4")
+    # Per bin masks: some cells masked in every bin, some in a few.
+    mask = rng.random(shape) < 0.3
+    mask[:, 0, 0] = True
+    mask[:, 0, 1] = False
+    return ma.array(data, mask=mask, fill_value=-9999)
+
+
+def test_age_bins_sum_mixed_masks(secd):
+    rng = np.random.default_rng(3)
+    cube = random_bins(rng, (secd.BINS, 4, 5))
+    bins = secd.AgeBins(cube.copy(), head=7)
+    out = ma.empty_like(cube[0])
+    for start, stop in ((0, 30), (30, 50), (0, secd.BINS - 2)):
+        expected = np.roll(cube, -7, axis=0)[start:stop].sum(axis=0)
+        got = bins.sum(start, stop, out)
+        assert np.array_equal(ma.getmaskarray(got), ma.getmaskarray(expected))
+        assert np.array_equal(got.filled(-1), expected.filled(-1))
+    assert ma.getmaskarray(got)[0, 0]
+    assert not ma.getmaskarray(got)[0, 1]
+
+
+def test_age_bins_age_mixed_masks(secd):
+    rng = np.random.default_rng(5)
+    cube = random_bins(rng, (secd.BINS, 4, 5))
+    bins = secd.AgeBins(cube.copy())
+    # The old implementation: sum the bins with ma.sum() and roll the cube.
+    expected = cube.copy()
+    for _ in range(3):
+        bins.age()
+        expected[-3] += expected[-2]
+        expected[-2] = expected[0:-2].sum(axis=0)
+        expected = np.roll(expected, 1, axis=0)
+    got = ma.array([bins[idx] for idx in range(len(bins))])
+    assert np.array_equal(ma.getmaskarray(got), ma.getmaskarray(expected))
+    assert np.array_equal(got.filled(-1), expected.filled(-1))
+
+
+class Variables(object):
+    def __init__(self, variables):
+        self.variables = variables
+
+
+def test_year_loader_masks_reset_every_year(secd):
+    rng = np.random.default_rng(7)
+    years, shape = 4, (4, 5)
+    # The masks of the transitions change from year to year.
+    trans = Variables(
+        dict(
+            (name, random_bins(rng, (years,) + shape))
+            for name in ("a_to_secdf", "secdf_to_b", "c_to_secdf", "secdf_to_d")
+        )
+    )
+    state = Variables({"secdf": random_bins(rng, (years,) + shape)})
+    groups = {
+        "posf": ("a_to_secdf", "c_to_secdf"),
+        "negf": ("secdf_to_b", "c_to_secdf", "secdf_to_d"),
+    }
+    template = ma.zeros(shape, dtype="f4")
+    template.mask = rng.random(shape) < 0.2
+    loader = secd.YearLoader(trans, state, groups, ("secdf",), range(years), template)
+    count = 0
+    for idx, sums, states in loader:
+        for group, names in groups.items():
+            # The old implementation: sum the layers into a buffer masked
+            # like the template.
+            expected = ma.empty_like(template)
+            expected.fill(0)
+            for name in names:
+                expected += trans.variables[name][idx]
+            assert np.array_equal(
+                ma.getmaskarray(sums[group]), ma.getmaskarray(expected)
+            )
+            assert np.array_equal(sums[group].filled(-1), expected.filled(-1))
+        assert np.array_equal(
+            states["secdf"].filled(-1), state.variables["secdf"][idx].filled(-1)
+        )
+        count += 1
+    assert count == years
+
+
+def test_age_bins_put_keeps_mask(secd):
+    rng = np.random.default_rng(11)
+    cube = random_bins(rng, (secd.BINS, 4, 5))
+    bins = secd.AgeBins(cube.copy(), head=3)
+    value = random_bins(rng, (1, 4, 5))[0]
+    # The old implementation: sum the value in place into the bin.
+    expected = cube[3].copy()
+    expected.fill(0)
+    expected += value
+    bins.put(0, value)
+    assert np.array_equal(ma.getmaskarray(bins[0]), ma.getmaskarray(expected))
+    assert np.array_equal(bins[0].filled(-1), expected.filled(-1))
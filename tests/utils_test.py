@@ -0,0 +1,12 @@
+from projutils import utils
+
+
+def test_hyde_raw_bc_year(monkeypatch):
+    monkeypatch.setenv("DATA_ROOT", "/data")
+    assert utils.hyde_raw("32", -1000, "popc") == (
+        "zip:/data/hyde32/baseline/1000BC_pop.zip!popc_1000BC.asc"
+    )
+    assert utils.hyde_raw("31", 1950, "popc") == (
+        "zip:/data/hyde31/1950ad_pop.zip!popc_1950AD.asc"
+    )
+    return